@@ -0,0 +1,192 @@
+import asyncio
+import math
+from collections import deque
+from typing import Dict, Iterable, Optional
+
+from fastapi.responses import JSONResponse
+
+from metrics import ADMISSION_IN_FLIGHT, ADMISSION_BYTES, ADMISSION_QUEUE, ADMISSION_REJECTED
+
+
+class Overloaded(Exception):
+    def __init__(self, status_code: int, reason: str, detail: str, retry_after: Optional[int]):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.reason = reason
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class BodyTooLarge(Exception):
+    """Raised from the wrapped receive once a body outgrows what was reserved for it."""
+
+
+class AdmissionController:
+    """
+    Bounds the analysis work in flight: at most max_requests requests and
+    max_bytes of upload bodies at once. A request that does not fit waits in a
+    FIFO queue of at most max_queue entries for up to queue_timeout seconds:
+
+        queue full          429, Retry-After
+        waited too long     503, Retry-After
+        larger than max     413 (it would never fit)
+
+    Runs on the event loop only, so no locking is needed.
+    """
+
+    def __init__(self, max_requests: int = 8, max_bytes: int = 512 * 1024 * 1024, max_queue: int = 16,
+                 queue_timeout: float = 10.0, retry_after: int = 5):
+        self.max_requests = max_requests
+        self.max_bytes = max_bytes
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._active = 0
+        self._bytes = 0
+        self._waiters = deque()       # (n_bytes, future) in arrival order
+        self.counters = {"admitted": 0, "queued": 0, "queue_full": 0, "queue_timeout": 0, "too_large": 0}
+
+    def _fits(self, n_bytes: int) -> bool:
+        return self._active < self.max_requests and self._bytes + n_bytes <= self.max_bytes
+
+    def _take(self, n_bytes: int) -> None:
+        self._active += 1
+        self._bytes += n_bytes
+        self.counters["admitted"] += 1
+        ADMISSION_IN_FLIGHT.inc()
+        ADMISSION_BYTES.inc(n_bytes)
+
+    def _reject(self, status_code: int, reason: str, detail: str, retry: bool = True) -> Overloaded:
+        self.counters[reason] += 1
+        ADMISSION_REJECTED.inc(1, reason)
+        return Overloaded(status_code, reason, detail, self._retry_after() if retry else None)
+
+    def _retry_after(self) -> int:
+        # One interval per full round of queued work ahead of the caller
+        rounds = 1 + len(self._waiters) // max(self.max_requests, 1)
+        return int(math.ceil(self.retry_after * rounds))
+
+    async def acquire(self, n_bytes: int) -> None:
+        """Admit a request declaring n_bytes of body, waiting in the queue if needed. Raises Overloaded."""
+        if n_bytes > self.max_bytes:
+            raise self._reject(413, "too_large", f"Upload of {n_bytes} bytes exceeds the {self.max_bytes} byte limit",
+                               retry=False)
+        if not self._waiters and self._fits(n_bytes):
+            self._take(n_bytes)
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise self._reject(429, "queue_full", "Too many analyses in progress; retry later")
+
+        entry = (n_bytes, asyncio.get_running_loop().create_future())
+        self._waiters.append(entry)
+        self.counters["queued"] += 1
+        ADMISSION_QUEUE.inc()
+        try:
+            done, _ = await asyncio.wait({entry[1]}, timeout=self.queue_timeout)
+        except asyncio.CancelledError:
+            # Client went away; give back the slot if it was granted meanwhile
+            self._leave(entry)
+            raise
+        if not done:
+            self._leave(entry)
+            raise self._reject(503, "queue_timeout", "Server busy; retry later")
+        ADMISSION_QUEUE.dec()
+
+    def _leave(self, entry) -> None:
+        n_bytes, future = entry
+        ADMISSION_QUEUE.dec()
+        if future.done():
+            self.release(n_bytes)
+        else:
+            future.cancel()
+            self._waiters.remove(entry)
+
+    def release(self, n_bytes: int) -> None:
+        self._active -= 1
+        self._bytes -= n_bytes
+        ADMISSION_IN_FLIGHT.dec()
+        ADMISSION_BYTES.dec(n_bytes)
+        # Wake waiters in order while they fit; a large upload at the head is not overtaken
+        while self._waiters and self._fits(self._waiters[0][0]):
+            n, future = self._waiters.popleft()
+            self._take(n)
+            future.set_result(None)
+
+    def stats(self) -> Dict:
+        return {
+            **self.counters,
+            "in_flight":       self._active,
+            "bytes_in_flight": self._bytes,
+            "queue_depth":     len(self._waiters),
+            "max_requests":    self.max_requests,
+            "max_bytes":       self.max_bytes,
+            "max_queue":       self.max_queue
+        }
+
+
+class AdmissionMiddleware:
+    """
+    Plain ASGI middleware that admits POSTs to the analysis paths before their
+    body is read, so a burst of uploads is shed instead of being buffered.
+    The declared Content-Length is reserved until the response has been sent;
+    a body without one reserves an equal share of the byte limit. The body
+    actually received is counted, and one that outgrows its reservation
+    (chunked, or an understated Content-Length) is answered with 413.
+    """
+
+    def __init__(self, app, controller: AdmissionController, paths: Iterable[str]):
+        self.app = app
+        self.controller = controller
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope: Dict, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+
+        declared = dict(scope["headers"]).get(b"content-length")
+        n_bytes = int(declared) if declared and declared.isdigit() else \
+            self.controller.max_bytes // max(self.controller.max_requests, 1)
+        try:
+            await self.controller.acquire(n_bytes)
+        except Overloaded as e:
+            return await self._respond(e, scope, receive, send)
+
+        received = 0
+        started = False
+        exceeded = None
+
+        async def counting_receive():
+            nonlocal received, exceeded
+            if exceeded is not None:
+                raise BodyTooLarge(exceeded.detail)
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > n_bytes:
+                    exceeded = self.controller._reject(
+                        413, "too_large", f"Upload body exceeds the {n_bytes} bytes reserved for it", retry=False)
+                    raise BodyTooLarge(exceeded.detail)
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            if exceeded is not None and not started:
+                return      # whatever the app makes of the aborted body is replaced by the 413 below
+            started = True
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, guarded_send)
+        except BodyTooLarge:
+            if started:
+                raise       # too late for a 413; let the server drop the connection
+        finally:
+            self.controller.release(n_bytes)
+        if exceeded is not None and not started:
+            await self._respond(exceeded, scope, receive, send)
+
+    @staticmethod
+    async def _respond(e: Overloaded, scope: Dict, receive, send) -> None:
+        headers = {"Retry-After": str(e.retry_after)} if e.retry_after is not None else None
+        response = JSONResponse({"detail": e.detail}, status_code=e.status_code, headers=headers)
+        await response(scope, receive, send)
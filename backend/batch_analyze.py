@@ -0,0 +1,167 @@
+"""
+Offline batch analysis: a directory (or manifest) of VCFs -> JSONL results.
+
+Runs the same pipeline as POST /analyze/batch without HTTP. Files are parsed and
+evaluated on a process pool and explained in this process; each finished file
+is appended to the output as one line, {"file", "results"} or {"file", "error"}:
+
+    python batch_analyze.py /data/vcfs --drugs CODEINE,WARFARIN --output results.jsonl
+
+The output doubles as the checkpoint: re-running with the same --output skips
+every file already in it, so an interrupted run picks up where it stopped.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import List, Set
+
+from llm_explainer import close_client
+from pipeline import evaluate_file, results_for_file
+
+VCF_SUFFIXES = (".vcf", ".vcf.gz")
+
+
+def find_inputs(source: str) -> List[str]:
+    """Every VCF under a directory, or the paths listed in a manifest file (one per line)."""
+    if os.path.isdir(source):
+        paths = []
+        for root, _dirs, files in os.walk(source):
+            paths.extend(os.path.join(root, name) for name in files if name.endswith(VCF_SUFFIXES))
+        return sorted(paths)
+    if source.endswith(VCF_SUFFIXES):
+        return [source]
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source) as f:
+        lines = [line.strip() for line in f]
+    return [p if os.path.isabs(p) else os.path.join(base, p) for p in lines if p and not p.startswith("#")]
+
+
+def load_checkpoint(output: str) -> Set[str]:
+    """
+    Files already written to output. A partially written last line (from an
+    interrupted run) is truncated away so the file stays valid JSONL.
+    """
+    done = set()
+    if not os.path.exists(output):
+        return done
+    with open(output, "rb+") as f:
+        valid = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                done.add(json.loads(line)["file"])
+            except (ValueError, KeyError):
+                break
+            valid += len(line)
+        f.truncate(valid)
+    return done
+
+
+class Progress:
+    """Throughput and ETA on stderr, redrawn at most twice a second."""
+
+    def __init__(self, total: int, total_bytes: int):
+        self.total = total
+        self.total_bytes = total_bytes
+        self.done = 0
+        self.failed = 0
+        self.bytes = 0
+        self.start = time.time()
+        self._drawn = 0.0
+
+    def update(self, n_bytes: int, failed: bool) -> None:
+        self.done += 1
+        self.failed += failed
+        self.bytes += n_bytes
+        now = time.time()
+        if now - self._drawn >= 0.5 or self.done == self.total:
+            self._drawn = now
+            self.draw(now)
+
+    def draw(self, now: float) -> None:
+        elapsed = max(now - self.start, 1e-9)
+        rate = self.done / elapsed
+        remaining = (self.total_bytes - self.bytes) / (self.bytes / elapsed) if self.bytes else 0
+        eta = time.strftime("%H:%M:%S", time.gmtime(remaining))
+        sys.stderr.write(f"\r[{self.done}/{self.total}] {rate:.1f} files/s  "
+                         f"{self.bytes / elapsed / (1024 * 1024):.1f} MB/s  "
+                         f"{self.failed} failed  ETA {eta} ")
+        sys.stderr.flush()
+
+
+async def run_batch(paths: List[str], drug_list: List[str], output: str, workers: int) -> Progress:
+    loop     = asyncio.get_running_loop()
+    sizes    = {path: os.path.getsize(path) if os.path.exists(path) else 0 for path in paths}
+    progress = Progress(len(paths), sum(sizes.values()))
+
+    async def process(pool, path):
+        start_time = time.time()
+        summary = await loop.run_in_executor(pool, evaluate_file, path, drug_list)
+        if "error" in summary:
+            return {"file": path, "error": summary["error"]}
+        return {"file": path, "results": await results_for_file(summary, start_time)}
+
+    # Spawned like the /analyze/batch workers, so neither path inherits SQLite handles or HTTP clients
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"))
+    with pool, open(output, "a", encoding="utf-8") as out:
+        queue   = iter(paths)
+        pending = set()
+        try:
+            while True:
+                # Keep every worker busy with one file queued behind it
+                while len(pending) < 2 * workers:
+                    path = next(queue, None)
+                    if path is None:
+                        break
+                    pending.add(asyncio.ensure_future(process(pool, path)))
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    record = task.result()
+                    out.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+                    out.flush()
+                    progress.update(sizes[record["file"]], "error" in record)
+        finally:
+            for task in pending:
+                task.cancel()
+            await close_client()
+    return progress
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze a directory or manifest of VCFs into JSONL results.")
+    parser.add_argument("source", help="Directory to walk for .vcf/.vcf.gz files, or a manifest listing one path per line")
+    parser.add_argument("--drugs", required=True, help="Comma-separated drug names, e.g. CODEINE,WARFARIN")
+    parser.add_argument("--output", default="results.jsonl", help="JSONL output and checkpoint (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Worker processes for parsing (default: %(default)s)")
+    args = parser.parse_args()
+
+    drug_list = [d.strip().upper() for d in args.drugs.split(",") if d.strip()]
+    paths     = find_inputs(args.source)
+    completed = load_checkpoint(args.output)
+    todo      = [p for p in paths if p not in completed]
+    print(f"{len(paths)} VCFs found, {len(paths) - len(todo)} already in {args.output}, {len(todo)} to process",
+          file=sys.stderr)
+    if not todo:
+        return
+
+    try:
+        progress = asyncio.run(run_batch(todo, drug_list, args.output, args.workers))
+    except KeyboardInterrupt:
+        print(f"\nInterrupted; re-run the same command to resume from {args.output}", file=sys.stderr)
+        sys.exit(130)
+    elapsed = time.time() - progress.start
+    print(f"\nProcessed {progress.done} files ({progress.failed} failed) in {elapsed:.1f}s "
+          f"({progress.done / max(elapsed, 1e-9):.1f} files/s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
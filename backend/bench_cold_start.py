@@ -0,0 +1,139 @@
+"""
+Cold-start benchmark: time from launching the API process to its first answer.
+
+Each run starts a fresh `uvicorn main:app` (as render.yaml does) with the LLM
+disabled and measures, from the moment the process is spawned:
+
+    first_response   POST /analyze for every drug on a small synthetic VCF,
+                     retried until the server accepts the connection
+    ready            GET /ready returns 200 (background warm-up finished)
+
+The app's own import and warm-up times are taken from /ready. Results are
+written as JSON so runs can be compared across commits:
+
+    python bench_cold_start.py --runs 5 --output bench_cold_start.json
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict
+
+import httpx
+
+from bench_pipeline import _git_commit
+from synthetic_vcf import write_vcf
+
+DRUGS = "CODEINE,WARFARIN,CLOPIDOGREL,SIMVASTATIN,AZATHIOPRINE,FLUOROURACIL"
+POLL_SECONDS = 0.002
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def run_once(vcf_path: str, workdir: str, timeout: float) -> Dict:
+    port  = _free_port()
+    # Fresh stores per run, outside the working tree
+    state = tempfile.TemporaryDirectory(prefix="pharmaguard-bench-state-", dir=workdir)
+    env = {**os.environ, "GEMINI_API_KEY": "",
+           "EXPLANATION_CACHE_DB": os.path.join(state.name, "explanation_cache.sqlite3"),
+           "PATIENT_DB":           os.path.join(state.name, "patients.sqlite3")}
+    with open(vcf_path, "rb") as f:
+        vcf = f.read()
+    url = f"http://127.0.0.1:{port}"
+
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        with httpx.Client(timeout=timeout) as client:
+            while True:
+                if time.perf_counter() - started > timeout:
+                    raise TimeoutError(f"no response within {timeout}s")
+                try:
+                    response = client.post(f"{url}/analyze", files={"vcf_file": ("bench.vcf", vcf)},
+                                           data={"drugs": DRUGS})
+                    break
+                except httpx.TransportError:
+                    time.sleep(POLL_SECONDS)
+            first_response = time.perf_counter() - started
+            response.raise_for_status()
+
+            while True:
+                ready = client.get(f"{url}/ready")
+                if ready.status_code == 200:
+                    break
+                if time.perf_counter() - started > timeout:
+                    raise TimeoutError(f"not ready within {timeout}s")
+                time.sleep(POLL_SECONDS)
+            ready_at = time.perf_counter() - started
+            status = ready.json()
+    finally:
+        server.terminate()
+        server.wait()
+        state.cleanup()
+
+    return {
+        "first_response_s": round(first_response, 4),
+        "ready_s":          round(ready_at, 4),
+        "import_s":         status["import_seconds"],
+        "warmup_s":         status["warmup_seconds"]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark time to first /analyze response after a cold start.")
+    parser.add_argument("--runs", type=int, default=5, help="Cold starts to measure (default: %(default)s)")
+    parser.add_argument("--records", type=int, default=1000, help="Records in the first request's VCF (default: %(default)s)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Give up on a run after this many seconds")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "pharmaguard-bench"),
+                        help="Where the generated VCF is cached (default: %(default)s)")
+    parser.add_argument("--output", help="Write the JSON report here (default: print it)")
+    args = parser.parse_args()
+
+    os.makedirs(args.workdir, exist_ok=True)
+    vcf_path = os.path.join(args.workdir, f"synthetic_{args.records}r_1s_0.001d_0.0m.vcf")
+    if not os.path.exists(vcf_path):
+        write_vcf(vcf_path, args.records)
+
+    runs = []
+    for i in range(args.runs):
+        run = run_once(vcf_path, args.workdir, args.timeout)
+        runs.append(run)
+        print(f"run {i + 1}: first response {run['first_response_s']:.3f}s  ready {run['ready_s']:.3f}s  "
+              f"(import {run['import_s']:.3f}s, warm-up {run['warmup_s']:.3f}s)", flush=True)
+
+    report = {
+        "meta": {
+            "commit":    _git_commit(),
+            "python":    platform.python_version(),
+            "platform":  platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "created":   time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        },
+        "records": args.records,
+        "median":  {k: round(statistics.median(r[k] for r in runs), 4) for k in runs[0]},
+        "runs":    runs
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {len(runs)} runs to {args.output}")
+    else:
+        print(json.dumps(report["median"], indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""
+Benchmark suite for the parser and rule path on synthetic VCFs.
+
+For every combination of --records and --samples a deterministic VCF is generated
+(see synthetic_vcf.py) and each stage runs in a fresh process so its peak RSS is
+its own:
+
+    parse          VCFStreamParser over the file (pipeline.parse_vcf_path)
+    cohort_parse   CohortParser over the file (multi-sample inputs only)
+    extract        extract_pharmacogenomic_variants for every pharmacogene
+    phenotype      determine_phenotype + get_diplotype for every pharmacogene
+    analyze        POST /analyze end to end for all drugs, with the LLM stubbed
+
+Results are written as JSON so runs can be compared across commits:
+
+    python bench_pipeline.py --records 1000,100000,1000000 --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Dict, List
+
+from synthetic_vcf import write_vcf
+
+STAGES = ("parse", "cohort_parse", "extract", "phenotype", "analyze")
+
+STUB_EXPLANATION = {
+    "summary": "Benchmark stub.",
+    "mechanism_explanation": "Benchmark stub.",
+    "patient_friendly": "Benchmark stub.",
+    "clinical_significance": "Benchmark stub.",
+    "monitoring_parameters": "Benchmark stub.",
+    "alternative_drugs": "Benchmark stub."
+}
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _run_stage(stage: str, path: str, repeat: int) -> Dict:
+    """Run one stage in this (fresh) process and time it."""
+    # Keep the explanation path deterministic and every store out of the working tree;
+    # the directory goes away when this worker process exits
+    state = tempfile.TemporaryDirectory(prefix="pharmaguard-bench-state-")
+    os.environ["EXPLANATION_CACHE_DB"] = os.path.join(state.name, "explanation_cache.sqlite3")
+    os.environ["PATIENT_DB"] = os.path.join(state.name, "patients.sqlite3")
+    os.environ["EXPLANATION_TABLE"] = ""
+    import pipeline
+    from cpic_rules import PGX_GENES
+    from vcf_parser import extract_pharmacogenomic_variants, determine_phenotype, get_diplotype
+
+    baseline_rss = _peak_rss_mb()
+    if stage == "parse":
+        start = time.perf_counter()
+        pipeline.parse_vcf_path(path)
+        seconds = time.perf_counter() - start
+        calls = 1
+
+    elif stage == "cohort_parse":
+        from bgzf import GzipStreamDecoder
+        from cohort import CohortParser
+        parser  = CohortParser()
+        decoder = GzipStreamDecoder() if path.endswith(".gz") else None
+        start = time.perf_counter()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(pipeline.CHUNK_SIZE), b""):
+                for piece in decoder.decompress(chunk) if decoder else (chunk,):
+                    parser.feed(piece)
+        parser.close()
+        seconds = time.perf_counter() - start
+        calls = 1
+
+    elif stage in ("extract", "phenotype"):
+        parsed_vcf = pipeline.parse_vcf_path(path)
+        hits = {gene: extract_pharmacogenomic_variants(parsed_vcf, gene) for gene in PGX_GENES}
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for gene in PGX_GENES:
+                if stage == "extract":
+                    extract_pharmacogenomic_variants(parsed_vcf, gene)
+                else:
+                    determine_phenotype(hits[gene], gene)
+                    get_diplotype(hits[gene], gene)
+        seconds = time.perf_counter() - start
+        calls = repeat * len(PGX_GENES)
+
+    elif stage == "analyze":
+        import llm_explainer
+        from fastapi.testclient import TestClient
+        from cpic_rules import GENE_DRUG_RULES
+
+        import httpx
+        # Stub only the HTTP call, so prompt building, the breaker and reply parsing are all timed
+        posts = []
+
+        async def stub(payload):
+            posts.append(payload)
+            drugs = re.findall(r"^DRUG: (\S+)$", payload["contents"][0]["parts"][0]["text"], re.M)
+            reply = {drug: STUB_EXPLANATION for drug in drugs} if drugs else STUB_EXPLANATION
+            body  = {"candidates": [{"content": {"parts": [{"text": json.dumps(reply)}]}}]}
+            return httpx.Response(200, json=body)
+        llm_explainer._post = stub
+        llm_explainer.GEMINI_API_KEY = "benchmark-stub"
+
+        import main
+        with TestClient(main.app) as client, open(path, "rb") as f:
+            start = time.perf_counter()
+            response = client.post("/analyze", files={"vcf_file": (os.path.basename(path), f)},
+                                   data={"drugs": ",".join(GENE_DRUG_RULES)})
+            seconds = time.perf_counter() - start
+        response.raise_for_status()
+        fallbacks = [r["drug"] for r in response.json() if "fallback_reason" in r["llm_generated_explanation"]]
+        if not posts or fallbacks:
+            raise RuntimeError(f"LLM stub was bypassed ({len(posts)} calls, fallbacks for {fallbacks})")
+        calls = 1
+
+    else:
+        raise ValueError(f"Unknown stage '{stage}'")
+
+    return {"seconds": seconds, "calls": calls, "baseline_rss_mb": baseline_rss, "peak_rss_mb": _peak_rss_mb()}
+
+
+def run_isolated(stage: str, path: str, repeat: int) -> Dict:
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(_run_stage, stage, path, repeat).result()
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def run_suite(records: List[int], samples: List[int], stages: List[str], pgx_density: float,
+              missing_ids: float, gz: bool, repeat: int, workdir: str) -> Dict:
+    results = []
+    for n_records in records:
+        for n_samples in samples:
+            name = f"synthetic_{n_records}r_{n_samples}s_{pgx_density}d_{missing_ids}m.vcf" + (".gz" if gz else "")
+            path = os.path.join(workdir, name)
+            if not os.path.exists(path):
+                write_vcf(path, n_records, n_samples, pgx_density, missing_ids, gz)
+            size_mb = os.path.getsize(path) / (1024 * 1024)
+
+            for stage in stages:
+                if stage == "cohort_parse" and n_samples == 1:
+                    continue
+                measured = run_isolated(stage, path, repeat)
+                per_file = measured["seconds"] / measured["calls"] if stage in ("extract", "phenotype") else measured["seconds"]
+                row = {
+                    "stage":           stage,
+                    "records":         n_records,
+                    "samples":         n_samples,
+                    "pgx_density":     pgx_density,
+                    "missing_ids":     missing_ids,
+                    "gz":              gz,
+                    "file_mb":         round(size_mb, 3),
+                    "seconds":         round(measured["seconds"], 6),
+                    "calls":           measured["calls"],
+                    "baseline_rss_mb": measured["baseline_rss_mb"],
+                    "peak_rss_mb":     measured["peak_rss_mb"],
+                }
+                if stage in ("extract", "phenotype"):
+                    row["us_per_call"] = round(per_file * 1e6, 3)
+                else:
+                    row["records_per_s"] = round(n_records / per_file) if per_file else None
+                    row["mb_per_s"] = round(size_mb / per_file, 2) if per_file else None
+                results.append(row)
+                print(_format_row(row), flush=True)
+
+    return {
+        "meta": {
+            "commit":    _git_commit(),
+            "python":    platform.python_version(),
+            "platform":  platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "created":   time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+        },
+        "results": results
+    }
+
+
+def _format_row(row: Dict) -> str:
+    rate = (f"{row['us_per_call']:>12.1f} us/call" if "us_per_call" in row
+            else f"{row['records_per_s']:>12,} rec/s {row['mb_per_s']:>8.1f} MB/s")
+    return (f"{row['stage']:<13} {row['records']:>9} rec x {row['samples']:>5} samples  "
+            f"{row['seconds']:>9.3f}s  {rate}  peak {row['peak_rss_mb']:.0f} MB "
+            f"(+{row['peak_rss_mb'] - row['baseline_rss_mb']:.0f})")
+
+
+def _int_list(text: str) -> List[int]:
+    return [int(x) for x in text.split(",") if x]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parsing, rule evaluation and /analyze on synthetic VCFs.")
+    parser.add_argument("--records", type=_int_list, default=[1000, 100_000],
+                        help="Comma-separated record counts, 1k to 5M (default: 1000,100000)")
+    parser.add_argument("--samples", type=_int_list, default=[1],
+                        help="Comma-separated sample counts, 1 to 10k (default: 1)")
+    parser.add_argument("--stages", default=",".join(STAGES), help="Comma-separated stages (default: all)")
+    parser.add_argument("--pgx-density", type=float, default=0.001, help="Fraction of PGx records (default: %(default)s)")
+    parser.add_argument("--missing-ids", type=float, default=0.0, help="Fraction of '.' IDs (default: %(default)s)")
+    parser.add_argument("--gz", action="store_true", help="Benchmark gzip-compressed inputs")
+    parser.add_argument("--repeat", type=int, default=1000, help="Repetitions for extract/phenotype (default: %(default)s)")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "pharmaguard-bench"),
+                        help="Where generated VCFs are cached (default: %(default)s)")
+    parser.add_argument("--output", help="Write the JSON report here (default: print it)")
+    args = parser.parse_args()
+
+    stages = [s for s in args.stages.split(",") if s]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+    os.makedirs(args.workdir, exist_ok=True)
+
+    report = run_suite(args.records, args.samples, stages, args.pgx_density,
+                       args.missing_ids, args.gz, args.repeat, args.workdir)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {len(report['results'])} results to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
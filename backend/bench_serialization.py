@@ -0,0 +1,77 @@
+"""
+Benchmark response serialization: stock JSONResponse vs the fragment-cached ResultResponse.
+
+Builds realistic RIFT results from the sample VCFs (fallback explanations,
+no network) and times encoding of 1-, 6- and 600-result payloads:
+
+    python bench_serialization.py --repeat 2000
+"""
+import argparse
+import glob
+import os
+import time
+from typing import Dict, List
+
+from fastapi.responses import JSONResponse
+
+from cpic_rules import GENE_DRUG_RULES
+from llm_explainer import fallback_explanation
+from pipeline import parse_vcf_path, evaluate_drug, assemble_result
+from serializer import ResultResponse
+
+SAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test_case_vcf")
+
+
+def sample_results() -> List[Dict]:
+    """One result per (sample VCF, supported drug)."""
+    results = []
+    for path in sorted(glob.glob(os.path.join(SAMPLE_DIR, "*.vcf"))):
+        parsed_vcf = parse_vcf_path(path)
+        for drug in GENE_DRUG_RULES:
+            e = evaluate_drug(parsed_vcf, drug)
+            r = e["risk_info"]
+            explanation = fallback_explanation(drug, e["gene"], e["phenotype"], e["diplotype"], r["risk_label"],
+                                               r["severity"], e["detected_variants"], r["recommendation"], r["mechanism"])
+            results.append(assemble_result(parsed_vcf["patient_id"], e, explanation, parsed_vcf, time.time()))
+    return results
+
+
+def payload(results: List[Dict], n: int):
+    items = [results[i % len(results)] for i in range(n)]
+    return items[0] if n == 1 else items
+
+
+def best_of(renders, content, repeat: int, rounds: int = 15) -> List[float]:
+    """Best per-call time of each render; rounds alternate between them so machine noise hits both alike."""
+    best = [float("inf")] * len(renders)
+    for _ in range(rounds):
+        for i, render in enumerate(renders):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                render(content)
+            best[i] = min(best[i], (time.perf_counter() - start) / repeat)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare JSONResponse and ResultResponse encoding times.")
+    parser.add_argument("--repeat", type=int, default=2000, help="Encodings per timing round (default: %(default)s)")
+    parser.add_argument("--sizes", default="1,6,600", help="Comma-separated result counts (default: %(default)s)")
+    args = parser.parse_args()
+
+    results  = sample_results()
+    baseline = JSONResponse.render
+    fast     = ResultResponse.render
+    print(f"{'results':>8} {'bytes':>10} {'json ms':>10} {'fast ms':>10} {'speedup':>8}")
+    for n in (int(s) for s in args.sizes.split(",")):
+        content = payload(results, n)
+        encoded = fast(None, content)
+        if encoded != baseline(None, content):
+            raise SystemExit(f"Output differs from JSONResponse for {n} results")
+        repeat = max(1, args.repeat // max(1, n // 10))
+        t_json, t_fast = best_of([lambda c: baseline(None, c), lambda c: fast(None, c)], content, repeat)
+        print(f"{n:>8} {len(encoded):>10} {t_json * 1000:>10.3f} {t_fast * 1000:>10.3f} {t_json / t_fast:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
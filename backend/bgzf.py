@@ -0,0 +1,263 @@
+import os
+import struct
+import zlib
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+# Tabix/CSI binning scheme used by .tbi files (min_shift=14, depth=5)
+TBI_MIN_SHIFT = 14
+TBI_DEPTH = 5
+
+# Largest decompressed stream accepted from one .vcf.gz; guards against gzip bombs
+MAX_DECOMPRESSED_BYTES = int(os.environ.get("MAX_DECOMPRESSED_BYTES") or str(16 * 1024 ** 3))
+# Largest decompressed .tbi/.csi index; real ones are a few MB and are held in memory whole
+MAX_INDEX_BYTES = int(os.environ.get("MAX_INDEX_BYTES") or str(256 * 1024 ** 2))
+# Decompressed output is handed on in pieces of at most this size
+PIECE_SIZE = 1024 * 1024
+# The BGZF spec caps a block's uncompressed payload at 64 KiB
+BGZF_MAX_BLOCK = 65536
+
+
+class DecompressionLimitExceeded(ValueError):
+    """A compressed upload expands past its decompression limit."""
+
+
+class GzipStreamDecoder:
+    """
+    Incremental decompressor for gzip and BGZF data.
+    BGZF is a series of concatenated gzip members, so a fresh decompressor
+    is started whenever one member ends. Output is produced in pieces of at
+    most piece_size bytes, so memory stays flat however well the input
+    compresses, and the stream is rejected once it passes max_output bytes.
+    """
+
+    def __init__(self, max_output: Optional[int] = MAX_DECOMPRESSED_BYTES, piece_size: int = PIECE_SIZE):
+        self.max_output = max_output
+        self.piece_size = piece_size
+        self.total_out = 0
+        self._d = zlib.decompressobj(31)
+
+    def decompress(self, data: bytes) -> Iterator[bytes]:
+        """Yield the decompressed bytes of data, in bounded pieces."""
+        while True:
+            piece = self._d.decompress(data, self.piece_size)
+            if piece:
+                self.total_out += len(piece)
+                if self.max_output is not None and self.total_out > self.max_output:
+                    raise DecompressionLimitExceeded(
+                        f"Decompressed data exceeds the {self.max_output} byte limit")
+                yield piece
+            if self._d.eof:
+                data = self._d.unused_data
+                self._d = zlib.decompressobj(31)
+                if not data:
+                    break
+                continue
+            data = self._d.unconsumed_tail
+            # A full piece may leave output buffered inside zlib even with no input left
+            if not data and len(piece) < self.piece_size:
+                break
+
+
+def decompress_gzip(data: bytes, max_output: Optional[int] = MAX_DECOMPRESSED_BYTES) -> bytes:
+    """Decompress a whole (possibly multi-member) gzip/BGZF buffer."""
+    return b"".join(GzipStreamDecoder(max_output).decompress(data))
+
+
+def read_block(f: BinaryIO) -> Optional[bytes]:
+    """Read and decompress the BGZF block at the current file offset. Returns None at EOF."""
+    header = f.read(12)
+    if len(header) < 12:
+        return None
+    if header[:2] != b"\x1f\x8b" or not header[3] & 4:
+        raise ValueError("Not a BGZF file")
+    xlen = struct.unpack("<H", header[10:12])[0]
+    extra = f.read(xlen)
+
+    # Find the 'BC' subfield carrying the total block size
+    bsize = None
+    i = 0
+    while i + 4 <= len(extra):
+        slen = struct.unpack("<H", extra[i + 2:i + 4])[0]
+        if extra[i:i + 2] == b"BC" and slen == 2:
+            bsize = struct.unpack("<H", extra[i + 4:i + 6])[0]
+        i += 4 + slen
+    if bsize is None:
+        raise ValueError("Not a BGZF file: missing BC block size")
+
+    rest = f.read(bsize + 1 - 12 - xlen)
+    d = zlib.decompressobj(31)
+    data = d.decompress(header + extra + rest, BGZF_MAX_BLOCK + 1)
+    if len(data) > BGZF_MAX_BLOCK:
+        raise ValueError("Not a BGZF file: block larger than 64 KiB")
+    return data
+
+
+def read_header(f: BinaryIO) -> bytes:
+    """Return the '#' header lines at the start of a BGZF-compressed VCF."""
+    f.seek(0)
+    header = []
+    pending = b""
+    while True:
+        data = read_block(f)
+        if data is None:
+            break
+        lines = (pending + data).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            if line and not line.startswith(b"#"):
+                return b"\n".join(header) + b"\n"
+            header.append(line)
+    if pending.startswith(b"#"):
+        header.append(pending)
+    return b"\n".join(header) + b"\n"
+
+
+def _parse_names(data: bytes, offset: int) -> Tuple[Dict, int]:
+    fmt, col_seq, col_beg, col_end, meta, skip, l_nm = struct.unpack_from("<7i", data, offset)
+    offset += 28
+    names = data[offset:offset + l_nm].split(b"\x00")
+    names = [n.decode("utf-8") for n in names if n]
+    return {"meta_char": chr(meta), "skip": skip, "names": names}, offset + l_nm
+
+
+def parse_index(raw: bytes) -> Dict:
+    """
+    Parse a tabix (.tbi) or CSI (.csi) index for a BGZF-compressed VCF.
+    Returns the binning parameters and, per reference sequence, the bin ->
+    chunk map, the linear index (tbi only) and the record count if present.
+    Raises DecompressionLimitExceeded past MAX_INDEX_BYTES.
+    """
+    data = decompress_gzip(raw, MAX_INDEX_BYTES) if raw[:2] == b"\x1f\x8b" else raw
+    if len(data) > MAX_INDEX_BYTES:
+        raise DecompressionLimitExceeded(f"Index exceeds the {MAX_INDEX_BYTES} byte limit")
+    magic = data[:4]
+
+    if magic == b"TBI\x01":
+        n_ref = struct.unpack_from("<i", data, 4)[0]
+        header, offset = _parse_names(data, 8)
+        min_shift, depth, is_csi = TBI_MIN_SHIFT, TBI_DEPTH, False
+    elif magic == b"CSI\x01":
+        min_shift, depth, l_aux = struct.unpack_from("<3i", data, 4)
+        aux = data[16:16 + l_aux]
+        header = _parse_names(aux, 0)[0] if l_aux >= 28 else {"names": []}
+        offset = 16 + l_aux
+        n_ref = struct.unpack_from("<i", data, offset)[0]
+        offset += 4
+        is_csi = True
+    else:
+        raise ValueError("Unrecognised index file: expected a .tbi or .csi index")
+
+    pseudo_bin = ((1 << (3 * (depth + 1))) - 1) // 7 + 1
+    refs = []
+    n_records = 0
+    for _ in range(n_ref):
+        (n_bin,) = struct.unpack_from("<i", data, offset)
+        offset += 4
+        bins = {}
+        n_mapped = None
+        for _ in range(n_bin):
+            if is_csi:
+                bin_id, _loffset, n_chunk = struct.unpack_from("<IQi", data, offset)
+                offset += 16
+            else:
+                bin_id, n_chunk = struct.unpack_from("<Ii", data, offset)
+                offset += 8
+            chunks = list(struct.iter_unpack("<QQ", data[offset:offset + 16 * n_chunk]))
+            offset += 16 * n_chunk
+            if bin_id == pseudo_bin:
+                # Pseudo-bin: (file span of this reference), (mapped, unmapped counts)
+                n_mapped = chunks[1][0] if len(chunks) > 1 else None
+            else:
+                bins[bin_id] = chunks
+
+        linear = []
+        if not is_csi:
+            (n_intv,) = struct.unpack_from("<i", data, offset)
+            offset += 4
+            linear = list(struct.unpack_from(f"<{n_intv}Q", data, offset))
+            offset += 8 * n_intv
+
+        if n_mapped is None:
+            n_records = None
+        elif n_records is not None:
+            n_records += n_mapped
+        refs.append({"bins": bins, "linear": linear})
+
+    names = header.get("names", [])
+    return {
+        "min_shift": min_shift,
+        "depth": depth,
+        "refs": dict(zip(names, refs)),
+        "n_records": n_records,
+    }
+
+
+def reg2bins(beg: int, end: int, min_shift: int, depth: int) -> List[int]:
+    """All bins that may hold records overlapping the 0-based half-open [beg, end)."""
+    bins = []
+    end -= 1
+    shift = min_shift + depth * 3
+    level_offset = 0
+    for level in range(depth + 1):
+        bins.extend(range(level_offset + (beg >> shift), level_offset + (end >> shift) + 1))
+        shift -= 3
+        level_offset += 1 << (level * 3)
+    return bins
+
+
+def _resolve_ref(index: Dict, chrom: str) -> Optional[str]:
+    """Match a chromosome name against the index, tolerating a missing/extra 'chr' prefix."""
+    refs = index["refs"]
+    if chrom in refs:
+        return chrom
+    alt = chrom[3:] if chrom.startswith("chr") else f"chr{chrom}"
+    return alt if alt in refs else None
+
+
+def region_chunks(index: Dict, regions: List[Tuple[str, int, int]]) -> List[Tuple[int, int]]:
+    """
+    Map 1-based inclusive (chrom, start, end) regions to the minimal sorted list
+    of non-overlapping BGZF virtual-offset ranges that have to be read.
+    """
+    chunks = []
+    for chrom, start, end in regions:
+        name = _resolve_ref(index, chrom)
+        if name is None:
+            continue
+        ref = index["refs"][name]
+        beg = max(start - 1, 0)
+        min_off = 0
+        if ref["linear"]:
+            min_off = ref["linear"][min(beg >> index["min_shift"], len(ref["linear"]) - 1)]
+        for bin_id in reg2bins(beg, end, index["min_shift"], index["depth"]):
+            for cbeg, cend in ref["bins"].get(bin_id, ()):
+                if cend > min_off:
+                    chunks.append((max(cbeg, min_off), cend))
+
+    merged = []
+    for cbeg, cend in sorted(chunks):
+        if merged and cbeg <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], cend))
+        else:
+            merged.append((cbeg, cend))
+    return merged
+
+
+def read_chunks(f: BinaryIO, chunks: List[Tuple[int, int]]) -> Iterator[bytes]:
+    """Yield the decompressed bytes of each virtual-offset range, block by block."""
+    for vbeg, vend in chunks:
+        coffset, uoffset = vbeg >> 16, vbeg & 0xFFFF
+        end_coffset, end_uoffset = vend >> 16, vend & 0xFFFF
+        f.seek(coffset)
+        while True:
+            block_offset = f.tell()
+            if block_offset > end_coffset:
+                break
+            data = read_block(f)
+            if data is None:
+                break
+            start = uoffset if block_offset == coffset else 0
+            if block_offset == end_coffset:
+                yield data[start:end_uoffset]
+                break
+            yield data[start:]
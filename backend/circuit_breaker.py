@@ -0,0 +1,102 @@
+import time
+from typing import Dict, Optional
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling an upstream whose circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for one upstream:
+
+        closed      calls pass; failure_threshold failures in a row open it
+        open        calls are refused until reset_seconds have passed
+        half_open   up to half_open_probes trial calls; once that many succeed
+                    the circuit closes, any failure re-opens it
+
+    Runs on the event loop only, so no locking is needed.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0, half_open_probes: int = 1,
+                 gauge=None):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.half_open_probes = half_open_probes
+        self.gauge = gauge            # optional metrics Gauge set to STATE_VALUES on every transition
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_successes = 0
+        self.counters = {"opened": 0, "rejected": 0}
+        if gauge is not None:
+            gauge.set(self.STATE_VALUES[self.CLOSED])
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+            self._set_state(self.HALF_OPEN)
+        return self._state
+
+    def _set_state(self, state: str) -> None:
+        self._state = state
+        self._probes = self._probe_successes = 0
+        if state == self.OPEN:
+            self._opened_at = time.monotonic()
+            self.counters["opened"] += 1
+        elif state == self.CLOSED:
+            self._failures = 0
+        if self.gauge is not None:
+            self.gauge.set(self.STATE_VALUES[state])
+
+    def allow(self) -> bool:
+        """Whether a call may go upstream now; in half-open this claims a probe slot."""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and self._probes < self.half_open_probes:
+            self._probes += 1
+            return True
+        self.counters["rejected"] += 1
+        return False
+
+    def record_success(self) -> None:
+        if self.state == self.HALF_OPEN:
+            self._probe_successes += 1
+            if self._probe_successes >= self.half_open_probes:
+                self._set_state(self.CLOSED)
+        else:
+            self._failures = 0
+
+    def record_failure(self) -> None:
+        state = self.state
+        if state == self.HALF_OPEN:
+            self._set_state(self.OPEN)
+        elif state == self.CLOSED:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                self._set_state(self.OPEN)
+
+    def record_abandoned(self) -> None:
+        """An allowed call ended without a verdict (e.g. cancelled); free its probe slot."""
+        if self._state == self.HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def retry_in(self) -> Optional[float]:
+        """Seconds until the next half-open probe while open, else None."""
+        if self.state != self.OPEN:
+            return None
+        return max(self.reset_seconds - (time.monotonic() - self._opened_at), 0.0)
+
+    def stats(self) -> Dict:
+        retry_in = self.retry_in()
+        return {
+            **self.counters,
+            "state":                self.state,
+            "consecutive_failures": self._failures,
+            "retry_in_seconds":     round(retry_in, 1) if retry_in is not None else None
+        }
@@ -0,0 +1,146 @@
+import dataclasses
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from cpic_rules import KnowledgeBase, REFERENCE_ALLELE, UNKNOWN_ALLELE, diplotype_table, knowledge_base, star_order
+from vcf_parser import VCFStreamParser, VCFVariant, pgx_hit
+
+MISSING = -1
+
+# Alt-allele dosage of the GT strings seen so far
+_GT_CODES = {".": MISSING, "./.": MISSING, ".|.": MISSING}
+
+
+def genotype_code(gt: str) -> int:
+    """Encode a GT call as alt-allele dosage: 0, 1, 2 (hom alt) or -1 (missing)."""
+    code = _GT_CODES.get(gt)
+    if code is None:
+        alleles = gt.replace('|', '/').split('/')
+        called = [a for a in alleles if a != '.']
+        if not called:
+            code = MISSING
+        else:
+            n_alt = sum(1 for a in called if a != '0')
+            code = 2 if n_alt and n_alt == len(alleles) else min(n_alt, 1)
+        _GT_CODES[gt] = code
+    return code
+
+
+class CohortParser(VCFStreamParser):
+    """
+    Streaming parser for joint-called multi-sample VCFs.
+    Every sample column of the PGx records is kept in a columnar int8
+    dosage matrix (sites x samples); nothing else is materialised.
+    """
+
+    def __init__(self, kb: Optional[KnowledgeBase] = None):
+        super().__init__(kb=kb)
+        self.samples = []
+        self.sites = []             # PGx site metadata, one per matrix row
+        self._site_index = {}       # (gene, rsid) -> matrix row
+        self._rows = []
+        self._gt_text = []          # raw GT strings per site, for reporting
+
+    def on_column_header(self, cols: List[str]) -> None:
+        super().on_column_header(cols)
+        self.samples = cols[9:]
+
+    def add_variant(self, variant: VCFVariant, parts: List[str]) -> None:
+        # Resolve the site as if carried, so it does not depend on the first sample's call
+        site = pgx_hit(dataclasses.replace(variant, genotype="0/1"), self.kb)
+        if site is None:
+            return
+
+        n = len(self.samples)
+        fmt = parts[8].split(':') if len(parts) > 9 else []
+        if 'GT' not in fmt:
+            gts = ['.'] * n
+        elif fmt[0] == 'GT':
+            gts = [s.split(':', 1)[0] for s in parts[9:9 + n]]
+        else:
+            gi = fmt.index('GT')
+            gts = [(s.split(':') + ['.'] * gi)[gi] for s in parts[9:9 + n]]
+        gts += ['.'] * (n - len(gts))
+        row = np.fromiter((genotype_code(g) for g in gts), dtype=np.int8, count=n)
+
+        key = (site["gene"], variant.rsid.lower())
+        idx = self._site_index.get(key)
+        if idx is not None:
+            # As in the single-sample index, the first record that carries an rsID wins
+            take = (self._rows[idx] <= 0) & (row > 0)
+            self._rows[idx][take] = row[take]
+            for j in np.nonzero(take)[0]:
+                self._gt_text[idx][j] = gts[j]
+            return
+
+        del site["genotype"]
+        self._site_index[key] = len(self.sites)
+        self.sites.append(site)
+        self._gt_text.append(gts)
+        self._rows.append(row)
+
+    def result(self) -> Dict:
+        result = super().result()
+        n = len(self.samples)
+        result.update({
+            "samples": self.samples,
+            "sites": self.sites,
+            "genotypes": np.vstack(self._rows) if self._rows else np.zeros((0, n), dtype=np.int8),
+            "genotype_text": self._gt_text,
+        })
+        return result
+
+
+def cohort_phenotypes(parsed: Dict, gene: str) -> Tuple[np.ndarray, np.ndarray, List[List[Dict]]]:
+    """
+    Phenotype every sample of a cohort for one gene at once.
+    Returns per-sample phenotype and diplotype arrays plus each sample's
+    detected variants, with the same semantics as call_diplotype: the two
+    lowest-activity allele copies are found per sample and the phenotype is
+    gathered from the gene's diplotype table for all samples in one step.
+    """
+    n = len(parsed["samples"])
+    rows = [i for i, site in enumerate(parsed["sites"]) if site["gene"] == gene]
+    detected = [[] for _ in range(n)]
+    if not rows:
+        return np.full(n, "NM", dtype=object), np.full(n, "*1/*1", dtype=object), detected
+
+    table = diplotype_table(gene, knowledge_base(parsed["knowledge_base_version"]))
+    index, names, scores, unknown = table["index"], table["names"], table["scores"], table["unknown"]
+    sites = [parsed["sites"][i] for i in rows]
+
+    # Rank the sites as call_diplotype ranks allele copies; the extra slot k is the *1 padding
+    alleles = [index.get(site["rsid"].lower(), unknown) for site in sites]
+    ranked = []
+    for local, (site, i) in enumerate(zip(sites, alleles)):
+        ranked.append((scores[i], i, names[i] if i != unknown else site["star_allele"] or UNKNOWN_ALLELE, local))
+    ranked.sort()
+    order = [r[3] for r in ranked]
+    k = len(order)
+    allele_of = np.array([r[1] for r in ranked] + [0], dtype=np.intp)
+    stars = np.array([r[2] for r in ranked] + [REFERENCE_ALLELE], dtype=object)
+
+    codes = parsed["genotypes"][rows]
+    copies = np.clip(codes[order], 0, 2).cumsum(axis=0)
+    total = copies[-1]
+    # Sorted position of each sample's first and second allele copy
+    first = np.where(total >= 1, (copies >= 1).argmax(axis=0), k)
+    second = np.where(total >= 2, (copies >= 2).argmax(axis=0), k)
+
+    a, b = allele_of[first], allele_of[second]
+    phenotype = np.array(table["phenotype"], dtype=object)[a, b]
+
+    # Written in star-number order as in call_diplotype; the *1 padding always stays second
+    written = np.empty(k + 1, dtype=np.intp)
+    written[sorted(range(k), key=lambda p: star_order(stars[p]))] = np.arange(k)
+    written[k] = k
+    swap = written[second] < written[first]
+    first, second = np.where(swap, second, first), np.where(swap, first, second)
+    diplotype = stars[first] + "/" + stars[second]
+
+    carrier = codes > 0
+    gt_text = parsed["genotype_text"]
+    for local, sample in zip(*np.nonzero(carrier)):
+        detected[sample].append(dict(sites[local], genotype=gt_text[rows[local]][sample]))
+    return phenotype, diplotype, detected
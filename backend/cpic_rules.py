@@ -1,289 +1,392 @@
 # CPIC Guidelines - Gene-Drug-Phenotype-Risk Mappings
 # Based on CPIC clinical guidelines (cpicpgx.org)
+#
+# The rule data lives in versioned JSON/TSV files under knowledge_base/ (listed in
+# its manifest.json) and is compiled here into the lookup structures the request
+# path uses: rsID map, locus index, result templates and diplotype tables.
+#
+# A compiled KnowledgeBase is immutable. reload_knowledge_base() builds a new one
+# off to the side and swaps a single reference, so readers never take a lock.
+# Parses record the version they used and later stages resolve it through
+# knowledge_base(version), so one request sees one knowledge base throughout.
+import hashlib
+import json
+import os
+import pickle
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Optional, Tuple
 
-GENE_DRUG_RULES = {
-    "CODEINE": {
-        "gene": "CYP2D6",
-        "phenotype_risks": {
-            "URM": {
-                "risk_label": "Toxic",
-                "severity": "critical",
-                "confidence_score": 0.95,
-                "recommendation": "Avoid codeine. Ultrarapid metabolism leads to excessive morphine production causing respiratory depression and potential death. Use alternative analgesic such as morphine (with care) or a non-opioid.",
-                "mechanism": "CYP2D6 ultrarapid metabolizers convert codeine to morphine too rapidly, causing toxic morphine plasma levels."
-            },
-            "PM": {
-                "risk_label": "Ineffective",
-                "severity": "high",
-                "confidence_score": 0.92,
-                "recommendation": "Avoid codeine. Poor metabolizers cannot convert codeine to its active form morphine, resulting in no analgesic effect. Use an alternative non-CYP2D6-dependent opioid.",
-                "mechanism": "CYP2D6 poor metabolizers lack the enzyme activity to O-demethylate codeine to morphine, producing no analgesic effect."
-            },
-            "IM": {
-                "risk_label": "Adjust Dosage",
-                "severity": "moderate",
-                "confidence_score": 0.80,
-                "recommendation": "Use with caution. Reduced analgesic effect expected. Consider lower dose or alternative analgesic.",
-                "mechanism": "Reduced CYP2D6 activity leads to decreased morphine production from codeine."
-            },
-            "NM": {
-                "risk_label": "Safe",
-                "severity": "none",
-                "confidence_score": 0.90,
-                "recommendation": "Standard dosing applies. Monitor for expected analgesic effect.",
-                "mechanism": "Normal CYP2D6 activity provides expected codeine to morphine conversion."
-            },
-            "RM": {
-                "risk_label": "Adjust Dosage",
-                "severity": "low",
-                "confidence_score": 0.75,
-                "recommendation": "Use with caution. Slightly increased morphine production possible. Monitor for opioid side effects.",
-                "mechanism": "Mildly increased CYP2D6 activity may produce elevated morphine levels."
-            }
-        }
-    },
-    "WARFARIN": {
-        "gene": "CYP2C9",
-        "phenotype_risks": {
-            "PM": {
-                "risk_label": "Adjust Dosage",
-                "severity": "high",
-                "confidence_score": 0.93,
-                "recommendation": "Reduce warfarin dose by 50-75%. Poor metabolizers have significantly reduced warfarin clearance, leading to elevated plasma levels and bleeding risk. Monitor INR closely.",
-                "mechanism": "CYP2C9 poor metabolizers have severely impaired warfarin S-enantiomer metabolism, prolonging anticoagulant effect."
-            },
-            "IM": {
-                "risk_label": "Adjust Dosage",
-                "severity": "moderate",
-                "confidence_score": 0.85,
-                "recommendation": "Reduce warfarin starting dose by 25-50%. Monitor INR more frequently during initiation.",
-                "mechanism": "Intermediate CYP2C9 activity reduces warfarin clearance, requiring lower doses to achieve target INR."
-            },
-            "NM": {
-                "risk_label": "Safe",
-                "severity": "none",
-                "confidence_score": 0.88,
-                "recommendation": "Standard dosing and monitoring apply.",
-                "mechanism": "Normal CYP2C9 activity provides expected warfarin metabolism."
-            },
-            "URM": {
-                "risk_label": "Adjust Dosage",
-                "severity": "low",
-                "confidence_score": 0.70,
-                "recommendation": "May require higher warfarin doses to achieve therapeutic INR. Monitor closely.",
-                "mechanism": "Increased CYP2C9 activity leads to faster warfarin clearance."
-            },
-            "RM": {
-                "risk_label": "Safe",
-                "severity": "none",
-                "confidence_score": 0.78,
-                "recommendation": "Standard dosing with routine monitoring.",
-                "mechanism": "Near-normal warfarin metabolism expected."
-            }
-        }
-    },
-    "CLOPIDOGREL": {
-        "gene": "CYP2C19",
-        "phenotype_risks": {
-            "PM": {
-                "risk_label": "Ineffective",
-                "severity": "critical",
-                "confidence_score": 0.95,
-                "recommendation": "Avoid clopidogrel. Poor metabolizers cannot activate the prodrug, resulting in no antiplatelet effect. Use prasugrel or ticagrelor as alternatives.",
-                "mechanism": "CYP2C19 poor metabolizers cannot convert clopidogrel to its active thiol metabolite, resulting in absent platelet inhibition and increased cardiovascular event risk."
-            },
-            "IM": {
-                "risk_label": "Adjust Dosage",
-                "severity": "moderate",
-                "confidence_score": 0.82,
-                "recommendation": "Consider alternative antiplatelet agent (prasugrel or ticagrelor). If clopidogrel must be used, higher dose monitoring required.",
-                "mechanism": "Reduced CYP2C19 activity leads to decreased active metabolite formation and suboptimal platelet inhibition."
-            },
-            "NM": {
-                "risk_label": "Safe",
-                "severity": "none",
-                "confidence_score": 0.90,
-                "recommendation": "Standard clopidogrel dosing recommended.",
-                "mechanism": "Normal CYP2C19 activity provides adequate clopidogrel activation."
-            },
-            "RM": {
-                "risk_label": "Safe",
-                "severity": "none",
-                "confidence_score": 0.85,
-                "recommendation": "Standard dosing. Enhanced drug activation may provide good antiplatelet effect.",
-                "mechanism": "Increased CYP2C19 activity leads to enhanced clopidogrel activation."
-            },
-            "URM": {
-                "risk_label": "Safe",
-                "severity": "none",
-                "confidence_score": 0.80,
-                "recommendation": "Standard dosing with good expected response.",
-                "mechanism": "Ultrarapid CYP2C19 activity provides robust clopidogrel activation."
-            }
-        }
-    },
-    "SIMVASTATIN": {
-        "gene": "SLCO1B1",
-        "phenotype_risks": {
-            "PM": {
-                "risk_label": "Toxic",
-                "severity": "high",
-                "confidence_score": 0.91,
-                "recommendation": "Avoid simvastatin 40-80mg doses. High risk of simvastatin-induced myopathy. Use lower dose (10-20mg) or switch to pravastatin or rosuvastatin.",
-                "mechanism": "SLCO1B1 poor function leads to reduced hepatic uptake of simvastatin, increasing plasma concentrations and myopathy risk."
-            },
-            "IM": {
-                "risk_label": "Adjust Dosage",
-                "severity": "moderate",
-                "confidence_score": 0.83,
-                "recommendation": "Use lower simvastatin dose (20-40mg max) or consider alternative statin. Monitor for muscle symptoms (myalgia, CK elevation).",
-                "mechanism": "Decreased SLCO1B1 transporter activity leads to elevated simvastatin plasma levels."
-            },
-            "NM": {
-                "risk_label": "Safe",
-                "severity": "none",
-                "confidence_score": 0.87,
-                "recommendation": "Standard simvastatin dosing. Routine monitoring recommended.",
-                "mechanism": "Normal SLCO1B1 function provides adequate hepatic simvastatin uptake."
-            },
-            "URM": {
-                "risk_label": "Safe",
-                "severity": "none",
-                "confidence_score": 0.75,
-                "recommendation": "Standard or potentially higher doses may be needed for therapeutic effect.",
-                "mechanism": "Enhanced SLCO1B1 activity increases hepatic uptake, potentially reducing systemic exposure."
-            },
-            "RM": {
-                "risk_label": "Safe",
-                "severity": "none",
-                "confidence_score": 0.80,
-                "recommendation": "Standard dosing recommended.",
-                "mechanism": "Normal to enhanced SLCO1B1 function."
-            }
-        }
-    },
-    "AZATHIOPRINE": {
-        "gene": "TPMT",
-        "phenotype_risks": {
-            "PM": {
-                "risk_label": "Toxic",
-                "severity": "critical",
-                "confidence_score": 0.96,
-                "recommendation": "CONTRAINDICATED at standard doses. TPMT-deficient patients accumulate toxic thioguanine nucleotides causing life-threatening bone marrow suppression. Reduce dose by 90% or use alternative agent.",
-                "mechanism": "Absent TPMT activity causes accumulation of cytotoxic thioguanine nucleotides, leading to severe myelosuppression."
-            },
-            "IM": {
-                "risk_label": "Adjust Dosage",
-                "severity": "high",
-                "confidence_score": 0.89,
-                "recommendation": "Reduce azathioprine dose by 30-70%. Monitor CBC weekly for first month, then monthly. Watch for signs of myelosuppression.",
-                "mechanism": "Reduced TPMT activity leads to accumulation of thioguanine nucleotides above therapeutic levels."
-            },
-            "NM": {
-                "risk_label": "Safe",
-                "severity": "none",
-                "confidence_score": 0.91,
-                "recommendation": "Standard azathioprine dosing with routine CBC monitoring.",
-                "mechanism": "Normal TPMT activity maintains thioguanine nucleotides within therapeutic range."
-            },
-            "RM": {
-                "risk_label": "Adjust Dosage",
-                "severity": "low",
-                "confidence_score": 0.70,
-                "recommendation": "May require higher doses for therapeutic effect. Monitor thiopurine metabolite levels.",
-                "mechanism": "Increased TPMT activity leads to reduced thioguanine nucleotide accumulation."
-            },
-            "URM": {
-                "risk_label": "Ineffective",
-                "severity": "moderate",
-                "confidence_score": 0.72,
-                "recommendation": "Standard doses may be insufficient. Consider alternative immunosuppressant or monitor drug metabolite levels closely.",
-                "mechanism": "Very high TPMT activity rapidly clears thioguanine nucleotides, potentially reducing therapeutic efficacy."
-            }
+KB_DIR = os.environ.get("KB_DIR") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "knowledge_base")
+# Compiled form of the source files, reused at startup while they are unchanged
+KB_SNAPSHOT = os.environ.get("KB_SNAPSHOT") or os.path.join(KB_DIR, ".compiled.pickle")
+SNAPSHOT_FORMAT = 1
+# Superseded versions stay resolvable for requests that started before a reload
+MAX_KNOWN_VERSIONS = 8
+
+REFERENCE_ALLELE = "*1"
+UNKNOWN_ALLELE = "unknown"
+_STAR_NUMBER = re.compile(r"\*(\d+)(.*)")
+
+RISK_FIELDS = ("risk_label", "severity", "confidence_score", "recommendation", "mechanism")
+
+
+@dataclass(frozen=True)
+class KnowledgeBase:
+    version: str
+    gene_drug_rules: Mapping
+    variant_star_alleles: Mapping
+    variant_loci: Mapping
+    gene_to_drug: Mapping
+    drug_to_gene: Mapping
+    gene_loci: Mapping
+    pgx_genes: Tuple[str, ...]
+    pgx_regions: Tuple[Tuple, ...]
+    locus_index: Mapping
+    result_templates: Mapping
+    diplotype_tables: Mapping
+    supported_drugs_text: str
+
+
+# Activity-score phenotype thresholds (CPIC): >= 1.5 NM, >= 1.0 IM, otherwise PM
+def activity_phenotype(score: float) -> str:
+    if score >= 1.5:
+        return "NM"
+    if score >= 1.0:
+        return "IM"
+    return "PM"
+
+
+def star_order(name: str) -> Tuple:
+    """Sort key for writing a diplotype: *2 < *3 < *3A < *10, unnamed alleles last."""
+    match = _STAR_NUMBER.fullmatch(name)
+    return (0, int(match.group(1)), match.group(2)) if match else (1, 0, name)
+
+
+# ---------------------------------------------------------------------------
+# Source files
+# ---------------------------------------------------------------------------
+
+def _read_sources(kb_dir: str) -> Tuple[Dict, Dict[str, bytes], str]:
+    """The manifest, the raw bytes of every file it lists, and a digest over all of them."""
+    with open(os.path.join(kb_dir, "manifest.json"), "rb") as f:
+        manifest_raw = f.read()
+    manifest = json.loads(manifest_raw)
+    digest = hashlib.sha256(manifest_raw)
+    raw = {}
+    for name, filename in sorted(manifest["files"].items()):
+        with open(os.path.join(kb_dir, filename), "rb") as f:
+            raw[name] = f.read()
+        digest.update(name.encode("utf-8") + b"\0" + raw[name])
+    return manifest, raw, digest.hexdigest()
+
+
+def _read_tsv(raw: bytes) -> List[Dict[str, str]]:
+    """Rows of a tab-separated file with a header line; blank lines and '#' comments are skipped."""
+    lines = [line for line in raw.decode("utf-8").splitlines() if line.strip() and not line.startswith("#")]
+    if not lines:
+        return []
+    header = lines[0].split("\t")
+    return [dict(zip(header, line.split("\t"))) for line in lines[1:]]
+
+
+def _number(text: str):
+    # Whole numbers stay ints so results encode exactly as the rule data is written
+    return int(text) if text.lstrip("-").isdigit() else float(text)
+
+
+def _parse_sources(raw: Dict[str, bytes]) -> Dict:
+    rules = json.loads(raw["rules"])
+
+    alleles = {}
+    for row in _read_tsv(raw["star_alleles"]):
+        alleles[row["rsid"].lower()] = {
+            "gene":                   row["gene"],
+            "star_allele":            row["star_allele"],
+            "function":               row["function"],
+            "activity_score":         _number(row["activity_score"]),
+            "phenotype_contribution": row["phenotype_contribution"]
         }
-    },
-    "FLUOROURACIL": {
-        "gene": "DPYD",
-        "phenotype_risks": {
-            "PM": {
-                "risk_label": "Toxic",
-                "severity": "critical",
-                "confidence_score": 0.97,
-                "recommendation": "CONTRAINDICATED. DPYD-deficient patients cannot metabolize fluorouracil, leading to severe and potentially fatal toxicity (mucositis, neutropenia, neurotoxicity). Avoid completely or reduce dose by 50-85% with therapeutic drug monitoring.",
-                "mechanism": "Absent DPYD activity prevents catabolism of fluorouracil, causing massive drug accumulation and life-threatening systemic toxicity."
-            },
-            "IM": {
-                "risk_label": "Adjust Dosage",
-                "severity": "high",
-                "confidence_score": 0.90,
-                "recommendation": "Reduce fluorouracil starting dose by 25-50%. Begin at lower dose and titrate based on tolerability and drug levels. Requires close monitoring.",
-                "mechanism": "Partial DPYD deficiency reduces fluorouracil catabolism, elevating exposure and toxicity risk."
-            },
-            "NM": {
-                "risk_label": "Safe",
-                "severity": "none",
-                "confidence_score": 0.89,
-                "recommendation": "Standard fluorouracil dosing. Routine toxicity monitoring recommended.",
-                "mechanism": "Normal DPYD activity provides expected fluorouracil catabolism."
-            },
-            "RM": {
-                "risk_label": "Safe",
-                "severity": "none",
-                "confidence_score": 0.80,
-                "recommendation": "Standard dosing. Slightly enhanced drug clearance may occur.",
-                "mechanism": "Near-normal DPYD function with adequate fluorouracil metabolism."
-            },
-            "URM": {
-                "risk_label": "Safe",
-                "severity": "none",
-                "confidence_score": 0.75,
-                "recommendation": "Standard dosing. May require higher doses for full therapeutic effect in some cases.",
-                "mechanism": "Enhanced DPYD activity may increase fluorouracil catabolism slightly."
+
+    loci = {}
+    for row in _read_tsv(raw["variant_loci"]):
+        loci.setdefault(row["rsid"].lower(), []).append((row["chrom"], int(row["pos"]), row["ref"], row["alt"]))
+
+    gene_to_drug = {}
+    gene_loci = {}
+    for row in _read_tsv(raw["genes"]):
+        if gene_to_drug.setdefault(row["gene"], row["drug"]) != row["drug"]:
+            raise ValueError(f"gene {row['gene']} is listed for both {gene_to_drug[row['gene']]} and {row['drug']}")
+        gene_loci.setdefault(row["gene"], []).append((row["chrom"], int(row["start"]), int(row["end"])))
+
+    return {"rules": rules, "alleles": alleles, "loci": loci, "gene_to_drug": gene_to_drug, "gene_loci": gene_loci}
+
+
+def _validate(data: Dict) -> None:
+    """Reject data the request path could not serve, before it is ever swapped in."""
+    for drug, rule in data["rules"].items():
+        risks = rule.get("phenotype_risks", {})
+        if "gene" not in rule or "NM" not in risks:
+            raise ValueError(f"rule for {drug} needs a gene and an NM phenotype entry")
+        for phenotype, risk_info in risks.items():
+            missing = [f for f in RISK_FIELDS if f not in risk_info]
+            if missing:
+                raise ValueError(f"rule for {drug}/{phenotype} is missing {', '.join(missing)}")
+    for rsid in data["loci"]:
+        if rsid not in data["alleles"]:
+            raise ValueError(f"variant_loci lists {rsid}, which has no star allele entry")
+    genes = set(data["gene_to_drug"]) | {info["gene"] for info in data["alleles"].values()}
+    genes |= {rule["gene"] for rule in data["rules"].values()}
+    for gene in sorted(genes):
+        if gene not in data["gene_loci"]:
+            raise ValueError(f"gene {gene} has no genomic span in genes.tsv")
+
+
+# ---------------------------------------------------------------------------
+# Compilation
+# ---------------------------------------------------------------------------
+
+def build_locus_index(variant_loci: Dict) -> Dict[str, Tuple[List[int], List[List[Tuple]]]]:
+    """
+    Build a per-chromosome sorted index of every known PGx position.
+    Each chromosome maps to (sorted positions, [(ref, alt, rsid), ...] per position)
+    and is registered under both its 'chrN' and 'N' names.
+    """
+    by_chrom = {}
+    for rsid, loci in variant_loci.items():
+        for chrom, pos, ref, alt in loci:
+            by_chrom.setdefault(chrom, {}).setdefault(pos, []).append((ref, alt, rsid))
+
+    index = {}
+    for chrom, sites in by_chrom.items():
+        positions = sorted(sites)
+        entry = (positions, [sites[p] for p in positions])
+        index[chrom] = entry
+        index[chrom[3:] if chrom.startswith("chr") else f"chr{chrom}"] = entry
+    return index
+
+
+# Compiled rule table: the static part of every (drug, phenotype) result, built once
+# per knowledge base so the request path only fills in the patient-specific fields.
+# Phenotypes a drug has no rule for resolve to its NM entry, as before.
+def _compile_templates(rules: Dict) -> Dict:
+    templates = {}
+    for drug, rule in rules.items():
+        for phenotype, risk_info in rule["phenotype_risks"].items():
+            templates[(drug, phenotype)] = {
+                "gene":      rule["gene"],
+                "risk_info": risk_info,
+                "risk_assessment": {
+                    "risk_label":       risk_info["risk_label"],
+                    "confidence_score": risk_info["confidence_score"],
+                    "severity":         risk_info["severity"]
+                },
+                "clinical_recommendation": {
+                    "action":          risk_info["recommendation"],
+                    "cpic_guideline":  f"CPIC Guideline for {drug} and {rule['gene']}",
+                    "mechanism":       risk_info["mechanism"]
+                }
             }
-        }
+    return templates
+
+
+def _compile_diplotype_table(gene: str, alleles: Dict) -> Dict:
+    """
+    Dense diplotype lookup for one gene. Allele 0 is *1, then the gene's known
+    variants in star_alleles.tsv order, then one slot for variants of unknown
+    function (activity 0). activity[i][j] and phenotype[i][j] give the result for
+    the diplotype made of alleles i and j.
+    """
+    rsids  = [rsid for rsid, info in alleles.items() if info["gene"] == gene]
+    names  = [REFERENCE_ALLELE] + [alleles[r]["star_allele"] for r in rsids] + [UNKNOWN_ALLELE]
+    scores = [1.0] + [float(alleles[r]["activity_score"]) for r in rsids] + [0.0]
+    n = len(names)
+    activity = tuple(tuple(scores[i] + scores[j] for j in range(n)) for i in range(n))
+    return {
+        "gene":      gene,
+        "names":     tuple(names),
+        "scores":    tuple(scores),
+        "index":     {rsid: i + 1 for i, rsid in enumerate(rsids)},
+        "unknown":   n - 1,
+        "activity":  activity,
+        "phenotype": tuple(tuple(activity_phenotype(a) for a in row) for row in activity),
     }
-}
 
-# Variant to Star Allele mapping (rsID -> functional impact)
-VARIANT_STAR_ALLELES = {
-    # CYP2D6
-    "rs3892097": {"gene": "CYP2D6", "star_allele": "*4", "function": "no_function", "activity_score": 0, "phenotype_contribution": "PM"},
-    "rs35742686": {"gene": "CYP2D6", "star_allele": "*3", "function": "no_function", "activity_score": 0, "phenotype_contribution": "PM"},
-    "rs5030655": {"gene": "CYP2D6", "star_allele": "*6", "function": "no_function", "activity_score": 0, "phenotype_contribution": "PM"},
-    "rs16947": {"gene": "CYP2D6", "star_allele": "*2", "function": "normal_function", "activity_score": 1, "phenotype_contribution": "NM"},
-    "rs28371725": {"gene": "CYP2D6", "star_allele": "*41", "function": "decreased_function", "activity_score": 0.5, "phenotype_contribution": "IM"},
-    "rs1065852": {"gene": "CYP2D6", "star_allele": "*10", "function": "decreased_function", "activity_score": 0.5, "phenotype_contribution": "IM"},
-    # CYP2C19
-    "rs4244285": {"gene": "CYP2C19", "star_allele": "*2", "function": "no_function", "activity_score": 0, "phenotype_contribution": "PM"},
-    "rs4986893": {"gene": "CYP2C19", "star_allele": "*3", "function": "no_function", "activity_score": 0, "phenotype_contribution": "PM"},
-    "rs12248560": {"gene": "CYP2C19", "star_allele": "*17", "function": "increased_function", "activity_score": 1, "phenotype_contribution": "RM"}, # Technically increased, but often treated as 1+
-    "rs28399504": {"gene": "CYP2C19", "star_allele": "*4", "function": "no_function", "activity_score": 0, "phenotype_contribution": "PM"},
-    # CYP2C9
-    "rs1799853": {"gene": "CYP2C9", "star_allele": "*2", "function": "decreased_function", "activity_score": 0.5, "phenotype_contribution": "IM"},
-    "rs1057910": {"gene": "CYP2C9", "star_allele": "*3", "function": "no_function", "activity_score": 0, "phenotype_contribution": "PM"},
-    "rs28371686": {"gene": "CYP2C9", "star_allele": "*5", "function": "no_function", "activity_score": 0, "phenotype_contribution": "PM"},
-    # SLCO1B1
-    "rs4149056": {"gene": "SLCO1B1", "star_allele": "*5", "function": "decreased_function", "activity_score": 0, "phenotype_contribution": "PM"},
-    "rs2306283": {"gene": "SLCO1B1", "star_allele": "*1b", "function": "increased_function", "activity_score": 1, "phenotype_contribution": "RM"},
-    "rs11045819": {"gene": "SLCO1B1", "star_allele": "*14", "function": "decreased_function", "activity_score": 0.5, "phenotype_contribution": "IM"},
-    # TPMT
-    "rs1800460": {"gene": "TPMT", "star_allele": "*3B", "function": "no_function", "activity_score": 0, "phenotype_contribution": "PM"},
-    "rs1142345": {"gene": "TPMT", "star_allele": "*3C", "function": "no_function", "activity_score": 0, "phenotype_contribution": "PM"},
-    "rs1800462": {"gene": "TPMT", "star_allele": "*2", "function": "no_function", "activity_score": 0, "phenotype_contribution": "PM"},
-    # DPYD
-    "rs3918290": {"gene": "DPYD", "star_allele": "*2A", "function": "no_function", "activity_score": 0, "phenotype_contribution": "PM"},
-    "rs55886062": {"gene": "DPYD", "star_allele": "*13", "function": "no_function", "activity_score": 0, "phenotype_contribution": "PM"},
-    "rs67376798": {"gene": "DPYD", "star_allele": "c.2846A>T", "function": "decreased_function", "activity_score": 0.5, "phenotype_contribution": "IM"},
-    "rs75017182": {"gene": "DPYD", "star_allele": "HapB3", "function": "decreased_function", "activity_score": 0.5, "phenotype_contribution": "IM"},
-}
 
-GENE_TO_DRUG = {
-    "CYP2D6": "CODEINE",
-    "CYP2C19": "CLOPIDOGREL",
-    "CYP2C9": "WARFARIN",
-    "SLCO1B1": "SIMVASTATIN",
-    "TPMT": "AZATHIOPRINE",
-    "DPYD": "FLUOROURACIL"
+def _compile(version: str, data: Dict) -> Dict:
+    """Everything the request path looks up, as plain picklable data."""
+    # Every region a VCF has to be read over to find all supported pharmacogenes
+    pgx_genes = sorted(set(data["gene_to_drug"]) | {v["gene"] for v in data["alleles"].values()})
+    return {
+        **data,
+        "version":     version,
+        "pgx_genes":   pgx_genes,
+        "pgx_regions": sorted({locus for gene in pgx_genes for locus in data["gene_loci"][gene]}),
+        "locus_index": build_locus_index(data["loci"]),
+        "templates":   _compile_templates(data["rules"]),
+        "diplotypes":  {gene: _compile_diplotype_table(gene, data["alleles"]) for gene in pgx_genes},
+    }
+
+
+def _freeze_template(template: Dict) -> MappingProxyType:
+    return MappingProxyType({
+        **template,
+        "risk_assessment":         MappingProxyType(template["risk_assessment"]),
+        "clinical_recommendation": MappingProxyType(template["clinical_recommendation"])
+    })
+
+
+def _freeze_table(table: Dict) -> MappingProxyType:
+    return MappingProxyType({**table, "index": MappingProxyType(table["index"])})
+
+
+def _freeze(compiled: Dict) -> KnowledgeBase:
+    return KnowledgeBase(
+        version=compiled["version"],
+        gene_drug_rules=MappingProxyType(compiled["rules"]),
+        variant_star_alleles=MappingProxyType(compiled["alleles"]),
+        variant_loci=MappingProxyType(compiled["loci"]),
+        gene_to_drug=MappingProxyType(compiled["gene_to_drug"]),
+        drug_to_gene=MappingProxyType({v: k for k, v in compiled["gene_to_drug"].items()}),
+        gene_loci=MappingProxyType(compiled["gene_loci"]),
+        pgx_genes=tuple(compiled["pgx_genes"]),
+        pgx_regions=tuple(compiled["pgx_regions"]),
+        locus_index=MappingProxyType(compiled["locus_index"]),
+        result_templates=MappingProxyType({k: _freeze_template(t) for k, t in compiled["templates"].items()}),
+        diplotype_tables=MappingProxyType({g: _freeze_table(t) for g, t in compiled["diplotypes"].items()}),
+        supported_drugs_text=", ".join(compiled["rules"])
+    )
+
+
+def load_knowledge_base(kb_dir: str = KB_DIR, snapshot: Optional[str] = KB_SNAPSHOT) -> KnowledgeBase:
+    """
+    Compile the knowledge base in kb_dir. The compiled form is cached in snapshot,
+    keyed on a digest of the source files, so unchanged files are not re-parsed.
+    """
+    manifest, raw, digest = _read_sources(kb_dir)
+    version = f"{manifest['version']}+{digest[:12]}"
+
+    if snapshot and os.path.exists(snapshot):
+        try:
+            with open(snapshot, "rb") as f:
+                cached = pickle.load(f)
+            if cached.get("format") == SNAPSHOT_FORMAT and cached.get("digest") == digest:
+                return _freeze(cached["compiled"])
+        except Exception:
+            pass   # unreadable or from another version of this module; rebuilt below
+
+    try:
+        data = _parse_sources(raw)
+        _validate(data)
+    except (KeyError, ValueError) as e:
+        raise ValueError(f"Invalid knowledge base in {kb_dir}: {e}") from e
+    compiled = _compile(version, data)
+
+    if snapshot:
+        try:
+            tmp = f"{snapshot}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                pickle.dump({"format": SNAPSHOT_FORMAT, "digest": digest, "compiled": compiled}, f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, snapshot)
+        except OSError:
+            pass   # read-only deployment; compile again next start
+    return _freeze(compiled)
+
+
+# ---------------------------------------------------------------------------
+# Active knowledge base
+# ---------------------------------------------------------------------------
+
+_active = load_knowledge_base()
+_known = OrderedDict([(_active.version, _active)])
+_reload_lock = threading.Lock()
+
+
+def current_kb() -> KnowledgeBase:
+    """The knowledge base new requests should use."""
+    return _active
+
+
+def knowledge_base(version: Optional[str] = None) -> KnowledgeBase:
+    """The knowledge base with this version if it was loaded recently, else the current one."""
+    if version is None or version == _active.version:
+        return _active
+    return _known.get(version, _active)
+
+
+def reload_knowledge_base(kb_dir: str = KB_DIR) -> KnowledgeBase:
+    """
+    Load kb_dir and make it current. Invalid data raises ValueError and leaves
+    the current knowledge base in place. Requests already running keep theirs.
+    """
+    global _active
+    with _reload_lock:
+        kb = load_knowledge_base(kb_dir, KB_SNAPSHOT if kb_dir == KB_DIR else None)
+        _known[kb.version] = kb
+        _known.move_to_end(kb.version)
+        while len(_known) > MAX_KNOWN_VERSIONS:
+            _known.popitem(last=False)
+        _active = kb
+    return kb
+
+
+def rule_template(drug: str, phenotype: str, kb: Optional[KnowledgeBase] = None) -> MappingProxyType:
+    """Compiled result fragments for a supported drug and phenotype."""
+    templates = (kb or _active).result_templates
+    template = templates.get((drug, phenotype))
+    return template if template is not None else templates[(drug, "NM")]
+
+
+def diplotype_table(gene: str, kb: Optional[KnowledgeBase] = None) -> MappingProxyType:
+    """Compiled diplotype table for a gene; genes without known alleles get *1 + unknown only."""
+    table = (kb or _active).diplotype_tables.get(gene)
+    return table if table is not None else _freeze_table(_compile_diplotype_table(gene, {}))
+
+
+# Static fragments of the result returned for a drug without a rule
+UNSUPPORTED_TEMPLATE = MappingProxyType({
+    "risk_assessment": MappingProxyType({
+        "risk_label": "Unknown",
+        "confidence_score": 0.0,
+        "severity": "none"
+    }),
+    "llm_generated_explanation": MappingProxyType({
+        "mechanism_explanation": "N/A",
+        "patient_friendly": "This drug is not currently supported by PharmaGuard.",
+        "clinical_significance": "N/A",
+        "monitoring_parameters": "N/A",
+        "alternative_drugs": "N/A"
+    })
+})
+
+# The module-level tables of the current knowledge base, for scripts and tools.
+# Request code uses a KnowledgeBase directly so a reload cannot change it mid-request.
+_LEGACY_NAMES = {
+    "GENE_DRUG_RULES":      "gene_drug_rules",
+    "VARIANT_STAR_ALLELES": "variant_star_alleles",
+    "VARIANT_LOCI":         "variant_loci",
+    "GENE_TO_DRUG":         "gene_to_drug",
+    "DRUG_TO_GENE":         "drug_to_gene",
+    "GENE_LOCI":            "gene_loci",
+    "PGX_GENES":            "pgx_genes",
+    "PGX_REGIONS":          "pgx_regions",
+    "RESULT_TEMPLATES":     "result_templates",
+    "DIPLOTYPE_TABLES":     "diplotype_tables",
+    "SUPPORTED_DRUGS_TEXT": "supported_drugs_text",
 }
 
-DRUG_TO_GENE = {v: k for k, v in GENE_TO_DRUG.items()}
+
+def __getattr__(name: str):
+    if name in _LEGACY_NAMES:
+        return getattr(_active, _LEGACY_NAMES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+if __name__ == "__main__":
+    # Build step (see render.yaml): importing compiled the files and wrote the snapshot,
+    # so a cold start only has to unpickle it
+    print(f"Knowledge base {_active.version} compiled to {KB_SNAPSHOT}")
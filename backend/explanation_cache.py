@@ -0,0 +1,276 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+
+class ExplanationCache:
+    """
+    Two-tier cache for LLM explanations: a bounded in-process LRU in front of
+    an optional SQLite store. Entries expire after ttl_seconds and are scoped
+    to a version key, so a prompt/model change never serves stale text.
+    Concurrent misses for the same key share a single upstream call.
+    Only the memory tier is used inline: disk reads run in the threadpool and
+    writes are batched into one commit by a background writer.
+    Other caches with the same needs (see result_cache.py) use their own table.
+    Callers that serve hits from elsewhere name their counters in extra_hits;
+    they are counted into hit_rate.
+    """
+
+    def __init__(self, max_entries: int = 1024, db_path: Optional[str] = None,
+                 ttl_seconds: int = 7 * 24 * 3600, version: str = "1", table: str = "explanations",
+                 extra_hits: Tuple[str, ...] = ()):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.version = version
+        self._memory = OrderedDict()      # key -> (expires_at, value)
+        self._inflight = {}               # key -> Future shared by coalesced callers
+        self._tasks = set()               # running get_or_create_many factories
+        self._lock = threading.Lock()     # memory tier and counters; never held across disk I/O
+        self._db_lock = threading.Lock()  # the SQLite connection
+        self._unwritten = {}              # key -> (expires_at, value) stored but not yet on disk
+        self._writer_scheduled = False
+        self._db = None
+        self._table = table
+        self._hit_counters = (*extra_hits, "memory_hits", "disk_hits")
+        self.counters = {**dict.fromkeys(extra_hits, 0),
+                         "memory_hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "stores": 0}
+
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "key TEXT PRIMARY KEY, version TEXT NOT NULL, expires_at REAL NOT NULL, value TEXT NOT NULL)"
+            )
+            # Drop rows from older prompt versions and anything already expired
+            self._db.execute(f"DELETE FROM {table} WHERE version != ? OR expires_at < ?",
+                             (version, time.time()))
+            self._db.commit()
+
+    def make_key(self, *parts) -> str:
+        raw = json.dumps([self.version, *parts], separators=(",", ":"))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Look key up in memory, then on disk. Blocks on SQLite: on the event loop use get_or_create(_many)."""
+        cached = self._get_memory(key)
+        if cached is not None:
+            return cached
+        value = self._load([key]).get(key)
+        return dict(value) if value is not None else None
+
+    def _get_memory(self, key: str) -> Optional[Dict]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return dict(entry[1])
+                del self._memory[key]
+        return None
+
+    def _load(self, keys: List[str]) -> Dict[str, Dict]:
+        """Read keys that missed the memory tier from SQLite into it; blocks on disk."""
+        rows = []
+        if self._db is not None:
+            with self._db_lock:
+                rows = self._db.execute(
+                    f"SELECT key, expires_at, value FROM {self._table} "
+                    f"WHERE key IN ({','.join('?' * len(keys))}) AND version = ? AND expires_at > ?",
+                    (*keys, self.version, time.time())
+                ).fetchall()
+        found = {key: (expires_at, json.loads(value)) for key, expires_at, value in rows}
+        with self._lock:
+            for key, (expires_at, value) in found.items():
+                self._remember(key, expires_at, value)
+            self.counters["disk_hits"] += len(found)
+            self.counters["misses"] += len(keys) - len(found)
+        return {key: dict(value) for key, (_, value) in found.items()}
+
+    async def _load_async(self, keys: List[str]) -> Dict[str, Dict]:
+        if self._db is None:
+            return self._load(keys)
+        return await run_in_threadpool(self._load, keys)
+
+    def put(self, key: str, value: Dict) -> None:
+        """
+        Store in memory at once. The SQLite write is queued and committed
+        together with any others by a writer in a worker thread, or right
+        away when no event loop is running.
+        """
+        expires_at = time.time() + self.ttl_seconds
+        value = dict(value)
+        with self._lock:
+            self._remember(key, expires_at, value)
+            self.counters["stores"] += 1
+            if self._db is None:
+                return
+            self._unwritten[key] = (expires_at, value)
+            if self._writer_scheduled:
+                return
+            self._writer_scheduled = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        # An executor job starts at once and is waited for when the loop shuts down
+        loop.run_in_executor(None, self.flush)
+
+    def flush(self) -> int:
+        """Write every queued entry to SQLite in one transaction. Returns the number written."""
+        if self._db is None:
+            return 0
+        # Taking the rows under the disk lock keeps successive writes of a key in order
+        with self._db_lock:
+            with self._lock:
+                rows, self._unwritten = self._unwritten, {}
+                self._writer_scheduled = False
+            if rows:
+                self._db.executemany(
+                    f"INSERT OR REPLACE INTO {self._table} (key, version, expires_at, value) VALUES (?, ?, ?, ?)",
+                    [(key, self.version, expires_at, json.dumps(value)) for key, (expires_at, value) in rows.items()]
+                )
+                self._db.commit()
+        return len(rows)
+
+    def _remember(self, key: str, expires_at: float, value: Dict) -> None:
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def warm(self) -> int:
+        """
+        Load the most recently stored unexpired entries from disk into the memory
+        tier, up to max_entries. Safe to run in a worker thread while serving.
+        Returns the number of entries loaded.
+        """
+        if self._db is None:
+            return 0
+        with self._db_lock:
+            rows = self._db.execute(
+                f"SELECT key, expires_at, value FROM {self._table} WHERE version = ? AND expires_at > ? "
+                "ORDER BY expires_at DESC LIMIT ?",
+                (self.version, time.time(), self.max_entries)
+            ).fetchall()
+        # Decode outside the lock so lookups are not held up; oldest first keeps the LRU order
+        decoded = [(key, expires_at, json.loads(value)) for key, expires_at, value in reversed(rows)]
+        with self._lock:
+            for key, expires_at, value in decoded:
+                if key not in self._memory:
+                    self._remember(key, expires_at, value)
+        return len(decoded)
+
+    def is_pending(self, key: str) -> bool:
+        """True while an upstream call for key is in flight (a lookup now would be coalesced)."""
+        return key in self._inflight
+
+    async def get_or_create(self, key: str, factory: Callable[[], Awaitable[Tuple[Dict, bool]]]) -> Dict:
+        """
+        Return the cached value for key, or await factory() to create it.
+        factory returns (value, cacheable); only cacheable values are stored.
+        """
+        cached = self._get_memory(key)
+        if cached is not None:
+            return cached
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.counters["coalesced"] += 1
+            return dict(await asyncio.shield(pending))
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            stored = (await self._load_async([key])).get(key)
+            if stored is not None:
+                future.set_result(stored)
+                return dict(stored)
+            value, cacheable = await factory()
+            if cacheable:
+                self.put(key, value)
+            future.set_result(value)
+            return dict(value)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()   # mark retrieved when nobody was waiting
+            raise
+        finally:
+            del self._inflight[key]
+
+    def get_or_create_many(self, keys: List[str],
+                           factory: Callable[[List[str]], Awaitable[Dict[str, Tuple[Dict, bool]]]]) -> List[asyncio.Future]:
+        """
+        One future per key. Keys in memory resolve at once and keys already
+        being created join that call; the rest are looked up on disk, and those
+        not found are created together by a single factory(missing_keys) call
+        returning {key: (value, cacheable)}.
+        The factory runs as its own task, so callers may stop waiting without
+        cancelling it. Resolved values are shared: copy before mutating.
+        """
+        loop = asyncio.get_running_loop()
+        futures, missing = [], []
+        for key in keys:
+            cached = self._get_memory(key)
+            if cached is not None:
+                future = loop.create_future()
+                future.set_result(cached)
+            elif key in self._inflight:
+                self.counters["coalesced"] += 1
+                future = self._inflight[key]
+            else:
+                future = self._inflight[key] = loop.create_future()
+                missing.append(key)
+            futures.append(future)
+        if missing:
+            task = loop.create_task(self._create_many(missing, factory))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return futures
+
+    async def _create_many(self, keys: List[str], factory) -> None:
+        try:
+            stored = await self._load_async(keys)
+            for key, value in stored.items():
+                self._inflight.pop(key).set_result(value)
+            keys = [key for key in keys if key not in stored]
+            created = await factory(keys) if keys else {}
+            for key in keys:
+                value, cacheable = created[key]
+                if cacheable:
+                    self.put(key, value)
+                self._inflight.pop(key).set_result(value)
+        except BaseException as e:
+            for key in keys:
+                future = self._inflight.pop(key, None)
+                if future is None or future.done():
+                    continue
+                if isinstance(e, asyncio.CancelledError):
+                    future.cancel()
+                else:
+                    future.set_exception(e)
+                    future.exception()   # mark retrieved when nobody was waiting
+            if not isinstance(e, Exception):
+                raise
+
+    def stats(self) -> Dict:
+        hits = sum(self.counters[name] for name in self._hit_counters)
+        lookups = hits + self.counters["misses"]
+        return {
+            **self.counters,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self._memory),
+            "version": self.version
+        }
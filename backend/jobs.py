@@ -0,0 +1,215 @@
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from cpic_rules import knowledge_base
+from llm_explainer import LLM_TIMEOUT_SECONDS
+from pipeline import parse_vcf_path, evaluate_drug, explain_all, assemble_result, unsupported_result
+
+STAGES = ("parse", "rules", "explanations")
+FINISHED = ("done", "failed")
+
+
+class JobManager:
+    """
+    In-process job queue for long-running analyses.
+    A bounded pool of asyncio workers runs parse -> rules -> explanations for
+    each submitted upload and records per-stage progress and timings. When a
+    job directory is configured, uploads and job state are kept on disk so
+    queued and interrupted jobs are picked up again after a restart.
+    """
+
+    def __init__(self, workers: int = 2, job_dir: Optional[str] = None, ttl_seconds: int = 24 * 3600):
+        self.workers = workers
+        self.ttl_seconds = ttl_seconds
+        self.jobs = {}
+        self._events = {}
+        self._queue = None
+        self._tasks = []
+        self._db = None
+        # Without a job directory uploads go to a temporary one that only lives between start() and stop()
+        self._temporary_uploads = not job_dir
+        self.upload_dir = os.path.join(job_dir, "uploads") if job_dir else None
+
+        if job_dir:
+            os.makedirs(self.upload_dir, exist_ok=True)
+            self._db = sqlite3.connect(os.path.join(job_dir, "jobs.sqlite3"), check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, state TEXT NOT NULL)")
+            self._db.commit()
+
+    async def start(self) -> None:
+        self._queue = asyncio.Queue()
+        if self._temporary_uploads:
+            self.upload_dir = tempfile.mkdtemp(prefix="pharmaguard-jobs-")
+        if self._db is not None:
+            for (state,) in self._db.execute("SELECT state FROM jobs"):
+                job = json.loads(state)
+                self.jobs[job["id"]] = job
+                self._events[job["id"]] = asyncio.Event()
+                if job["status"] in FINISHED:
+                    self._events[job["id"]].set()
+                elif os.path.exists(job["path"]):
+                    # Interrupted or never started: run again from the beginning
+                    self._reset(job)
+                    self._queue.put_nowait(job["id"])
+                else:
+                    self._fail(job, "Upload was lost before the job could run")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._temporary_uploads and self.upload_dir is not None:
+            shutil.rmtree(self.upload_dir, ignore_errors=True)
+            self.upload_dir = None
+
+    def new_upload_path(self, filename: str) -> str:
+        fd, path = tempfile.mkstemp(dir=self.upload_dir, suffix=".vcf.gz" if filename.endswith(".gz") else ".vcf")
+        os.close(fd)
+        return path
+
+    def submit(self, path: str, filename: str, drug_list: List[str]) -> Dict:
+        self._purge_expired()
+        job = {
+            "id":         uuid.uuid4().hex,
+            "filename":   filename,
+            "path":       path,
+            "drugs":      drug_list,
+            "created_at": time.time()
+        }
+        self._reset(job)
+        self.jobs[job["id"]] = job
+        self._events[job["id"]] = asyncio.Event()
+        self._save(job)
+        self._queue.put_nowait(job["id"])
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        return self.jobs.get(job_id)
+
+    async def wait(self, job_id: str, timeout: float) -> Optional[Dict]:
+        """Long-poll: return the job once it finishes or when timeout expires."""
+        job = self.jobs.get(job_id)
+        if job is None or job["status"] in FINISHED or timeout <= 0:
+            return job
+        try:
+            await asyncio.wait_for(self._events[job_id].wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return job
+
+    def status(self, job: Dict) -> Dict:
+        """Public view of a job, without its result payload."""
+        return {k: v for k, v in job.items() if k not in ("path", "result")}
+
+    def stats(self) -> Dict:
+        counts = {}
+        for job in self.jobs.values():
+            counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return {"workers": self.workers, "queue_depth": self._queue.qsize() if self._queue else 0, "jobs": counts}
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            job = self.jobs.get(job_id)
+            if job is None:
+                continue
+            try:
+                await self._run(job)
+            except Exception as e:
+                self._fail(job, f"Job failed: {str(e)}")
+
+    async def _run(self, job: Dict) -> None:
+        job["status"] = "running"
+        job["started_at"] = time.time()
+        self._save(job)
+
+        self._begin(job, "parse")
+        try:
+            parsed_vcf = await run_in_threadpool(parse_vcf_path, job["path"])
+        except Exception as e:
+            return self._fail(job, f"Could not read VCF file: {str(e)}")
+        if not parsed_vcf["parse_success"] and parsed_vcf["total_variants"] == 0:
+            return self._fail(job, "VCF file contains no parseable variants")
+        self._end(job, "parse")
+
+        self._begin(job, "rules")
+        rules = knowledge_base(parsed_vcf["knowledge_base_version"]).gene_drug_rules
+        evaluations = [evaluate_drug(parsed_vcf, d) if d in rules else None for d in job["drugs"]]
+        self._end(job, "rules")
+
+        self._begin(job, "explanations")
+        stage = job["stages"]["explanations"]
+        stage["total"] = sum(1 for e in evaluations if e is not None)
+
+        # Nobody is waiting on the response, so give the LLM its full timeout
+        explanations = iter(await explain_all([e for e in evaluations if e is not None], budget=LLM_TIMEOUT_SECONDS))
+        stage["completed"] = stage["total"]
+        self._end(job, "explanations")
+
+        start_time = job["started_at"]
+        patient_id = parsed_vcf["patient_id"]
+        results = [
+            assemble_result(patient_id, e, next(explanations), parsed_vcf, start_time) if e is not None
+            else unsupported_result(patient_id, drug, parsed_vcf, start_time)
+            for drug, e in zip(job["drugs"], evaluations)
+        ]
+        job["result"] = results[0] if len(results) == 1 else results
+        self._finish(job, "done")
+
+    def _reset(self, job: Dict) -> None:
+        job.update(status="queued", error=None, result=None, started_at=None, finished_at=None,
+                   stages={name: {"status": "pending", "seconds": None} for name in STAGES})
+        job["stages"]["explanations"].update(completed=0, total=None)
+
+    def _begin(self, job: Dict, name: str) -> None:
+        job["stages"][name].update(status="running", started=time.time())
+        job["current_stage"] = name
+
+    def _end(self, job: Dict, name: str) -> None:
+        stage = job["stages"][name]
+        stage["seconds"] = round(time.time() - stage.pop("started"), 4)
+        stage["status"] = "done"
+        self._save(job)
+
+    def _fail(self, job: Dict, error: str) -> None:
+        job["error"] = error
+        self._finish(job, "failed")
+
+    def _finish(self, job: Dict, status: str) -> None:
+        job["status"] = status
+        job["finished_at"] = time.time()
+        job.pop("current_stage", None)
+        for stage in job["stages"].values():
+            if stage.pop("started", None) is not None:
+                stage["status"] = status
+        self._save(job)
+        if os.path.exists(job["path"]):
+            os.remove(job["path"])
+        self._events[job["id"]].set()
+
+    def _save(self, job: Dict) -> None:
+        if self._db is not None:
+            self._db.execute("INSERT OR REPLACE INTO jobs (id, state) VALUES (?, ?)", (job["id"], json.dumps(job)))
+            self._db.commit()
+
+    def _purge_expired(self) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        expired = [j["id"] for j in self.jobs.values() if j["status"] in FINISHED and j["finished_at"] < cutoff]
+        for job_id in expired:
+            del self.jobs[job_id]
+            del self._events[job_id]
+            if self._db is not None:
+                self._db.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        if expired and self._db is not None:
+            self._db.commit()
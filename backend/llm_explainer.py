@@ -1,9 +1,86 @@
 import os
+import gzip
 import json
-import urllib.request
-from typing import Dict, List
+import asyncio
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+from explanation_cache import ExplanationCache
+from metrics import LLM_SECONDS, LLM_IN_FLIGHT, LLM_WAITING, LLM_FALLBACKS, LLM_CIRCUIT_STATE
+
+if TYPE_CHECKING:
+    import httpx
 
 GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")
+GEMINI_URL     = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent"
+LLM_TIMEOUT_SECONDS = 30
+# Upper bound on Gemini calls in flight across all requests of this process
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "8"))
+# How long a request waits for the LLM before answering with the template explanation;
+# the call itself carries on in the background and fills the cache for the next request.
+# A multi-drug call generates about as much text per drug as a single one, so its budget
+# grows by LLM_BUDGET_PER_DRUG_SECONDS for each drug after the first.
+LLM_BUDGET_SECONDS = float(os.environ.get("LLM_BUDGET_SECONDS") or "3")
+LLM_BUDGET_PER_DRUG_SECONDS = float(os.environ.get("LLM_BUDGET_PER_DRUG_SECONDS") or "2")
+# Most drugs explained by one multi-drug call; output tokens grow with each drug
+LLM_BATCH_SIZE = int(os.environ.get("LLM_BATCH_SIZE") or "8")
+LLM_MAX_OUTPUT_TOKENS = 8192
+
+# Stop calling Gemini after repeated failures; probe again after the reset interval
+LLM_BREAKER = CircuitBreaker(
+    failure_threshold=int(os.environ.get("LLM_BREAKER_FAILURES") or "5"),
+    reset_seconds=float(os.environ.get("LLM_BREAKER_RESET_SECONDS") or "30"),
+    half_open_probes=int(os.environ.get("LLM_BREAKER_PROBES") or "1"),
+    gauge=LLM_CIRCUIT_STATE
+)
+
+# Bump when the prompt or model changes so stale cached explanations are ignored
+PROMPT_VERSION = "gemini-1.5-flash/v1"
+
+EXPLANATION_CACHE = ExplanationCache(
+    max_entries=int(os.environ.get("EXPLANATION_CACHE_SIZE", "1024")),
+    db_path=os.environ.get("EXPLANATION_CACHE_DB",
+                           os.path.join(os.path.dirname(os.path.abspath(__file__)), "explanation_cache.sqlite3")),
+    ttl_seconds=int(os.environ.get("EXPLANATION_CACHE_TTL", str(7 * 24 * 3600))),
+    version=PROMPT_VERSION,
+    extra_hits=("pregenerated_hits",)
+)
+
+# Offline-generated explanations for every reachable outcome (see pregenerate_explanations.py)
+EXPLANATION_TABLE_PATH = os.environ.get("EXPLANATION_TABLE",
+                                        os.path.join(os.path.dirname(os.path.abspath(__file__)), "explanations.json.gz"))
+PREGENERATED = {}
+
+# The fields of an explanation, in the order the prompts ask for them
+EXPLANATION_FIELDS = ("summary", "mechanism_explanation", "patient_friendly",
+                      "clinical_significance", "monitoring_parameters", "alternative_drugs")
+
+# One pooled keep-alive client (and concurrency gate) per event loop
+_client_state = {"loop": None, "client": None, "semaphore": None}
+
+
+def _get_client():
+    # httpx is imported on first use (or by the startup warm-up) to keep it off the cold-start path
+    import httpx
+    loop = asyncio.get_running_loop()
+    if _client_state["loop"] is not loop:
+        _client_state["loop"]      = loop
+        _client_state["client"]    = httpx.AsyncClient(
+            timeout=LLM_TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_connections=LLM_MAX_CONCURRENCY,
+                                max_keepalive_connections=LLM_MAX_CONCURRENCY)
+        )
+        _client_state["semaphore"] = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return _client_state["client"], _client_state["semaphore"]
+
+
+async def close_client():
+    """Close the pooled HTTP client; called on application shutdown."""
+    client = _client_state["client"]
+    _client_state.update(loop=None, client=None, semaphore=None)
+    if client is not None:
+        await client.aclose()
 
 def _clean_severity_text(severity: str) -> str:
     mapping = {
@@ -15,16 +92,12 @@ def _clean_severity_text(severity: str) -> str:
     }
     return mapping.get(severity, "clinical risk requiring evaluation")
 
-def generate_clinical_explanation(
+def build_prompt(
     drug: str, gene: str, phenotype: str, diplotype: str,
-    risk_label: str, severity: str, detected_variants: List[Dict],
+    risk_label: str, severity: str, variant_list: str,
     recommendation: str, mechanism: str
-) -> Dict:
-
-    variant_list = ", ".join([v.get("rsid", "unknown") for v in detected_variants]) if detected_variants else "None"
-    star_alleles  = ", ".join([v.get("star_allele", "unknown") for v in detected_variants]) if detected_variants else "*1/*1 (reference)"
-
-    prompt = f"""You are a clinical pharmacogenomics expert. Generate a structured clinical explanation.
+) -> str:
+    return f"""You are a clinical pharmacogenomics expert. Generate a structured clinical explanation.
 
 PATIENT PROFILE:
 - Drug: {drug}
@@ -48,67 +121,326 @@ Return ONLY valid JSON with EXACTLY these fields:
 
 Be specific, cite exact variants ({variant_list}) if present, reference CPIC guidelines. Return ONLY valid JSON, no markdown."""
 
+
+def build_batch_prompt(profiles: List[Dict]) -> str:
+    """One prompt for several drugs of the same patient; profiles hold build_prompt's arguments."""
+    sections = "\n\n".join(f"""DRUG: {p["drug"]}
+- Gene: {p["gene"]}
+- Diplotype: {p["diplotype"]}
+- Phenotype: {p["phenotype"]}
+- Risk: {p["risk_label"]} (Severity: {p["severity"]})
+- Variants: {p["variant_list"]}
+- Mechanism: {p["mechanism"]}
+- Recommendation: {p["recommendation"]}""" for p in profiles)
+    drugs = ", ".join(p["drug"] for p in profiles)
+
+    return f"""You are a clinical pharmacogenomics expert. Generate a structured clinical explanation for each drug below. All drugs are for the same patient.
+
+Phenotypes: PM=Poor Metabolizer, IM=Intermediate, NM=Normal, RM=Rapid, URM=Ultrarapid.
+
+{sections}
+
+Return ONLY valid JSON: one object with a key for each drug ({drugs}), spelled exactly as given, whose value has EXACTLY these fields:
+{{
+  "<DRUG>": {{
+    "summary": "2-3 sentence clinical summary citing that drug's specific variants and their impact on its therapy. If Variants is 'None', state that no actionable variants were detected.",
+    "mechanism_explanation": "Detailed molecular explanation of how the gene's variants affect the drug",
+    "patient_friendly": "Simple 2-3 sentence explanation for a patient without medical background",
+    "clinical_significance": "Why this finding matters clinically and what happens if ignored",
+    "monitoring_parameters": "Specific lab tests or clinical parameters to monitor",
+    "alternative_drugs": "Specific alternative medications to consider if applicable"
+  }}
+}}
+
+Be specific, cite each drug's exact variants if present, reference CPIC guidelines. Return ONLY valid JSON, no markdown."""
+
+
+async def _request_explanation(prompt: str) -> Dict:
+    """Ask Gemini for an explanation. Raises on any upstream or parsing failure."""
+    result = await _request_json(prompt, 1000)
+    result.pop("error", None)   # NEVER let error leak out
+    return result
+
+
+async def _request_batch(profiles: List[Dict]) -> List[Optional[Dict]]:
+    """
+    Ask Gemini to explain several drugs in one call. Returns one explanation per
+    profile, or None where its section is missing or malformed.
+    """
+    prompt = build_batch_prompt(profiles)
+    result = await _request_json(prompt, min(1000 * len(profiles), LLM_MAX_OUTPUT_TOKENS))
+    sections = []
+    for p in profiles:
+        section = result.get(p["drug"]) if isinstance(result, dict) else None
+        if isinstance(section, dict):
+            section.pop("error", None)
+            if not all(isinstance(section.get(f), str) and section[f].strip() for f in EXPLANATION_FIELDS):
+                section = None
+        else:
+            section = None
+        sections.append(section)
+    return sections
+
+
+async def _request_json(prompt: str, max_tokens: int):
+    """
+    Send one prompt and parse the JSON reply. Raises on any upstream or parsing
+    failure, and with CircuitOpenError without calling out while the circuit is open.
+    """
+    if not GEMINI_API_KEY:
+        raise RuntimeError("GEMINI_API_KEY is not set")
+    if not LLM_BREAKER.allow():
+        raise CircuitOpenError("Gemini circuit is open")
+    import httpx
+    payload = {
+        "contents": [{"parts": [{"text": prompt}]}],
+        "generationConfig": {"temperature": 0.3, "maxOutputTokens": max_tokens}
+    }
+    try:
+        response = await _post(payload)
+    except httpx.HTTPError:
+        LLM_BREAKER.record_failure()
+        raise
+    except BaseException:
+        LLM_BREAKER.record_abandoned()
+        raise
+    LLM_BREAKER.record_success()
+
+    data = response.json()
+    text = data["candidates"][0]["content"]["parts"][0]["text"].strip()
+    if "```" in text:
+        text = text.split("```")[1]
+        if text.startswith("json"):
+            text = text[4:]
+    return json.loads(text.strip())
+
+
+async def _post(payload: Dict) -> "httpx.Response":
+    """POST to Gemini under the concurrency limit; raises httpx.HTTPError on timeouts and error statuses."""
+    client, semaphore = _get_client()
+    LLM_WAITING.inc()
     try:
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={GEMINI_API_KEY}"
-        payload = json.dumps({
-            "contents": [{"parts": [{"text": prompt}]}],
-            "generationConfig": {"temperature": 0.3, "maxOutputTokens": 1000}
-        }).encode("utf-8")
-
-        req = urllib.request.Request(url, data=payload,
-            headers={"Content-Type": "application/json"}, method="POST")
-
-        with urllib.request.urlopen(req, timeout=30) as response:
-            data = json.loads(response.read().decode("utf-8"))
-            text = data["candidates"][0]["content"]["parts"][0]["text"].strip()
-            if "```" in text:
-                text = text.split("```")[1]
-                if text.startswith("json"):
-                    text = text[4:]
-            result = json.loads(text.strip())
-            result.pop("error", None)   # NEVER let error leak out
-            return result
-
-    except Exception:
-        # Clean fallback — absolutely NO error field
-        severity_text = _clean_severity_text(severity)
-
-        if risk_label == "Ineffective":
-            patient_msg   = f"Your genetic profile indicates that {drug} will likely not work for you due to variants in your {gene} gene. Your doctor should consider an alternative medication."
-            significance  = f"Without pharmacogenomic-guided prescribing this patient may receive a drug that provides no therapeutic benefit, potentially delaying effective treatment."
-        elif risk_label == "Toxic":
-            patient_msg   = f"Your genetic profile indicates that {drug} could be dangerous at standard doses due to variants in your {gene} gene. Your doctor must adjust or avoid this medication."
-            significance  = f"Without pharmacogenomic-guided prescribing this patient faces serious risk of drug toxicity which could be life-threatening."
-        elif risk_label == "Adjust Dosage":
-            patient_msg   = f"Your genetic profile suggests the standard dose of {drug} may not be right for you due to variants in your {gene} gene. Your doctor should adjust your dose accordingly."
-            significance  = f"Without dose adjustment this patient may experience suboptimal therapeutic outcomes or increased side effects from {drug}."
+        await semaphore.acquire()
+    finally:
+        LLM_WAITING.dec()
+    LLM_IN_FLIGHT.inc()
+    try:
+        response = await client.post(GEMINI_URL, params={"key": GEMINI_API_KEY}, json=payload)
+    finally:
+        LLM_IN_FLIGHT.dec()
+        semaphore.release()
+    response.raise_for_status()
+    return response
+
+
+def fallback_explanation(
+    drug: str, gene: str, phenotype: str, diplotype: str,
+    risk_label: str, severity: str, detected_variants: List[Dict],
+    recommendation: str, mechanism: str
+) -> Dict:
+    """Deterministic rule-based explanation used whenever the LLM is unavailable."""
+    variant_list = ", ".join([v.get("rsid", "unknown") for v in detected_variants]) if detected_variants else "None"
+    severity_text = _clean_severity_text(severity)
+
+    if risk_label == "Ineffective":
+        patient_msg   = f"Your genetic profile indicates that {drug} will likely not work for you due to variants in your {gene} gene. Your doctor should consider an alternative medication."
+        significance  = f"Without pharmacogenomic-guided prescribing this patient may receive a drug that provides no therapeutic benefit, potentially delaying effective treatment."
+    elif risk_label == "Toxic":
+        patient_msg   = f"Your genetic profile indicates that {drug} could be dangerous at standard doses due to variants in your {gene} gene. Your doctor must adjust or avoid this medication."
+        significance  = f"Without pharmacogenomic-guided prescribing this patient faces serious risk of drug toxicity which could be life-threatening."
+    elif risk_label == "Adjust Dosage":
+        patient_msg   = f"Your genetic profile suggests the standard dose of {drug} may not be right for you due to variants in your {gene} gene. Your doctor should adjust your dose accordingly."
+        significance  = f"Without dose adjustment this patient may experience suboptimal therapeutic outcomes or increased side effects from {drug}."
+    else:
+        patient_msg   = f"Your genetic profile indicates that {drug} can be used at standard doses. Your {gene} gene variants show normal drug metabolism."
+        significance  = f"This finding indicates {severity_text}. Standard dosing is appropriate for this patient."
+
+    if risk_label == "Ineffective":
+        article = "an"
+        risk_desc = "ineffective"
+    elif risk_label == "Adjust Dosage":
+        article = "an"
+        risk_desc = "adjusted dosage"
+    elif risk_label == "Toxic":
+        article = "a"
+        risk_desc = "toxic"
+    else:
+        article = "a"
+        risk_desc = risk_label.lower()
+
+    if detected_variants:
+        summary_text = f"This patient carries {gene} variants {diplotype} consistent with a {phenotype} phenotype, predicting {article} {risk_desc} response to {drug} therapy. Detected variants {variant_list} alter {gene} enzyme function per CPIC guidelines."
+    else:
+        summary_text = f"This patient carries {gene} {diplotype} consistent with a Normal Metabolizer phenotype. No clinically actionable pharmacogenomic variants were detected according to CPIC guidelines."
+
+    return {
+        "summary": summary_text,
+        "mechanism_explanation": mechanism,
+        "patient_friendly": patient_msg,
+        "clinical_significance": significance,
+        "monitoring_parameters": f"Monitor for signs of {drug} {'toxicity including adverse drug reactions' if risk_label == 'Toxic' else 'therapeutic failure' if risk_label == 'Ineffective' else 'dose-related effects'}. Consult clinical pharmacist for {gene}-specific therapeutic drug monitoring.",
+        "alternative_drugs": recommendation
+    }
+
+
+def explanation_key(
+    drug: str, gene: str, phenotype: str, diplotype: str,
+    risk_label: str, severity: str, detected_variants: List[Dict],
+    recommendation: str, mechanism: str
+) -> str:
+    """Cache/table key: the prompt depends on nothing but these fields."""
+    variant_list = ", ".join([v.get("rsid", "unknown") for v in detected_variants]) if detected_variants else "None"
+    return EXPLANATION_CACHE.make_key(drug, gene, phenotype, diplotype, risk_label,
+                                      severity, variant_list, recommendation, mechanism)
+
+
+def load_pregenerated(path: str = EXPLANATION_TABLE_PATH) -> int:
+    """
+    Load the offline explanation table. Entries built from the fallback template
+    are only used when no API key is configured, so they never shadow the LLM.
+    Returns the number of entries loaded.
+    """
+    entries = {}
+    if os.path.exists(path):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            table = json.load(f)
+        if table.get("version") == PROMPT_VERSION:
+            for key, entry in table["entries"].items():
+                if entry["source"] == "llm":
+                    entries[key] = entry["explanation"]
+                elif not GEMINI_API_KEY:
+                    entries[key] = {**entry["explanation"], "source": "template", "fallback_reason": "disabled"}
+    # Swapped in at the end: this runs in a worker thread while requests are served
+    PREGENERATED.clear()
+    PREGENERATED.update(entries)
+    return len(PREGENERATED)
+
+
+async def generate_clinical_explanation(
+    drug: str, gene: str, phenotype: str, diplotype: str,
+    risk_label: str, severity: str, detected_variants: List[Dict],
+    recommendation: str, mechanism: str, budget: Optional[float] = None
+) -> Dict:
+    explanation, _ = await explain_with_outcome(drug, gene, phenotype, diplotype, risk_label, severity,
+                                                detected_variants, recommendation, mechanism, budget)
+    return explanation
+
+
+async def explain_with_outcome(
+    drug: str, gene: str, phenotype: str, diplotype: str,
+    risk_label: str, severity: str, detected_variants: List[Dict],
+    recommendation: str, mechanism: str, budget: Optional[float] = None
+) -> Tuple[Dict, str]:
+    """The explanation and where it came from: pregenerated, hit, miss, coalesced or fallback (see explain_many)."""
+    request = {"drug": drug, "gene": gene, "phenotype": phenotype, "diplotype": diplotype,
+               "risk_label": risk_label, "severity": severity, "detected_variants": detected_variants,
+               "recommendation": recommendation, "mechanism": mechanism}
+    return (await explain_many([request], budget))[0]
+
+
+def _template(reason: str, request: Dict) -> Dict:
+    """Template explanation for one request, marked with why it was used."""
+    LLM_FALLBACKS.inc(1, reason)
+    return {**fallback_explanation(**request), "source": "template", "fallback_reason": reason}
+
+
+def _profile(request: Dict) -> Dict:
+    """build_prompt arguments for a request: the detected variants become the variant list."""
+    profile = {k: v for k, v in request.items() if k != "detected_variants"}
+    variants = request["detected_variants"]
+    profile["variant_list"] = ", ".join([v.get("rsid", "unknown") for v in variants]) if variants else "None"
+    return profile
+
+
+def default_budget(n_drugs: int) -> float:
+    """Seconds to wait for a call explaining n_drugs drugs (batches of up to LLM_BATCH_SIZE run in parallel)."""
+    n = min(max(n_drugs, 1), LLM_BATCH_SIZE)
+    return min(LLM_BUDGET_SECONDS + LLM_BUDGET_PER_DRUG_SECONDS * (n - 1), LLM_TIMEOUT_SECONDS)
+
+
+def _batches(keys: List[str], requests: Dict[str, Dict]) -> List[List[str]]:
+    """Group keys into calls of at most LLM_BATCH_SIZE drugs, never repeating a drug in one call."""
+    batches = []
+    for key in keys:
+        drug = requests[key]["drug"]
+        for batch in batches:
+            if len(batch) < LLM_BATCH_SIZE and all(requests[k]["drug"] != drug for k in batch):
+                batch.append(key)
+                break
         else:
-            patient_msg   = f"Your genetic profile indicates that {drug} can be used at standard doses. Your {gene} gene variants show normal drug metabolism."
-            significance  = f"This finding indicates {severity_text}. Standard dosing is appropriate for this patient."
-
-        if risk_label == "Ineffective":
-            article = "an"
-            risk_desc = "ineffective"
-        elif risk_label == "Adjust Dosage":
-            article = "an"
-            risk_desc = "adjusted dosage"
-        elif risk_label == "Toxic":
-            article = "a"
-            risk_desc = "toxic"
+            batches.append([key])
+    return batches
+
+
+async def explain_many(requests: List[Dict], budget: Optional[float] = None) -> List[Tuple[Dict, str]]:
+    """
+    Explanations for several drugs of one patient, each with its outcome:
+    pregenerated, hit, miss, coalesced or fallback. requests hold
+    generate_clinical_explanation's arguments.
+
+    Drugs not in the caches are explained together by one multi-drug LLM call.
+    A drug whose section of the reply is missing or malformed falls back to the
+    template on its own. The wait for the LLM is capped at budget seconds, by
+    default default_budget() of the drugs still pending; a call that misses the
+    deadline still finishes in the background and fills the cache. Template
+    explanations are marked with "source": "template" and a "fallback_reason":
+    error, malformed, deadline, circuit_open or disabled (no API key).
+    """
+    started = time.perf_counter()
+    results = [None] * len(requests)
+    keys = [explanation_key(**r) for r in requests]
+
+    todo = []
+    for i, key in enumerate(keys):
+        pregenerated = PREGENERATED.get(key)
+        if pregenerated is not None:
+            EXPLANATION_CACHE.counters["pregenerated_hits"] += 1
+            LLM_SECONDS.observe(0.0, "pregenerated")
+            results[i] = dict(pregenerated), "pregenerated"
         else:
-            article = "a"
-            risk_desc = risk_label.lower()
+            todo.append(i)
+    if not todo:
+        return results
+
+    outcomes = {keys[i]: "coalesced" if EXPLANATION_CACHE.is_pending(keys[i]) else "hit" for i in todo}
+    by_key = {keys[i]: requests[i] for i in todo}
+
+    async def create(batch: List[str], created: Dict) -> None:
+        reason = "malformed"
+        try:
+            if len(batch) == 1:
+                explanations = [await _request_explanation(build_prompt(**_profile(by_key[batch[0]])))]
+            else:
+                explanations = await _request_batch([_profile(by_key[k]) for k in batch])
+        except Exception as e:
+            explanations = [None] * len(batch)
+            reason = "disabled" if not GEMINI_API_KEY else "circuit_open" if isinstance(e, CircuitOpenError) else "error"
+        for key, explanation in zip(batch, explanations):
+            if explanation is None:
+                # Clean fallback — absolutely NO error field; never cached so the LLM is retried
+                outcomes[key] = "fallback"
+                created[key] = _template(reason, by_key[key]), False
+            else:
+                outcomes[key] = "miss"
+                created[key] = explanation, True
+
+    async def create_many(missing: List[str]) -> Dict:
+        created = {}
+        await asyncio.gather(*(create(batch, created) for batch in _batches(missing, by_key)))
+        return created
+
+    futures = EXPLANATION_CACHE.get_or_create_many([keys[i] for i in todo], create_many)
+    waiting = [f for f in futures if not f.done()]
+    if waiting:
+        await asyncio.wait(waiting, timeout=default_budget(len(waiting)) if budget is None else budget)
 
-        if detected_variants:
-            summary_text = f"This patient carries {gene} variants {diplotype} consistent with a {phenotype} phenotype, predicting {article} {risk_desc} response to {drug} therapy. Detected variants {variant_list} alter {gene} enzyme function per CPIC guidelines."
+    elapsed = time.perf_counter() - started
+    for i, future in zip(todo, futures):
+        if not future.done():
+            results[i] = _template("deadline", requests[i]), "fallback"
+        elif future.cancelled() or future.exception() is not None:
+            results[i] = _template("error", requests[i]), "fallback"
         else:
-            summary_text = f"This patient carries {gene} {diplotype} consistent with a Normal Metabolizer phenotype. No clinically actionable pharmacogenomic variants were detected according to CPIC guidelines."
-
-        return {
-            "summary": summary_text,
-            "mechanism_explanation": mechanism,
-            "patient_friendly": patient_msg,
-            "clinical_significance": significance,
-            "monitoring_parameters": f"Monitor for signs of {drug} {'toxicity including adverse drug reactions' if risk_label == 'Toxic' else 'therapeutic failure' if risk_label == 'Ineffective' else 'dose-related effects'}. Consult clinical pharmacist for {gene}-specific therapeutic drug monitoring.",
-            "alternative_drugs": recommendation
-        }
+            results[i] = dict(future.result()), outcomes[keys[i]]
+        LLM_SECONDS.observe(elapsed, results[i][1])
+    return results
@@ -1,22 +1,149 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-import datetime
 import time
+_IMPORT_STARTED = time.perf_counter()   # cold-start timing includes the framework imports below
+
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Dict, List, Optional, Tuple
+import asyncio
+import hmac
+import importlib
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
 
-from vcf_parser import parse_vcf, extract_pharmacogenomic_variants, determine_phenotype, get_diplotype
-from cpic_rules import GENE_DRUG_RULES, DRUG_TO_GENE
-from llm_explainer import generate_clinical_explanation
+from vcf_parser import VCFStreamParser
+from cpic_rules import current_kb, knowledge_base, reload_knowledge_base, rule_template
+from bgzf import MAX_DECOMPRESSED_BYTES, DecompressionLimitExceeded, GzipStreamDecoder, parse_index, read_header, region_chunks, read_chunks
+from llm_explainer import generate_clinical_explanation, close_client, load_pregenerated, EXPLANATION_CACHE, LLM_BREAKER
+from serializer import ResultResponse, encode_content
+from metrics import (STAGE_SECONDS, VARIANTS_PARSED, BYTES_INGESTED, STARTUP_SECONDS, RequestMetricsMiddleware,
+                     render as render_metrics)
+from result_cache import RESULT_CACHE
+from pipeline import CHUNK_SIZE, build_results, assemble_result, unsupported_result, evaluate_file, results_for_file
+from jobs import JobManager
+from admission import AdmissionController, AdmissionMiddleware
+from patient_store import PATIENT_STORE, check_profile_id, new_profile_id, parsed_from_profile
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
 
 app = FastAPI(title="PharmaGuard API", version="2.0.0")
 
+# Worker processes for /analyze/batch, one per core unless BATCH_WORKERS is set
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", os.cpu_count() or 1))
+_process_pool = None
+# Most bytes one /analyze/batch request may extract to disk; each file is also capped at MAX_DECOMPRESSED_BYTES
+MAX_BATCH_BYTES = int(os.environ.get("MAX_BATCH_BYTES") or str(4 * 1024 ** 3))
+
+# Background analysis jobs; set JOB_DIR to keep them across restarts
+JOB_MANAGER = JobManager(
+    workers=int(os.environ.get("JOB_WORKERS", "2")),
+    job_dir=os.environ.get("JOB_DIR") or None,
+    ttl_seconds=int(os.environ.get("JOB_TTL", str(24 * 3600)))
+)
+# Longest a client may hold a long-poll open, kept under the load balancer idle timeout
+JOB_MAX_WAIT_SECONDS = 50
+
+# POST /knowledge-base/reload requires this in the X-Reload-Token header, and is disabled until it is set
+KB_RELOAD_TOKEN = os.environ.get("KB_RELOAD_TOKEN", "")
+# Stored patient profiles (PATIENT_DB) are only reachable with this in the X-Patient-Token header;
+# like the reload token there is no open default, so the store stays closed until it is set
+PATIENT_TOKEN = os.environ.get("PATIENT_TOKEN", "")
+
+# Load shedding for the upload endpoints: bounded in-flight requests and upload bytes,
+# then a short wait queue, then 429/503 with Retry-After
+ADMISSION = AdmissionController(
+    max_requests=int(os.environ.get("ADMISSION_MAX_REQUESTS") or "16"),
+    max_bytes=int(os.environ.get("ADMISSION_MAX_BYTES") or str(1024 * 1024 * 1024)),
+    max_queue=int(os.environ.get("ADMISSION_QUEUE") or "32"),
+    queue_timeout=float(os.environ.get("ADMISSION_QUEUE_TIMEOUT") or "5"),
+    retry_after=int(os.environ.get("ADMISSION_RETRY_AFTER") or "2")
+)
+ADMITTED_PATHS = ("/analyze", "/analyze/cohort", "/analyze/batch", "/jobs")
+
+# Added first so CORS wraps it: the browser must be able to read a 429/503 and its Retry-After
+app.add_middleware(AdmissionMiddleware, controller=ADMISSION, paths=ADMITTED_PATHS)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After", "X-Profile-Id"],
 )
+app.add_middleware(RequestMetricsMiddleware)
+
+
+# Cold-start state reported by /ready; the caches fill in the background after startup
+WARMUP = {
+    "ready":                     False,
+    "import_seconds":            None,
+    "warmup_seconds":            None,
+    "pregenerated_explanations": 0,
+    "cached_explanations":       0,
+    "cached_results":            0,
+    "error":                     None
+}
+_warmup_task = None
+
+
+# Modules kept off the cold-start path; warm-up imports them once the app is serving
+DEFERRED_IMPORTS = ("cohort", "httpx", "concurrent.futures.process")   # cohort pulls in numpy
+
+
+def _import_deferred() -> None:
+    for name in DEFERRED_IMPORTS:
+        importlib.import_module(name)
+
+
+async def warm_up() -> None:
+    started = time.perf_counter()
+    try:
+        WARMUP["pregenerated_explanations"] = await run_in_threadpool(load_pregenerated)
+        WARMUP["cached_explanations"]       = await run_in_threadpool(EXPLANATION_CACHE.warm)
+        WARMUP["cached_results"]            = await run_in_threadpool(RESULT_CACHE.warm)
+        await run_in_threadpool(_import_deferred)
+    except Exception as e:
+        # Serving still works on cold caches; report it rather than stay unready
+        WARMUP["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        WARMUP["warmup_seconds"] = round(time.perf_counter() - started, 4)
+        WARMUP["ready"] = True
+        STARTUP_SECONDS.set(WARMUP["warmup_seconds"], "warmup")
+
+
+@app.on_event("startup")
+async def startup():
+    global _warmup_task
+    await JOB_MANAGER.start()
+    _warmup_task = asyncio.create_task(warm_up())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    global _process_pool
+    if _warmup_task is not None:
+        _warmup_task.cancel()
+    await JOB_MANAGER.stop()
+    await close_client()
+    if _process_pool is not None:
+        _process_pool.shutdown(cancel_futures=True)
+        _process_pool = None
+
+
+def get_process_pool() -> "ProcessPoolExecutor":
+    global _process_pool
+    if _process_pool is None:
+        from concurrent.futures import ProcessPoolExecutor   # pulls in multiprocessing
+        from multiprocessing import get_context
+        # Not fork: this process runs threads that may hold locks (SQLite caches, logging, metrics)
+        # a forked child would inherit held. Workers load the knowledge base themselves by version.
+        _process_pool = ProcessPoolExecutor(max_workers=BATCH_WORKERS, mp_context=get_context("spawn"))
+    return _process_pool
 
 
 @app.get("/")
@@ -26,140 +153,577 @@ def root():
 
 @app.get("/health")
 def health():
-    return {"status": "healthy"}
+    return {"status": "healthy", "knowledge_base_version": current_kb().version}
+
+
+@app.get("/ready")
+def ready():
+    """Readiness, unlike /health (liveness): 503 until the startup warm-up has finished."""
+    body = {"status": "ready" if WARMUP["ready"] else "warming", **WARMUP}
+    return JSONResponse(body, status_code=200 if WARMUP["ready"] else 503)
 
 
 @app.get("/supported-drugs")
 def supported_drugs():
+    kb = current_kb()
     return {
-        "drugs": list(GENE_DRUG_RULES.keys()),
-        "genes": list(DRUG_TO_GENE.values())
+        "drugs": list(kb.gene_drug_rules.keys()),
+        "genes": list(kb.drug_to_gene.values()),
+        "knowledge_base_version": kb.version
     }
 
 
-def build_single_result(patient_id, drug, parsed_vcf, start_time):
-    """Build one RIFT-compliant result object for a single drug."""
+@app.get("/knowledge-base")
+def knowledge_base_info():
+    kb = current_kb()
+    return {
+        "version":  kb.version,
+        "drugs":    len(kb.gene_drug_rules),
+        "genes":    len(kb.pgx_genes),
+        "variants": len(kb.variant_star_alleles)
+    }
 
-    rule      = GENE_DRUG_RULES[drug]
-    gene      = rule["gene"]
-    pgx_vars  = extract_pharmacogenomic_variants(parsed_vcf, gene)
-    phenotype = determine_phenotype(pgx_vars, gene)
-    risk_info = rule["phenotype_risks"].get(phenotype, rule["phenotype_risks"]["NM"])
-    diplotype = get_diplotype(pgx_vars)
 
-    llm_explanation = generate_clinical_explanation(
-        drug=drug, gene=gene, phenotype=phenotype, diplotype=diplotype,
-        risk_label=risk_info["risk_label"], severity=risk_info["severity"],
-        detected_variants=pgx_vars, recommendation=risk_info["recommendation"],
-        mechanism=risk_info["mechanism"]
-    )
-    # Guarantee no error key ever reaches output
-    llm_explanation.pop("error", None)
+def check_token(expected: str, supplied: Optional[str], detail: str, disabled: str) -> None:
+    """403 unless supplied matches expected; an empty expected token shuts every caller out with disabled."""
+    if not expected:
+        raise HTTPException(status_code=403, detail=disabled)
+    if not hmac.compare_digest((supplied or "").encode(), expected.encode()):
+        raise HTTPException(status_code=403, detail=detail)
 
-    processing_time = round(time.time() - start_time, 2)
 
-    return {
-        "patient_id": patient_id,
-        "drug": drug,
-        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
-        "risk_assessment": {
-            "risk_label":       risk_info["risk_label"],
-            "confidence_score": risk_info["confidence_score"],
-            "severity":         risk_info["severity"]
-        },
-        "pharmacogenomic_profile": {
-            "primary_gene":      gene,
-            "diplotype":         diplotype,
-            "phenotype":         phenotype,
-            "detected_variants": pgx_vars
-        },
-        "clinical_recommendation": {
-            "action":          risk_info["recommendation"],
-            "cpic_guideline":  f"CPIC Guideline for {drug} and {gene}",
-            "mechanism":       risk_info["mechanism"]
-        },
-        "llm_generated_explanation": llm_explanation,
-        "quality_metrics": {
-            "vcf_parsing_success":          parsed_vcf["parse_success"],
-            "total_variants_in_vcf":        parsed_vcf["total_variants"],
-            "pharmacogenomic_variants_found": len(pgx_vars),
-            "processing_time_seconds":      processing_time
-        }
-    }
+@app.post("/knowledge-base/reload")
+async def reload_knowledge_base_files(x_reload_token: Optional[str] = Header(None)):
+    """
+    Re-read the knowledge-base files and swap them in for new requests.
+    Invalid files are rejected and the current knowledge base stays active.
+    """
+    check_token(KB_RELOAD_TOKEN, x_reload_token, "Invalid reload token",
+                "Knowledge-base reload requires KB_RELOAD_TOKEN to be configured")
+    previous = current_kb().version
+    try:
+        kb = await run_in_threadpool(reload_knowledge_base)
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Knowledge base not reloaded: {str(e)}")
+    return {"version": kb.version, "previous_version": previous, "changed": kb.version != previous}
 
 
-@app.post("/analyze")
-async def analyze(
-    vcf_file: UploadFile = File(...),
-    drugs:    str        = Form(...)
-):
-    start_time = time.time()
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Per-stage latency histograms and throughput counters in Prometheus text format."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    return {"explanations": EXPLANATION_CACHE.stats(), "results": RESULT_CACHE.stats(), "jobs": JOB_MANAGER.stats(),
+            "admission": ADMISSION.stats(), "llm_circuit": LLM_BREAKER.stats(),
+            "patients": PATIENT_STORE.stats() if PATIENT_STORE is not None else None}
+
+
+def parse_indexed_vcf(fileobj, index_raw: bytes, parser: VCFStreamParser) -> Dict:
+    """Parse only the BGZF blocks of a .vcf.gz that overlap the pharmacogene loci."""
+    with STAGE_SECONDS.time("parse"):
+        index  = parse_index(index_raw)
+        parser.feed(read_header(fileobj))
+        for data in read_chunks(fileobj, region_chunks(index, parser.kb.pgx_regions)):
+            parser.feed(data)
+        parsed_vcf = parser.close()
+    VARIANTS_PARSED.inc(parsed_vcf["total_variants"])
+    # Records outside the loci were never read; the index still knows how many exist
+    if index["n_records"] is not None:
+        parsed_vcf["total_variants"] = index["n_records"]
+    return parsed_vcf
+
 
-    # Validate file
-    if not vcf_file.filename.endswith(".vcf"):
-        raise HTTPException(status_code=400, detail="Only .vcf files are accepted")
+async def read_vcf_upload(vcf_file: UploadFile, index_file: Optional[UploadFile],
+                          parser: VCFStreamParser) -> Dict:
+    """Stream a .vcf or .vcf.gz upload through the parser, seeking via the index if one was sent."""
+    if index_file is not None:
+        with STAGE_SECONDS.time("upload_read"):
+            index_raw = await index_file.read()
+        BYTES_INGESTED.inc(len(index_raw) + (vcf_file.size or 0))
+        return await run_in_threadpool(parse_indexed_vcf, vcf_file.file, index_raw, parser)
+
+    decoder = GzipStreamDecoder() if vcf_file.filename.endswith(".gz") else None
+    read_seconds = parse_seconds = 0.0
+    n_bytes = 0
+    while True:
+        started = time.perf_counter()
+        chunk   = await vcf_file.read(CHUNK_SIZE)
+        read    = time.perf_counter()
+        read_seconds += read - started
+        if not chunk:
+            break
+        n_bytes += len(chunk)
+        if decoder is None:
+            parser.feed(chunk)
+        else:
+            for piece in decoder.decompress(chunk):
+                parser.feed(piece)
+        parse_seconds += time.perf_counter() - read
+
+    started    = time.perf_counter()
+    parsed_vcf = parser.close()
+    STAGE_SECONDS.observe(read_seconds, "upload_read")
+    STAGE_SECONDS.observe(parse_seconds + time.perf_counter() - started, "parse")
+    BYTES_INGESTED.inc(n_bytes)
+    VARIANTS_PARSED.inc(parsed_vcf["total_variants"])
+    return parsed_vcf
+
+
+async def parse_upload(vcf_file: UploadFile, index_file: Optional[UploadFile],
+                       parser: VCFStreamParser) -> Dict:
+    """Validate the uploaded file names and parse the VCF, mapping failures to HTTP 400."""
+    if not vcf_file.filename.endswith((".vcf", ".vcf.gz")):
+        raise HTTPException(status_code=400, detail="Only .vcf or .vcf.gz files are accepted")
+    if index_file is not None:
+        if not vcf_file.filename.endswith(".vcf.gz"):
+            raise HTTPException(status_code=400, detail="An index can only be used with a bgzipped .vcf.gz file")
+        if not index_file.filename.endswith((".tbi", ".csi")):
+            raise HTTPException(status_code=400, detail="Only .tbi or .csi index files are accepted")
 
     try:
-        content     = await vcf_file.read()
-        vcf_content = content.decode("utf-8")
+        return await read_vcf_upload(vcf_file, index_file, parser)
+    except DecompressionLimitExceeded as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Could not read VCF file: {str(e)}")
 
-    parsed_vcf = parse_vcf(vcf_content)
-    if not parsed_vcf["parse_success"] and parsed_vcf["total_variants"] == 0:
-        raise HTTPException(status_code=400, detail="VCF file contains no parseable variants")
 
+STREAM_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+
+
+def stream_format(stream: Optional[str], request: Request) -> Optional[str]:
+    """Streaming is opt-in: a stream=ndjson|sse form field or a matching Accept header."""
+    if stream:
+        if stream.lower() not in STREAM_MEDIA_TYPES:
+            raise HTTPException(status_code=400, detail="stream must be 'ndjson' or 'sse'")
+        return stream.lower()
+    accept = request.headers.get("accept", "")
+    for fmt, media_type in STREAM_MEDIA_TYPES.items():
+        if media_type in accept:
+            return fmt
+    return None
+
+
+def encode_record(fmt: str, event: str, record: Dict) -> bytes:
+    with STAGE_SECONDS.time("serialize"):
+        data = encode_content(record)
+    if fmt == "sse":
+        return b"event: " + event.encode("utf-8") + b"\ndata: " + data + b"\n\n"
+    return data + b"\n"
+
+
+async def completed_results(ready: List[Dict], pending: List[Awaitable[List[Dict]]]) -> AsyncIterator[Dict]:
+    """Yield the ready results, then each pending batch of results as soon as it finishes."""
+    for result in ready:
+        yield result
+    tasks = [asyncio.ensure_future(p) for p in pending]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            for result in await next_done:
+                yield result
+    finally:
+        # Client went away: don't leave explanation calls running on its behalf
+        for task in tasks:
+            task.cancel()
+
+
+def stream_response(fmt: str, results: AsyncIterator[Dict], parsed_vcf: Dict,
+                    start_time: float, **summary) -> StreamingResponse:
+    """
+    Stream results one record at a time, in completion order.
+    The last record is {"summary": {...}} with the quality metrics of the whole request.
+    """
+    async def body():
+        count = found = 0
+        async for result in results:
+            count += 1
+            found += result["quality_metrics"]["pharmacogenomic_variants_found"]
+            yield encode_record(fmt, "result", result)
+        summary.update({
+            "results":                        count,
+            "vcf_parsing_success":            parsed_vcf["parse_success"],
+            "total_variants_in_vcf":          parsed_vcf["total_variants"],
+            "pharmacogenomic_variants_found": found,
+            "processing_time_seconds":        round(time.time() - start_time, 2),
+            "knowledge_base_version":         parsed_vcf["knowledge_base_version"]
+        })
+        yield encode_record(fmt, "summary", {"summary": summary})
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(body(), media_type=STREAM_MEDIA_TYPES[fmt], headers=headers)
+
+
+async def analysis_response(parsed_vcf: Dict, drugs: str, fmt: Optional[str], start_time: float):
+    """The /analyze response body (or stream) for a parsed single-patient VCF."""
     patient_id = parsed_vcf["patient_id"]
     drug_list  = [d.strip().upper() for d in drugs.split(",") if d.strip()]
+    kb         = knowledge_base(parsed_vcf["knowledge_base_version"])
 
-    results = []
-    for drug in drug_list:
-        if drug not in GENE_DRUG_RULES:
-            # Still return valid schema even for unsupported drug
-            results.append({
-                "patient_id": patient_id,
-                "drug": drug,
-                "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
-                "risk_assessment": {
-                    "risk_label": "Unknown",
-                    "confidence_score": 0.0,
-                    "severity": "none"
-                },
-                "pharmacogenomic_profile": {
-                    "primary_gene": "Unknown",
-                    "diplotype": "*1/*1",
-                    "phenotype": "Unknown",
-                    "detected_variants": []
-                },
-                "clinical_recommendation": {
-                    "action": f"Drug '{drug}' is not supported. Supported drugs: {', '.join(GENE_DRUG_RULES.keys())}",
-                    "cpic_guideline": "N/A",
-                    "mechanism": "N/A"
-                },
-                "llm_generated_explanation": {
-                    "summary": f"Drug '{drug}' is not in the supported drug list.",
-                    "mechanism_explanation": "N/A",
-                    "patient_friendly": f"This drug is not currently supported by PharmaGuard.",
-                    "clinical_significance": "N/A",
-                    "monitoring_parameters": "N/A",
-                    "alternative_drugs": "N/A"
-                },
-                "quality_metrics": {
-                    "vcf_parsing_success": parsed_vcf["parse_success"],
-                    "total_variants_in_vcf": parsed_vcf["total_variants"],
-                    "pharmacogenomic_variants_found": 0,
-                    "processing_time_seconds": round(time.time() - start_time, 2)
-                }
-            })
+    results   = [None] * len(drug_list)
+    supported = []
+    for i, drug in enumerate(drug_list):
+        if drug not in kb.gene_drug_rules:
+            results[i] = unsupported_result(patient_id, drug, parsed_vcf, start_time)
             continue
+        supported.append(i)
+
+    # One LLM call covers every drug not already cached
+    pending = dict(zip(supported, build_results(patient_id, [drug_list[i] for i in supported],
+                                                parsed_vcf, start_time)))
 
-        result = build_single_result(patient_id, drug, parsed_vcf, start_time)
-        results.append(result)
+    if fmt is not None:
+        async def one(result):
+            return [await result]
+        ready = [r for r in results if r is not None]
+        return stream_response(fmt, completed_results(ready, [one(p) for p in pending.values()]),
+                               parsed_vcf, start_time, patient_id=patient_id)
+
+    for i, result in zip(pending, await asyncio.gather(*pending.values())):
+        results[i] = result
 
     # ✅ RIFT SCHEMA COMPLIANT:
     # Single drug  → return single object   { patient_id, drug, ... }
     # Multi drug   → return JSON array      [ { ... }, { ... } ]
     if len(results) == 1:
-        return JSONResponse(content=results[0])
+        return ResultResponse(content=results[0])
     else:
-        return JSONResponse(content=results)
+        return ResultResponse(content=results)
+
+
+@app.post("/analyze")
+async def analyze(
+    request:         Request,
+    vcf_file:        UploadFile           = File(...),
+    drugs:           str                  = Form(...),
+    index_file:      Optional[UploadFile] = File(None),
+    stream:          Optional[str]        = Form(None),
+    profile_id:      Optional[str]        = Form(None),
+    store_profile:   bool                 = Form(False),
+    x_patient_token: Optional[str]        = Header(None)
+):
+    start_time = time.time()
+    fmt        = stream_format(stream, request)
+    if profile_id is not None or store_profile:
+        # Keep the extracted genotypes so later drugs need no re-upload (GET /patients/{profile_id}/analyze)
+        if PATIENT_STORE is None:
+            raise HTTPException(status_code=400, detail="Patient profiles are disabled; set PATIENT_DB")
+        patient_store_access(x_patient_token)
+        try:
+            profile_id = check_profile_id(profile_id) if profile_id is not None else new_profile_id()
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    parsed_vcf = await parse_upload(vcf_file, index_file, VCFStreamParser())
+
+    if not parsed_vcf["parse_success"] and parsed_vcf["total_variants"] == 0:
+        raise HTTPException(status_code=400, detail="VCF file contains no parseable variants")
+
+    if profile_id is None:
+        return await analysis_response(parsed_vcf, drugs, fmt, start_time)
+    await run_in_threadpool(PATIENT_STORE.save, profile_id, parsed_vcf)
+    response = await analysis_response(parsed_vcf, drugs, fmt, start_time)
+    response.headers["X-Profile-Id"] = profile_id
+    return response
+
+
+def patient_store_access(x_patient_token: Optional[str]) -> None:
+    check_token(PATIENT_TOKEN, x_patient_token, "Invalid patient token",
+                "Patient profiles require PATIENT_TOKEN to be configured")
+
+
+def stored_profile(profile_id: str, x_patient_token: Optional[str]) -> Dict:
+    if PATIENT_STORE is None:
+        raise HTTPException(status_code=404, detail="Patient profiles are disabled; set PATIENT_DB")
+    patient_store_access(x_patient_token)
+    profile = PATIENT_STORE.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404,
+                            detail=f"No stored profile '{profile_id}'; upload the VCF to /analyze with store_profile")
+    return profile
+
+
+@app.get("/patients/{profile_id}")
+def patient_profile(profile_id: str, x_patient_token: Optional[str] = Header(None)):
+    """The stored PGx profile: per-gene diplotype and phenotype plus the variants they were called from."""
+    return stored_profile(profile_id, x_patient_token)
+
+
+@app.delete("/patients/{profile_id}")
+def delete_patient(profile_id: str, x_patient_token: Optional[str] = Header(None)):
+    stored_profile(profile_id, x_patient_token)
+    PATIENT_STORE.delete(profile_id)
+    return {"profile_id": profile_id, "deleted": True}
+
+
+@app.get("/patients/{profile_id}/analyze")
+async def analyze_patient(request: Request, profile_id: str, drugs: str, stream: Optional[str] = None,
+                          x_patient_token: Optional[str] = Header(None)):
+    """Same response as /analyze, evaluated from the stored profile instead of an upload."""
+    start_time = time.time()
+    fmt        = stream_format(stream, request)
+    profile    = stored_profile(profile_id, x_patient_token)
+
+    version = profile["knowledge_base_version"]
+    if knowledge_base(version).version != version:
+        raise HTTPException(status_code=409,
+                            detail=f"Profile was built with knowledge base {version}, which is no longer loaded; "
+                                   "re-upload the VCF to /analyze")
+    return await analysis_response(parsed_from_profile(profile), drugs, fmt, start_time)
+
+
+@app.post("/analyze/cohort")
+async def analyze_cohort(
+    request:    Request,
+    vcf_file:   UploadFile           = File(...),
+    drugs:      str                  = Form(...),
+    index_file: Optional[UploadFile] = File(None),
+    stream:     Optional[str]        = Form(None)
+):
+    """
+    Analyze every sample of a joint-called cohort VCF.
+    Phenotypes are computed for all samples at once from the genotype matrix and
+    one explanation is generated per distinct outcome, not per sample.
+    Returns a flat array of RIFT results ordered by sample, then drug, or streams
+    them as each outcome's explanation completes.
+    """
+    from cohort import CohortParser, cohort_phenotypes   # numpy; deferred to keep cold starts fast
+
+    start_time = time.time()
+    fmt        = stream_format(stream, request)
+    parsed_vcf = await parse_upload(vcf_file, index_file, CohortParser())
+
+    if parsed_vcf["total_variants"] == 0:
+        raise HTTPException(status_code=400, detail="VCF file contains no parseable variants")
+    samples = parsed_vcf["samples"]
+    if not samples:
+        raise HTTPException(status_code=400, detail="VCF file contains no sample columns")
+
+    drug_list = [d.strip().upper() for d in drugs.split(",") if d.strip()]
+    kb        = knowledge_base(parsed_vcf["knowledge_base_version"])
+
+    per_drug = []
+    pending  = {}
+    members  = {}       # outcome -> [(sample index, drug index)] sharing its explanation
+    for d, drug in enumerate(drug_list):
+        if drug not in kb.gene_drug_rules:
+            per_drug.append(None)
+            continue
+        gene = kb.gene_drug_rules[drug]["gene"]
+        with STAGE_SECONDS.time("phenotype"):
+            phenotypes, diplotypes, detected = cohort_phenotypes(parsed_vcf, gene)
+        per_drug.append((gene, phenotypes, diplotypes, detected))
+
+        for j in range(len(samples)):
+            outcome = (drug, phenotypes[j], diplotypes[j], tuple(v["rsid"] for v in detected[j]))
+            members.setdefault(outcome, []).append((j, d))
+            if outcome in pending:
+                continue
+            risk_info = rule_template(drug, phenotypes[j], kb)["risk_info"]
+            pending[outcome] = generate_clinical_explanation(
+                drug=drug, gene=gene, phenotype=phenotypes[j], diplotype=diplotypes[j],
+                risk_label=risk_info["risk_label"], severity=risk_info["severity"],
+                detected_variants=detected[j], recommendation=risk_info["recommendation"],
+                mechanism=risk_info["mechanism"]
+            )
+
+    def sample_result(j, d, explanation):
+        drug = drug_list[d]
+        gene, phenotypes, diplotypes, detected = per_drug[d]
+        evaluation = {
+            "drug":              drug,
+            "gene":              gene,
+            "phenotype":         phenotypes[j],
+            "diplotype":         diplotypes[j],
+            "risk_info":         rule_template(drug, phenotypes[j], kb)["risk_info"],
+            "detected_variants": detected[j]
+        }
+        return assemble_result(samples[j], evaluation, dict(explanation), parsed_vcf, start_time)
+
+    if fmt is not None:
+        async def outcome_results(outcome, explanation):
+            explanation = await explanation
+            return [sample_result(j, d, explanation) for j, d in members[outcome]]
+        ready = [unsupported_result(sample, drug, parsed_vcf, start_time)
+                 for sample in samples for drug, evaluated in zip(drug_list, per_drug) if evaluated is None]
+        return stream_response(fmt, completed_results(ready, [outcome_results(o, e) for o, e in pending.items()]),
+                               parsed_vcf, start_time, samples=len(samples))
+
+    explanations = dict(zip(pending, await asyncio.gather(*pending.values())))
+
+    results = []
+    for j, sample in enumerate(samples):
+        for d, (drug, evaluated) in enumerate(zip(drug_list, per_drug)):
+            if evaluated is None:
+                results.append(unsupported_result(sample, drug, parsed_vcf, start_time))
+                continue
+            gene, phenotypes, diplotypes, detected = evaluated
+            outcome = (drug, phenotypes[j], diplotypes[j], tuple(v["rsid"] for v in detected[j]))
+            results.append(sample_result(j, d, explanations[outcome]))
+
+    return ResultResponse(content=results)
+
+
+VCF_SUFFIXES     = (".vcf", ".vcf.gz")
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz")
+
+
+def unpack_batch_upload(filename: str, fileobj, workdir: str,
+                        max_bytes: int = MAX_BATCH_BYTES) -> Tuple[List[Tuple[str, str]], int]:
+    """
+    Copy one uploaded VCF, or every VCF inside an uploaded archive, into workdir.
+    Returns (display name, path on disk) pairs and the bytes written. Archive
+    member paths are never used as file system paths. A member larger than
+    MAX_DECOMPRESSED_BYTES, or more than max_bytes in all, raises
+    DecompressionLimitExceeded and removes every file already written.
+    """
+    saved = []
+    written = 0
+
+    def save(name, src, declared_size=None):
+        nonlocal written
+        limit = min(MAX_DECOMPRESSED_BYTES, max_bytes - written)
+        if declared_size is not None and declared_size > limit:
+            raise DecompressionLimitExceeded(f"'{name}' is larger than the {limit} bytes left for this batch")
+        fd, path = tempfile.mkstemp(dir=workdir, suffix=".vcf.gz" if name.endswith(".gz") else ".vcf")
+        saved.append((name, path))
+        n_bytes = 0
+        with os.fdopen(fd, "wb") as dst:
+            # Members are counted as they are extracted; the declared sizes can lie
+            while chunk := src.read(CHUNK_SIZE):
+                n_bytes += len(chunk)
+                if n_bytes > limit:
+                    raise DecompressionLimitExceeded(f"'{name}' is larger than the {limit} bytes left for this batch")
+                dst.write(chunk)
+        written += n_bytes
+
+    try:
+        if filename.endswith(".zip"):
+            with zipfile.ZipFile(fileobj) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir() and info.filename.endswith(VCF_SUFFIXES):
+                        with archive.open(info) as src:
+                            save(f"{filename}/{info.filename}", src, info.file_size)
+        elif filename.endswith(ARCHIVE_SUFFIXES):
+            with tarfile.open(fileobj=fileobj, mode="r:*") as archive:
+                for member in archive:
+                    if member.isfile() and member.name.endswith(VCF_SUFFIXES):
+                        save(f"{filename}/{member.name}", archive.extractfile(member), member.size)
+        else:
+            save(filename, fileobj)
+    except BaseException:
+        for _, path in saved:
+            os.remove(path)
+        raise
+    return saved, written
+
+
+@app.post("/analyze/batch")
+async def analyze_batch(
+    vcf_files: List[UploadFile] = File(...),
+    drugs:     str              = Form(...)
+):
+    """
+    Analyze many single-patient VCFs (or .zip/.tar archives of them) in one request.
+    Parsing and rule evaluation run in a process pool; explanations are then
+    generated concurrently. Returns one {file, results} or {file, error} per VCF.
+    """
+    start_time = time.time()
+    for upload in vcf_files:
+        if not upload.filename.endswith(VCF_SUFFIXES + ARCHIVE_SUFFIXES):
+            raise HTTPException(status_code=400,
+                                detail=f"Unsupported file '{upload.filename}': expected .vcf, .vcf.gz or an archive")
+
+    drug_list  = [d.strip().upper() for d in drugs.split(",") if d.strip()]
+    kb_version = current_kb().version
+
+    with tempfile.TemporaryDirectory(prefix="pharmaguard-batch-") as workdir:
+        saved = []
+        remaining = MAX_BATCH_BYTES
+        for upload in vcf_files:
+            try:
+                unpacked, n_bytes = await run_in_threadpool(unpack_batch_upload, upload.filename, upload.file,
+                                                            workdir, remaining)
+            except DecompressionLimitExceeded as e:
+                raise HTTPException(status_code=413, detail=str(e))
+            except (zipfile.BadZipFile, tarfile.TarError) as e:
+                raise HTTPException(status_code=400, detail=f"Could not read archive '{upload.filename}': {str(e)}")
+            saved += unpacked
+            remaining -= n_bytes
+
+        loop  = asyncio.get_running_loop()
+        pool  = get_process_pool()
+        evaluated = await asyncio.gather(*(
+            loop.run_in_executor(pool, evaluate_file, path, drug_list, kb_version) for _, path in saved
+        ))
+
+    async def file_response(name, summary):
+        if "error" in summary:
+            return {"file": name, "error": summary["error"]}
+        return {"file": name, "results": await results_for_file(summary, start_time)}
+
+    return JSONResponse(content=await asyncio.gather(*(
+        file_response(name, summary) for (name, _), summary in zip(saved, evaluated)
+    )))
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(
+    vcf_file: UploadFile = File(...),
+    drugs:    str        = Form(...)
+):
+    """
+    Queue an analysis and return its job ID immediately.
+    Poll GET /jobs/{job_id} for progress and fetch GET /jobs/{job_id}/result when done.
+    """
+    if not vcf_file.filename.endswith(VCF_SUFFIXES):
+        raise HTTPException(status_code=400, detail="Only .vcf or .vcf.gz files are accepted")
+    drug_list = [d.strip().upper() for d in drugs.split(",") if d.strip()]
+
+    path = JOB_MANAGER.new_upload_path(vcf_file.filename)
+    await run_in_threadpool(save_upload, vcf_file.file, path)
+    job = JOB_MANAGER.submit(path, vcf_file.filename, drug_list)
+    return {
+        "job_id":     job["id"],
+        "status":     job["status"],
+        "status_url": f"/jobs/{job['id']}",
+        "result_url": f"/jobs/{job['id']}/result"
+    }
+
+
+def save_upload(src, path: str) -> None:
+    with open(path, "wb") as dst:
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+
+async def find_job(job_id: str, wait: float) -> Dict:
+    job = await JOB_MANAGER.wait(job_id, min(max(wait, 0.0), JOB_MAX_WAIT_SECONDS))
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job '{job_id}'")
+    return job
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str, wait: float = 0):
+    """Job status with per-stage progress and timings. wait=N long-polls up to N seconds for completion."""
+    return JOB_MANAGER.status(await find_job(job_id, wait))
+
+
+@app.get("/jobs/{job_id}/result")
+async def job_result(job_id: str, wait: float = 0):
+    """
+    The analysis result, in the same shape /analyze returns.
+    Answers 202 with the job status while it is still queued or running.
+    """
+    job = await find_job(job_id, wait)
+    if job["status"] == "failed":
+        raise HTTPException(status_code=400, detail=job["error"])
+    if job["status"] != "done":
+        return JSONResponse(status_code=202, content=JOB_MANAGER.status(job))
+    return ResultResponse(content=job["result"])
+
+
+# Everything above ran at import; uvicorn starts serving right after
+WARMUP["import_seconds"] = round(time.perf_counter() - _IMPORT_STARTED, 4)
+STARTUP_SECONDS.set(WARMUP["import_seconds"], "import")
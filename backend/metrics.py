@@ -0,0 +1,181 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+# Latency buckets in seconds: sub-millisecond rule stages up to multi-second LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{v}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """Monotonic counter, optionally split by label values."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield self.name, _labels(self.label_names, labels), value
+
+
+class Gauge(Counter):
+    """Value that goes up and down (e.g. requests in flight)."""
+
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, *labels: str) -> None:
+        self.inc(-amount, *labels)
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram:
+    """Cumulative-bucket histogram; observe() is one bisect and three additions under a lock."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = labels
+        self.buckets = tuple(buckets)
+        self._series = {}       # labels -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *labels: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def count(self, *labels: str) -> int:
+        series = self._series.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def samples(self) -> Iterator[Tuple[str, str, float]]:
+        # Snapshot under the lock: observe() may add a label set or bump buckets mid-scrape
+        with self._lock:
+            snapshot = sorted((labels, list(series)) for labels, series in self._series.items())
+        for labels, series in snapshot:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), series):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield self.name + "_bucket", _labels(self.label_names + ("le",), labels + (le,)), cumulative
+            yield self.name + "_sum", _labels(self.label_names, labels), series[-1]
+            yield self.name + "_count", _labels(self.label_names, labels), cumulative
+
+
+STAGE_SECONDS = Histogram(
+    "pharmaguard_stage_seconds",
+    "Time spent per pipeline stage (upload_read, parse, extract, phenotype, serialize)",
+    labels=("stage",)
+)
+LLM_SECONDS = Histogram(
+    "pharmaguard_llm_explanation_seconds",
+    "Time to obtain a clinical explanation by outcome (pregenerated, hit, miss, coalesced, fallback)",
+    labels=("outcome",)
+)
+VARIANTS_PARSED = Counter("pharmaguard_variants_parsed_total", "VCF records parsed")
+BYTES_INGESTED  = Counter("pharmaguard_bytes_ingested_total", "Uploaded VCF and index bytes received")
+REQUESTS        = Counter("pharmaguard_requests_total", "HTTP requests handled", labels=("path",))
+IN_FLIGHT       = Gauge("pharmaguard_requests_in_flight", "HTTP requests currently being handled")
+
+ADMISSION_IN_FLIGHT = Gauge("pharmaguard_admission_in_flight", "Admitted analysis requests in progress")
+ADMISSION_BYTES     = Gauge("pharmaguard_admission_bytes_in_flight", "Upload bytes reserved by admitted requests")
+ADMISSION_QUEUE     = Gauge("pharmaguard_admission_queue_depth", "Analysis requests waiting for admission")
+ADMISSION_REJECTED  = Counter("pharmaguard_admission_rejected_total", "Analysis requests shed by admission control",
+                              labels=("reason",))
+LLM_IN_FLIGHT       = Gauge("pharmaguard_llm_calls_in_flight", "LLM calls currently in progress")
+LLM_WAITING         = Gauge("pharmaguard_llm_calls_waiting", "LLM calls waiting for a concurrency slot")
+LLM_FALLBACKS       = Counter("pharmaguard_llm_fallbacks_total",
+                              "Template explanations served instead of the LLM by reason (error, malformed, deadline, circuit_open, disabled)",
+                              labels=("reason",))
+LLM_CIRCUIT_STATE   = Gauge("pharmaguard_llm_circuit_state", "LLM circuit breaker state: 0 closed, 1 half-open, 2 open")
+
+STARTUP_SECONDS     = Gauge("pharmaguard_startup_seconds",
+                              "Cold-start time by phase (import of the app module, background warm-up)",
+                              labels=("phase",))
+
+REGISTRY: List = [STAGE_SECONDS, LLM_SECONDS, VARIANTS_PARSED, BYTES_INGESTED, REQUESTS, IN_FLIGHT,
+                  ADMISSION_IN_FLIGHT, ADMISSION_BYTES, ADMISSION_QUEUE, ADMISSION_REJECTED,
+                  LLM_IN_FLIGHT, LLM_WAITING, LLM_FALLBACKS, LLM_CIRCUIT_STATE, STARTUP_SECONDS]
+
+
+def _format(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{labels} {_format(value)}")
+
+    # Share of LLM-backed explanations that had to use the rule-based template
+    generated = LLM_SECONDS.count("miss") + LLM_SECONDS.count("fallback")
+    ratio = LLM_SECONDS.count("fallback") / generated if generated else 0.0
+    lines.append("# HELP pharmaguard_llm_fallback_ratio Fraction of generated explanations that fell back to the template")
+    lines.append("# TYPE pharmaguard_llm_fallback_ratio gauge")
+    lines.append(f"pharmaguard_llm_fallback_ratio {_format(ratio)}")
+    return "\n".join(lines) + "\n"
+
+
+class RequestMetricsMiddleware:
+    """
+    Plain ASGI middleware counting requests and requests in flight.
+    Only the route path template is used as a label, so ids never create new series.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope: Dict, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            IN_FLIGHT.dec()
+            route = scope.get("route")
+            REQUESTS.inc(1, getattr(route, "path", "unmatched"))
@@ -0,0 +1,133 @@
+"""
+Opt-in store of the PGx genotypes extracted from uploaded VCFs.
+
+Enabled by PATIENT_DB. An /analyze upload that asks for it (profile_id or
+store_profile) saves a profile, so that more drugs can be evaluated later
+from GET /patients/{profile_id}/analyze without uploading and parsing the
+file again. Profiles are keyed on the caller's profile_id or on one issued
+by the server, never on the patient ID guessed from the VCF: generic exports
+share IDs such as PATIENT_UNKNOWN, or one taken from a header line. A
+profile is a few hundred bytes. It holds:
+
+    pgx_variants   per-gene PGx hits, which is everything the rules read
+    genes          the called diplotype and phenotype for every PGx gene
+    patient_id, knowledge_base_version, total_variants, parse_success
+
+Profiles expire PATIENT_TTL seconds after they were saved. The hits are
+resolved against a knowledge-base version. Drugs are always evaluated with
+that version, and a profile whose version is no longer loaded must be
+rebuilt from the VCF (the new rules may read loci the old parse dropped).
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, Optional
+
+from cpic_rules import knowledge_base
+from vcf_parser import UNKNOWN_PATIENT_ID, determine_phenotype, get_diplotype
+
+PROFILE_ID = re.compile(r"[A-Za-z0-9][A-Za-z0-9._-]{0,127}")
+
+
+def check_profile_id(profile_id: str) -> str:
+    """Raise ValueError unless profile_id is usable as a caller-chosen key."""
+    if not PROFILE_ID.fullmatch(profile_id) or profile_id == UNKNOWN_PATIENT_ID:
+        raise ValueError("profile_id must be 1-128 letters, digits, '.', '_' or '-' and not "
+                         f"'{UNKNOWN_PATIENT_ID}'")
+    return profile_id
+
+
+def new_profile_id() -> str:
+    return uuid.uuid4().hex
+
+
+class PatientStore:
+    """SQLite-backed map of profile_id -> PGx profile; saving again replaces it and restarts its TTL."""
+
+    def __init__(self, db_path: str, ttl_seconds: int = 30 * 24 * 3600):
+        self.ttl_seconds = ttl_seconds
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.counters = {"saved": 0, "hits": 0, "misses": 0}
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS profiles ("
+            "profile_id TEXT PRIMARY KEY, expires_at REAL NOT NULL, profile TEXT NOT NULL)"
+        )
+        self._db.execute("DELETE FROM profiles WHERE expires_at < ?", (time.time(),))
+        self._db.commit()
+
+    def save(self, profile_id: str, parsed_vcf: Dict) -> Dict:
+        profile = build_profile(profile_id, parsed_vcf)
+        now = time.time()
+        with self._lock:
+            self._db.execute("DELETE FROM profiles WHERE expires_at < ?", (now,))
+            self._db.execute(
+                "INSERT OR REPLACE INTO profiles (profile_id, expires_at, profile) VALUES (?, ?, ?)",
+                (profile_id, now + self.ttl_seconds, json.dumps(profile, separators=(",", ":")))
+            )
+            self._db.commit()
+            self.counters["saved"] += 1
+        return profile
+
+    def get(self, profile_id: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._db.execute("SELECT profile FROM profiles WHERE profile_id = ? AND expires_at > ?",
+                                   (profile_id, time.time())).fetchone()
+            self.counters["hits" if row is not None else "misses"] += 1
+        return json.loads(row[0]) if row is not None else None
+
+    def delete(self, profile_id: str) -> bool:
+        with self._lock:
+            deleted = self._db.execute("DELETE FROM profiles WHERE profile_id = ? AND expires_at > ?",
+                                       (profile_id, time.time())).rowcount
+            self._db.commit()
+        return deleted > 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            profiles = self._db.execute("SELECT COUNT(*) FROM profiles WHERE expires_at > ?",
+                                        (time.time(),)).fetchone()[0]
+        return {**self.counters, "profiles": profiles, "ttl_seconds": self.ttl_seconds}
+
+
+def build_profile(profile_id: str, parsed_vcf: Dict) -> Dict:
+    kb = knowledge_base(parsed_vcf["knowledge_base_version"])
+    pgx_variants = parsed_vcf["pgx_variants"]
+    genes = {}
+    for gene in kb.pgx_genes:
+        hits = pgx_variants.get(gene, [])
+        genes[gene] = {"diplotype": get_diplotype(hits, gene, kb), "phenotype": determine_phenotype(hits, gene, kb)}
+    return {
+        "profile_id":             profile_id,
+        "patient_id":             parsed_vcf["patient_id"],
+        "knowledge_base_version": kb.version,
+        "saved_at":               time.time(),
+        "total_variants":         parsed_vcf["total_variants"],
+        "parse_success":          parsed_vcf["parse_success"],
+        "genes":                  genes,
+        "pgx_variants":           pgx_variants
+    }
+
+
+def parsed_from_profile(profile: Dict) -> Dict:
+    """The parsed-VCF shape the pipeline evaluates, rebuilt from a stored profile."""
+    return {
+        "patient_id":             profile["patient_id"],
+        "total_variants":         profile["total_variants"],
+        "variants":               [],
+        "pgx_variants":           profile["pgx_variants"],
+        "metadata":               {},
+        "parse_success":          profile["parse_success"],
+        "knowledge_base_version": profile["knowledge_base_version"]
+    }
+
+
+# Off unless a database path is configured
+PATIENT_STORE = PatientStore(
+    os.environ["PATIENT_DB"],
+    ttl_seconds=int(os.environ.get("PATIENT_TTL") or str(30 * 24 * 3600))
+) if os.environ.get("PATIENT_DB") else None
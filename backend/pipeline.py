@@ -0,0 +1,236 @@
+import asyncio
+import datetime
+import time
+from typing import Awaitable, Dict, List, Optional, Tuple
+
+from vcf_parser import VCFStreamParser, extract_pharmacogenomic_variants, determine_phenotype, get_diplotype, diplotype_note
+from cpic_rules import UNSUPPORTED_TEMPLATE, current_kb, knowledge_base, reload_knowledge_base, rule_template
+from bgzf import GzipStreamDecoder
+from llm_explainer import explain_many
+from metrics import STAGE_SECONDS, VARIANTS_PARSED, BYTES_INGESTED
+from result_cache import RESULT_CACHE, result_key
+
+# Files are parsed in fixed-size chunks so peak memory does not grow with the VCF
+CHUNK_SIZE = 1024 * 1024
+
+
+def evaluate_drug(parsed_vcf: Dict, drug: str) -> Dict:
+    """Apply the CPIC rule of a supported drug to a parsed VCF, with the knowledge base it was parsed with."""
+    kb   = knowledge_base(parsed_vcf["knowledge_base_version"])
+    gene = kb.gene_drug_rules[drug]["gene"]
+    with STAGE_SECONDS.time("extract"):
+        pgx_vars = extract_pharmacogenomic_variants(parsed_vcf, gene)
+    with STAGE_SECONDS.time("phenotype"):
+        phenotype = determine_phenotype(pgx_vars, gene, kb)
+        diplotype = get_diplotype(pgx_vars, gene, kb)
+    return {
+        "drug":              drug,
+        "gene":              gene,
+        "phenotype":         phenotype,
+        "diplotype":         diplotype,
+        "risk_info":         rule_template(drug, phenotype, kb)["risk_info"],
+        "detected_variants": pgx_vars
+    }
+
+
+def explanation_request(evaluation: Dict) -> Dict:
+    """generate_clinical_explanation arguments for an evaluation."""
+    risk_info = evaluation["risk_info"]
+    return {
+        "drug":              evaluation["drug"],
+        "gene":              evaluation["gene"],
+        "phenotype":         evaluation["phenotype"],
+        "diplotype":         evaluation["diplotype"],
+        "risk_label":        risk_info["risk_label"],
+        "severity":          risk_info["severity"],
+        "detected_variants": evaluation["detected_variants"],
+        "recommendation":    risk_info["recommendation"],
+        "mechanism":         risk_info["mechanism"]
+    }
+
+
+async def explain_all(evaluations: List[Dict], budget: Optional[float] = None) -> List[Dict]:
+    """Explanations for one patient's evaluations, from a single multi-drug LLM call where not cached."""
+    explained = await explain_many([explanation_request(e) for e in evaluations], budget)
+    return [explanation for explanation, _ in explained]
+
+
+def evaluate_and_explain(parsed_vcf: Dict, drugs: List[str]) -> List[Awaitable[Tuple[Dict, Dict]]]:
+    """
+    Evaluation and explanation for each supported drug, one awaitable per drug
+    so callers can stream them as they complete. Genotypes seen before are
+    served from RESULT_CACHE without re-running the rules or the explainer;
+    the remaining drugs share one multi-drug LLM call.
+    """
+    kb       = knowledge_base(parsed_vcf["knowledge_base_version"])
+    genes    = [kb.gene_drug_rules[drug]["gene"] for drug in drugs]
+    pgx_vars = [extract_pharmacogenomic_variants(parsed_vcf, gene) for gene in genes]
+    keys     = [result_key(kb.version, drug, v) for drug, v in zip(drugs, pgx_vars)]
+    drug_for = dict(zip(keys, drugs))
+
+    async def create_many(missing: List[str]) -> Dict:
+        evaluations = [evaluate_drug(parsed_vcf, drug_for[key]) for key in missing]
+        explained   = await explain_many([explanation_request(e) for e in evaluations])
+        created = {}
+        for key, evaluation, (explanation, outcome) in zip(missing, evaluations, explained):
+            cached = {"phenotype": evaluation["phenotype"], "diplotype": evaluation["diplotype"],
+                      "explanation": explanation}
+            # Fallback explanations (and coalesced ones, which may be) are not kept so the LLM is retried;
+            # pregenerated ones are already a dict lookup and may be fallback templates themselves
+            created[key] = cached, outcome in ("hit", "miss")
+        return created
+
+    async def finish(drug, gene, detected, future) -> Tuple[Dict, Dict]:
+        cached = await asyncio.shield(future)
+        evaluation = {
+            "drug":              drug,
+            "gene":              gene,
+            "phenotype":         cached["phenotype"],
+            "diplotype":         cached["diplotype"],
+            "risk_info":         rule_template(drug, cached["phenotype"], kb)["risk_info"],
+            "detected_variants": detected
+        }
+        return evaluation, dict(cached["explanation"])
+
+    futures = RESULT_CACHE.get_or_create_many(keys, create_many)
+    return [finish(*args) for args in zip(drugs, genes, pgx_vars, futures)]
+
+
+def build_results(patient_id: str, drugs: List[str], parsed_vcf: Dict, start_time: float) -> List[Awaitable[Dict]]:
+    """One awaitable RIFT-compliant result per supported drug, in order."""
+    async def build(pending):
+        evaluation, llm_explanation = await pending
+        return assemble_result(patient_id, evaluation, llm_explanation, parsed_vcf, start_time)
+    return [build(p) for p in evaluate_and_explain(parsed_vcf, drugs)]
+
+
+def assemble_result(patient_id, evaluation, llm_explanation, parsed_vcf, start_time):
+    """Fill the compiled (drug, phenotype) template with the patient-specific fields."""
+    drug      = evaluation["drug"]
+    version   = parsed_vcf["knowledge_base_version"]
+    template  = rule_template(drug, evaluation["phenotype"], knowledge_base(version))
+    pgx_vars  = evaluation["detected_variants"]
+
+    # Guarantee no error key ever reaches output
+    llm_explanation.pop("error", None)
+
+    return {
+        "patient_id": patient_id,
+        "drug": drug,
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+        "risk_assessment": dict(template["risk_assessment"]),
+        "pharmacogenomic_profile": {
+            "primary_gene":      template["gene"],
+            "diplotype":         evaluation["diplotype"],
+            "phenotype":         evaluation["phenotype"],
+            "detected_variants": pgx_vars,
+            "diplotype_note":    diplotype_note(pgx_vars, template["gene"], knowledge_base(version))
+        },
+        "clinical_recommendation": dict(template["clinical_recommendation"]),
+        "llm_generated_explanation": llm_explanation,
+        "quality_metrics": {
+            "vcf_parsing_success":          parsed_vcf["parse_success"],
+            "total_variants_in_vcf":        parsed_vcf["total_variants"],
+            "pharmacogenomic_variants_found": len(pgx_vars),
+            "processing_time_seconds":      round(time.time() - start_time, 2),
+            "knowledge_base_version":       version
+        }
+    }
+
+
+def unsupported_result(patient_id, drug, parsed_vcf, start_time):
+    """Still return valid schema even for unsupported drug."""
+    version = parsed_vcf["knowledge_base_version"]
+    return {
+        "patient_id": patient_id,
+        "drug": drug,
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+        "risk_assessment": dict(UNSUPPORTED_TEMPLATE["risk_assessment"]),
+        "pharmacogenomic_profile": {
+            "primary_gene": "Unknown",
+            "diplotype": "*1/*1",
+            "phenotype": "Unknown",
+            "detected_variants": [],
+            "diplotype_note": None
+        },
+        "clinical_recommendation": {
+            "action": f"Drug '{drug}' is not supported. Supported drugs: {knowledge_base(version).supported_drugs_text}",
+            "cpic_guideline": "N/A",
+            "mechanism": "N/A"
+        },
+        "llm_generated_explanation": {
+            "summary": f"Drug '{drug}' is not in the supported drug list.",
+            **UNSUPPORTED_TEMPLATE["llm_generated_explanation"]
+        },
+        "quality_metrics": {
+            "vcf_parsing_success": parsed_vcf["parse_success"],
+            "total_variants_in_vcf": parsed_vcf["total_variants"],
+            "pharmacogenomic_variants_found": 0,
+            "processing_time_seconds": round(time.time() - start_time, 2),
+            "knowledge_base_version": version
+        }
+    }
+
+
+def parse_vcf_path(path: str) -> Dict:
+    """Stream a .vcf or .vcf.gz file from disk through the parser."""
+    parser  = VCFStreamParser()
+    decoder = GzipStreamDecoder() if path.endswith(".gz") else None
+    with STAGE_SECONDS.time("parse"), open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            if decoder is None:
+                parser.feed(chunk)
+            else:
+                for piece in decoder.decompress(chunk):
+                    parser.feed(piece)
+        parsed_vcf = parser.close()
+        BYTES_INGESTED.inc(f.tell())
+    VARIANTS_PARSED.inc(parsed_vcf["total_variants"])
+    return parsed_vcf
+
+
+def evaluate_file(path: str, drug_list: List[str], kb_version: Optional[str] = None) -> Dict:
+    """
+    Parse one VCF and evaluate every requested drug. Runs in worker processes,
+    so it returns only the small picklable summary the results are built from.
+    kb_version is the knowledge base the caller is using; a worker that has not
+    seen a reload yet picks it up first.
+    """
+    if kb_version is not None and current_kb().version != kb_version:
+        try:
+            reload_knowledge_base()
+        except ValueError:
+            pass   # reported below as a version mismatch
+        if current_kb().version != kb_version:
+            return {"error": "The knowledge base changed during the analysis; please retry"}
+    try:
+        parsed_vcf = parse_vcf_path(path)
+    except Exception as e:
+        return {"error": f"Could not read VCF file: {str(e)}"}
+    if parsed_vcf["total_variants"] == 0:
+        return {"error": "VCF file contains no parseable variants"}
+
+    rules = knowledge_base(parsed_vcf["knowledge_base_version"]).gene_drug_rules
+    return {
+        "patient_id":     parsed_vcf["patient_id"],
+        "parse_success":  parsed_vcf["parse_success"],
+        "total_variants": parsed_vcf["total_variants"],
+        "knowledge_base_version": parsed_vcf["knowledge_base_version"],
+        "evaluations":    [evaluate_drug(parsed_vcf, d) if d in rules else {"drug": d}
+                           for d in drug_list]
+    }
+
+
+async def results_for_file(evaluated: Dict, start_time: float) -> List[Dict]:
+    """Turn an evaluate_file() summary into RIFT results, explaining all drugs in one LLM call."""
+    patient_id   = evaluated["patient_id"]
+    evaluations  = evaluated["evaluations"]
+    explanations = iter(await explain_all([e for e in evaluations if "gene" in e]))
+    return [
+        assemble_result(patient_id, e, next(explanations), evaluated, start_time) if "gene" in e
+        else unsupported_result(patient_id, e["drug"], evaluated, start_time)
+        for e in evaluations
+    ]
@@ -0,0 +1,108 @@
+"""
+Offline pre-generation of the clinical explanation table.
+
+Enumerates every (drug, diplotype, phenotype) outcome the rules can reach from
+the known star-allele variants, generates an explanation for each one and
+writes a gzipped JSON table that the API loads at startup:
+
+    python pregenerate_explanations.py --output explanations.json.gz
+
+Without GEMINI_API_KEY (or when a call fails) the deterministic fallback
+template is stored instead, exactly as the request path would produce it.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import time
+from itertools import permutations
+from typing import Dict, List
+
+from cpic_rules import GENE_DRUG_RULES, VARIANT_STAR_ALLELES, VARIANT_LOCI, rule_template
+from vcf_parser import VCFVariant, pgx_hit, determine_phenotype, get_diplotype
+import llm_explainer
+
+
+def _variant(rsid: str, genotype: str) -> Dict:
+    chrom, pos, ref, alt = VARIANT_LOCI.get(rsid, [("", 0, "", "")])[0]
+    return pgx_hit(VCFVariant(chrom=chrom, pos=pos, rsid=rsid, ref=ref, alt=alt, genotype=genotype))
+
+
+def variant_combinations(gene: str) -> List[List[Dict]]:
+    """
+    Detected-variant lists that decide the outcome for a gene: none, one
+    heterozygous or homozygous variant, and every ordered pair of variants.
+    """
+    rsids = [rsid for rsid, info in VARIANT_STAR_ALLELES.items() if info["gene"] == gene]
+    combos = [[]]
+    for rsid in rsids:
+        combos.append([_variant(rsid, "0/1")])
+        combos.append([_variant(rsid, "1/1")])
+    for a, b in permutations(rsids, 2):
+        combos.append([_variant(a, "0/1"), _variant(b, "0/1")])
+    return combos
+
+
+def enumerate_outcomes() -> Dict[str, Dict]:
+    """Map explanation key -> keyword arguments of generate_clinical_explanation."""
+    outcomes = {}
+    for drug, rule in GENE_DRUG_RULES.items():
+        gene = rule["gene"]
+        for pgx_vars in variant_combinations(gene):
+            phenotype = determine_phenotype(pgx_vars, gene)
+            risk_info = rule_template(drug, phenotype)["risk_info"]
+            kwargs = dict(
+                drug=drug, gene=gene, phenotype=phenotype, diplotype=get_diplotype(pgx_vars, gene),
+                risk_label=risk_info["risk_label"], severity=risk_info["severity"],
+                detected_variants=pgx_vars, recommendation=risk_info["recommendation"],
+                mechanism=risk_info["mechanism"]
+            )
+            outcomes.setdefault(llm_explainer.explanation_key(**kwargs), kwargs)
+    return outcomes
+
+
+async def generate_table(outcomes: Dict[str, Dict], concurrency: int) -> Dict[str, Dict]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def generate(kwargs):
+        variant_list = ", ".join(v["rsid"] for v in kwargs["detected_variants"]) or "None"
+        prompt = llm_explainer.build_prompt(
+            kwargs["drug"], kwargs["gene"], kwargs["phenotype"], kwargs["diplotype"],
+            kwargs["risk_label"], kwargs["severity"], variant_list,
+            kwargs["recommendation"], kwargs["mechanism"]
+        )
+        async with semaphore:
+            try:
+                return {"source": "llm", "explanation": await llm_explainer._request_explanation(prompt)}
+            except Exception:
+                return {"source": "fallback", "explanation": llm_explainer.fallback_explanation(**kwargs)}
+
+    try:
+        entries = await asyncio.gather(*(generate(kwargs) for kwargs in outcomes.values()))
+    finally:
+        await llm_explainer.close_client()
+    return dict(zip(outcomes, entries))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate clinical explanations for every reachable outcome.")
+    parser.add_argument("--output", default=llm_explainer.EXPLANATION_TABLE_PATH,
+                        help="Path of the gzipped JSON table (default: %(default)s)")
+    parser.add_argument("--concurrency", type=int, default=llm_explainer.LLM_MAX_CONCURRENCY,
+                        help="Gemini calls in flight (default: %(default)s)")
+    args = parser.parse_args()
+
+    start = time.time()
+    outcomes = enumerate_outcomes()
+    entries = asyncio.run(generate_table(outcomes, args.concurrency))
+
+    with gzip.open(args.output, "wt", encoding="utf-8") as f:
+        json.dump({"version": llm_explainer.PROMPT_VERSION, "entries": entries}, f, separators=(",", ":"))
+
+    from_llm = sum(1 for e in entries.values() if e["source"] == "llm")
+    print(f"Wrote {len(entries)} explanations ({from_llm} from Gemini, "
+          f"{len(entries) - from_llm} fallback) to {args.output} in {time.time() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
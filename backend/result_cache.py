@@ -0,0 +1,38 @@
+"""
+Cache of per-drug analysis outcomes for patients that are analyzed again.
+
+Entries are keyed on the drug plus a fingerprint of the PGx genotypes extracted
+for its gene, not the uploaded bytes, so a re-exported VCF with a new header or
+different non-PGx records still hits. An entry holds the called phenotype,
+diplotype and explanation, so a hit skips rule evaluation and the LLM.
+
+Keys include the knowledge-base version, which is a digest of the rule data
+files, so any change to the rules invalidates every entry; the cache version is
+the prompt version, so a prompt change drops the persisted entries too.
+"""
+import hashlib
+import json
+import os
+from typing import Dict, List
+
+from explanation_cache import ExplanationCache
+from llm_explainer import PROMPT_VERSION
+
+RESULT_CACHE = ExplanationCache(
+    max_entries=int(os.environ.get("RESULT_CACHE_SIZE", "4096")),
+    # Memory only unless a path is configured
+    db_path=os.environ.get("RESULT_CACHE_DB") or None,
+    ttl_seconds=int(os.environ.get("RESULT_CACHE_TTL", str(7 * 24 * 3600))),
+    version=PROMPT_VERSION,
+    table="results"
+)
+
+
+def genotype_fingerprint(pgx_vars: List[Dict]) -> str:
+    """Hash of a gene's detected variants and their genotypes, in extraction order."""
+    raw = json.dumps([sorted(v.items()) for v in pgx_vars], separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def result_key(kb_version: str, drug: str, pgx_vars: List[Dict]) -> str:
+    return RESULT_CACHE.make_key(kb_version, drug, genotype_fingerprint(pgx_vars))
@@ -0,0 +1,146 @@
+import json
+from json.encoder import encode_basestring
+from typing import Any, Dict, Tuple
+
+from fastapi.responses import JSONResponse
+
+from cpic_rules import knowledge_base
+from metrics import STAGE_SECONDS
+
+# Same output as starlette's JSONResponse.render, so both paths are byte-identical
+_encode = json.JSONEncoder(ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode
+
+
+def _make_fragment_encoder():
+    """
+    A single reusable C encoder for the dynamic fragments; JSONEncoder.encode
+    builds a new one on every call, which dominates for small dicts.
+    """
+    try:
+        from json.encoder import c_make_encoder
+        iterencode = c_make_encoder(None, json.JSONEncoder().default, encode_basestring,
+                                    None, ":", ",", False, False, False)
+        return lambda o: "".join(iterencode(o, 0))
+    except Exception:
+        return _encode
+
+
+_encode_fragment = _make_fragment_encoder()
+
+# Field order of assemble_result(); results in any other shape take the plain path
+RESULT_FIELDS  = ("patient_id", "drug", "timestamp", "risk_assessment", "pharmacogenomic_profile",
+                  "clinical_recommendation", "llm_generated_explanation", "quality_metrics")
+PROFILE_FIELDS = ("primary_gene", "diplotype", "phenotype", "detected_variants", "diplotype_note")
+
+
+def _compile_frame(template) -> Tuple[Dict, Dict, str]:
+    """The static risk/recommendation fragments and a frame with slots for everything else."""
+    risk_assessment = dict(template["risk_assessment"])
+    recommendation  = dict(template["clinical_recommendation"])
+    frame = ('{"patient_id":%s,"drug":%s,"timestamp":%s,"risk_assessment":'
+             + _encode(risk_assessment).replace("%", "%%")
+             + ',"pharmacogenomic_profile":%s,"clinical_recommendation":'
+             + _encode(recommendation).replace("%", "%%")
+             + ',"llm_generated_explanation":%s,"quality_metrics":%s}')
+    return risk_assessment, recommendation, frame
+
+
+# Knowledge-base version -> {(drug, phenotype): pre-encoded result frame}, compiled
+# from its rule table on first use; a reload only adds a new set
+MAX_FRAME_SETS = 4
+_FRAMES = {}
+
+
+def _frames(version: str) -> Dict:
+    frames = _FRAMES.get(version)
+    if frames is None:
+        kb = knowledge_base(version)
+        frames = {key: _compile_frame(template) for key, template in kb.result_templates.items()}
+        if len(_FRAMES) >= MAX_FRAME_SETS:
+            del _FRAMES[next(iter(_FRAMES))]
+        _FRAMES[version] = frames
+    return frames
+
+# Explanations and detected variants repeat across requests and cohort samples,
+# so their encodings are kept too, keyed by content
+MAX_FRAGMENTS = 4096
+_FRAGMENTS = {}
+
+
+def _encode_cached(value: Dict) -> str:
+    try:
+        # Value types are part of the key: 1, 1.0 and True compare equal but encode differently
+        key = (tuple(value.items()), tuple(map(type, value.values())))
+        encoded = _FRAGMENTS.get(key)
+    except TypeError:   # unhashable values (e.g. lists from the LLM); not worth caching
+        return _encode_fragment(value)
+    if encoded is None:
+        encoded = _encode_fragment(value)
+        if len(_FRAGMENTS) >= MAX_FRAGMENTS:
+            del _FRAGMENTS[next(iter(_FRAGMENTS))]
+        _FRAGMENTS[key] = encoded
+    return encoded
+
+
+def _encode_profile(profile: Dict) -> str:
+    variants = profile["detected_variants"]
+    if tuple(profile) != PROFILE_FIELDS or type(variants) is not list:
+        return _encode_fragment(profile)
+    return '{"primary_gene":%s,"diplotype":%s,"phenotype":%s,"detected_variants":[%s],"diplotype_note":%s}' % (
+        _encode_fragment(profile["primary_gene"]),
+        _encode_fragment(profile["diplotype"]),
+        _encode_fragment(profile["phenotype"]),
+        ",".join(_encode_cached(v) if type(v) is dict else _encode_fragment(v) for v in variants),
+        _encode_fragment(profile["diplotype_note"])
+    )
+
+
+def _encode_result(result: Dict) -> str:
+    """
+    Encode one RIFT result by filling the pre-encoded (drug, phenotype) frame of
+    the knowledge base it reports. The frame is only used when the static
+    fragments still equal the compiled ones.
+    """
+    profile  = result["pharmacogenomic_profile"]
+    frames   = _frames(result["quality_metrics"]["knowledge_base_version"])
+    compiled = frames.get((result["drug"], profile["phenotype"]))
+    if (compiled is None or tuple(result) != RESULT_FIELDS
+            or result["risk_assessment"] != compiled[0] or result["clinical_recommendation"] != compiled[1]):
+        return _encode_fragment(result)
+    explanation = result["llm_generated_explanation"]
+    return compiled[2] % (
+        _encode_fragment(result["patient_id"]),
+        _encode_fragment(result["drug"]),
+        _encode_fragment(result["timestamp"]),
+        _encode_profile(profile),
+        _encode_cached(explanation) if type(explanation) is dict else _encode_fragment(explanation),
+        _encode_fragment(result["quality_metrics"])
+    )
+
+
+def encode_result(result: Dict) -> bytes:
+    """Encode a single RIFT result, falling back to plain json on anything unexpected."""
+    try:
+        return _encode_result(result).encode("utf-8")
+    except Exception:
+        return _encode(result).encode("utf-8")
+
+
+def encode_content(content: Any) -> bytes:
+    """Encode a result object or a list of them; any other content goes through plain json."""
+    try:
+        if type(content) is dict and "pharmacogenomic_profile" in content:
+            return _encode_result(content).encode("utf-8")
+        if type(content) is list and all(type(r) is dict and "pharmacogenomic_profile" in r for r in content):
+            return ("[" + ",".join(_encode_result(r) for r in content) + "]").encode("utf-8")
+    except Exception:
+        pass
+    return _encode(content).encode("utf-8")
+
+
+class ResultResponse(JSONResponse):
+    """JSONResponse that serializes RIFT results through the pre-encoded fragments."""
+
+    def render(self, content: Any) -> bytes:
+        with STAGE_SECONDS.time("serialize"):
+            return encode_content(content)
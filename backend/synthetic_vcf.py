@@ -0,0 +1,116 @@
+"""
+Deterministic synthetic VCF generator for benchmarks.
+
+Writes a sorted VCFv4.2 file with a chosen number of records and samples, a
+fraction of records placed on the known pharmacogenomic loci, and optionally
+missing IDs and gzip compression. The same arguments always give the same bytes:
+
+    python synthetic_vcf.py --records 1000000 --samples 1 --pgx-density 0.0001 --gz out.vcf.gz
+"""
+import argparse
+import gzip
+import io
+import random
+from typing import Dict, List
+
+from cpic_rules import VARIANT_LOCI
+
+CHROMOSOMES = [f"chr{i}" for i in range(1, 23)]
+BASES = "ACGT"
+GENOTYPES = ["0/0", "0/1", "1/1", "0|1", "1|0", "./."]
+GENOTYPE_WEIGHTS = [60, 20, 8, 5, 5, 2]
+# Distinct genotype rows drawn per file; keeps generation fast with thousands of samples
+ROW_POOL = 64
+
+
+def _genotype_rows(rng: random.Random, samples: int) -> List[str]:
+    rows = []
+    for _ in range(ROW_POOL):
+        gts = rng.choices(GENOTYPES, GENOTYPE_WEIGHTS, k=samples)
+        rows.append("\t".join(f"{gt}:{rng.randint(5, 60)}" for gt in gts))
+    return rows
+
+
+def _pgx_rows(rng: random.Random, count: int, samples: int) -> Dict[str, List]:
+    """count records on the known loci (GRCh38), cycling through them, grouped by chromosome."""
+    loci = sorted((loci[0][0], rsid) for rsid, loci in VARIANT_LOCI.items())
+    by_chrom = {}
+    for i in range(count):
+        chrom, rsid = loci[i % len(loci)]
+        _, pos, ref, alt = VARIANT_LOCI[rsid][0]
+        # Carriers across the first samples so every hit reaches the single-sample path
+        gts = "\t".join(rng.choice(("0/1", "1/1", "0/1")) + ":30" for _ in range(min(samples, 8)))
+        if samples > 8:
+            gts += "\t" + "\t".join(["0/0:30"] * (samples - 8))
+        by_chrom.setdefault(chrom, []).append((pos, rsid, ref, alt, gts))
+    return by_chrom
+
+
+def write_vcf(path: str, records: int, samples: int = 1, pgx_density: float = 0.001,
+              missing_ids: float = 0.0, gz: bool = False, seed: int = 42) -> Dict:
+    """Write the synthetic VCF to path. Returns a summary of what was written."""
+    rng = random.Random(seed)
+    n_pgx = min(records, round(records * pgx_density))
+    pgx = _pgx_rows(rng, n_pgx, samples)
+    rows = _genotype_rows(rng, samples)
+    per_chrom = (records - n_pgx) // len(CHROMOSOMES)
+    extra = (records - n_pgx) % len(CHROMOSOMES)
+
+    # mtime=0 keeps the gzip header, and so the whole file, reproducible
+    raw = gzip.GzipFile(path, "wb", mtime=0) if gz else open(path, "wb")
+    written = 0
+    with io.TextIOWrapper(raw, encoding="utf-8", newline="\n") as f:
+        f.write("##fileformat=VCFv4.2\n")
+        f.write("##source=PharmaGuardSyntheticVCF\n")
+        f.write('##INFO=<ID=DP,Number=1,Type=Integer,Description="Total Depth">\n')
+        f.write('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">\n')
+        f.write('##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read Depth">\n')
+        names = "\t".join(f"SAMPLE_{i:05d}" for i in range(samples))
+        f.write(f"#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t{names}\n")
+
+        for c, chrom in enumerate(CHROMOSOMES):
+            n = per_chrom + (1 if c < extra else 0)
+            background = sorted(rng.sample(range(1_000_000, 150_000_000), n)) if n else []
+            hits = sorted(pgx.get(chrom, ()))
+            # Background records never land exactly on a PGx position, so the hit count is exact
+            taken = {rsid_loci[0][1] for rsid_loci in VARIANT_LOCI.values() if rsid_loci[0][0] == chrom}
+            background = [pos for pos in background if pos not in taken]
+            out = []
+            h = 0
+            for pos in background:
+                while h < len(hits) and hits[h][0] <= pos:
+                    out.append(hits[h])
+                    h += 1
+                ref, alt = rng.sample(BASES, 2)
+                out.append((pos, f"rs{900_000_000 + written + len(out)}", ref, alt, rows[rng.randrange(ROW_POOL)]))
+            out.extend(hits[h:])
+
+            for pos, rsid, ref, alt, gts in out:
+                vid = "." if missing_ids and rng.random() < missing_ids else rsid
+                f.write(f"{chrom}\t{pos}\t{vid}\t{ref}\t{alt}\t50\tPASS\tDP=30\tGT:DP\t{gts}\n")
+            written += len(out)
+
+    return {"path": path, "records": written, "samples": samples, "pgx_records": n_pgx,
+            "missing_ids": missing_ids, "gz": gz, "seed": seed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a deterministic synthetic VCF.")
+    parser.add_argument("output", help="Output path (.vcf or .vcf.gz)")
+    parser.add_argument("--records", type=int, default=100_000, help="Number of records (default: %(default)s)")
+    parser.add_argument("--samples", type=int, default=1, help="Number of sample columns (default: %(default)s)")
+    parser.add_argument("--pgx-density", type=float, default=0.001,
+                        help="Fraction of records on pharmacogenomic loci (default: %(default)s)")
+    parser.add_argument("--missing-ids", type=float, default=0.0,
+                        help="Fraction of records with '.' in the ID column (default: %(default)s)")
+    parser.add_argument("--gz", action="store_true", help="gzip-compress the output")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed (default: %(default)s)")
+    args = parser.parse_args()
+
+    summary = write_vcf(args.output, args.records, args.samples, args.pgx_density,
+                        args.missing_ids, args.gz, args.seed)
+    print(f"Wrote {summary['records']} records ({summary['pgx_records']} PGx) x {args.samples} samples to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
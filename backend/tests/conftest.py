@@ -0,0 +1,16 @@
+"""
+Test setup. The backend is a set of flat modules, so its directory goes on
+sys.path. Every store stays in memory and the LLM is disabled before the
+modules read their configuration at import time.
+"""
+import os
+import sys
+
+os.environ.update({"GEMINI_API_KEY": "", "EXPLANATION_CACHE_DB": "", "EXPLANATION_TABLE": ""})
+for name in ("PATIENT_DB", "PATIENT_TOKEN", "RESULT_CACHE_DB", "JOB_DIR", "KB_RELOAD_TOKEN"):
+    os.environ.pop(name, None)
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_DIR = os.path.join(BACKEND_DIR, "..", "test_case_vcf")
+sys.path.insert(0, BACKEND_DIR)
+
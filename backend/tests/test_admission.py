@@ -0,0 +1,161 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.testclient import TestClient
+
+from admission import AdmissionController, AdmissionMiddleware, Overloaded
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_admits_up_to_the_limits():
+    async def scenario():
+        c = AdmissionController(max_requests=2, max_bytes=100, max_queue=0)
+        await c.acquire(40)
+        await c.acquire(40)
+        assert c.stats()["in_flight"] == 2 and c.stats()["bytes_in_flight"] == 80
+        c.release(40)
+        c.release(40)
+        assert c.stats()["in_flight"] == 0 and c.stats()["bytes_in_flight"] == 0
+    run(scenario())
+
+
+def test_too_large_is_413_without_retry_after():
+    async def scenario():
+        c = AdmissionController(max_bytes=100)
+        with pytest.raises(Overloaded) as e:
+            await c.acquire(101)
+        assert (e.value.status_code, e.value.reason, e.value.retry_after) == (413, "too_large", None)
+    run(scenario())
+
+
+def test_full_queue_is_429():
+    async def scenario():
+        c = AdmissionController(max_requests=1, max_queue=1, queue_timeout=5, retry_after=2)
+        await c.acquire(0)
+        waiter = asyncio.create_task(c.acquire(0))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as e:
+            await c.acquire(0)
+        assert (e.value.status_code, e.value.reason) == (429, "queue_full")
+        assert e.value.retry_after >= 2
+        c.release(0)
+        await waiter
+        assert c.stats()["queue_depth"] == 0
+    run(scenario())
+
+
+def test_queue_timeout_is_503_and_frees_the_slot():
+    async def scenario():
+        c = AdmissionController(max_requests=1, max_queue=4, queue_timeout=0.05)
+        await c.acquire(0)
+        with pytest.raises(Overloaded) as e:
+            await c.acquire(0)
+        assert (e.value.status_code, e.value.reason) == (503, "queue_timeout")
+        assert c.stats()["queue_depth"] == 0
+        c.release(0)
+        await c.acquire(0)   # the timed-out waiter left nothing behind
+    run(scenario())
+
+
+def test_waiters_are_admitted_in_arrival_order():
+    async def scenario():
+        c = AdmissionController(max_requests=1, max_bytes=100, max_queue=4, queue_timeout=5)
+        await c.acquire(10)
+        order = []
+
+        async def request(name, n_bytes):
+            await c.acquire(n_bytes)
+            order.append(name)
+            await asyncio.sleep(0.01)
+            c.release(n_bytes)
+
+        tasks = [asyncio.create_task(request(name, n)) for name, n in (("big", 90), ("small", 1))]
+        await asyncio.sleep(0.01)
+        c.release(10)
+        await asyncio.gather(*tasks)
+        assert order == ["big", "small"]
+    run(scenario())
+
+
+def test_cancelled_waiter_returns_a_granted_slot():
+    async def scenario():
+        c = AdmissionController(max_requests=1, max_queue=4, queue_timeout=5)
+        await c.acquire(0)
+        waiter = asyncio.create_task(c.acquire(0))
+        await asyncio.sleep(0)
+        c.release(0)         # slot handed to the waiter...
+        waiter.cancel()      # ...which goes away before it runs
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert c.stats()["in_flight"] == 0
+    run(scenario())
+
+
+def shedding_app(controller: AdmissionController) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/analyze")
+    async def analyze():
+        return {"ok": True}
+
+    @app.post("/upload")
+    async def upload(request: Request):
+        try:
+            return {"received": len(await request.body())}
+        except Exception:
+            return {"error": "swallowed"}
+
+    @app.get("/health")
+    def health():
+        return {"ok": True}
+
+    app.add_middleware(AdmissionMiddleware, controller=controller, paths=("/analyze", "/upload"))
+    app.add_middleware(CORSMiddleware, allow_origins=["*"], expose_headers=["Retry-After"])
+    return app
+
+
+def test_middleware_sheds_with_retry_after_and_cors_headers():
+    client = TestClient(shedding_app(AdmissionController(max_requests=0, max_queue=0, retry_after=3)))
+    headers = {"Origin": "http://frontend.example"}
+    response = client.post("/analyze", content=b"x", headers=headers)
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "3"
+    assert response.headers["access-control-allow-origin"] == "*"
+    # Other paths and methods are not admission-controlled
+    assert client.get("/health", headers=headers).status_code == 200
+
+
+def test_middleware_releases_after_the_response():
+    controller = AdmissionController(max_requests=1, max_queue=0)
+    client = TestClient(shedding_app(controller))
+    for _ in range(3):
+        assert client.post("/analyze", content=b"x" * 10).status_code == 200
+    assert controller.stats()["in_flight"] == 0
+    assert controller.stats()["bytes_in_flight"] == 0
+
+
+def test_app_lets_cors_wrap_admission():
+    import main
+    classes = [m.cls for m in main.app.user_middleware]
+    assert classes.index(CORSMiddleware) < classes.index(AdmissionMiddleware)
+
+
+def test_body_is_counted_against_its_reservation():
+    controller = AdmissionController(max_requests=4, max_bytes=400, max_queue=0)
+    client = TestClient(shedding_app(controller))
+    assert client.post("/upload", content=b"x" * 100).json() == {"received": 100}
+
+    # An understated Content-Length, and a chunked body over its 100 byte share
+    understated = client.post("/upload", content=b"x" * 100, headers={"Content-Length": "10"})
+    chunked = client.post("/upload", content=iter([b"x" * 60, b"x" * 60]))
+    for response in (understated, chunked):
+        assert response.status_code == 413
+        assert "reserved" in response.json()["detail"]
+        assert "retry-after" not in response.headers
+    assert controller.stats()["too_large"] == 2
+    assert controller.stats()["in_flight"] == 0 and controller.stats()["bytes_in_flight"] == 0
@@ -0,0 +1,96 @@
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from bgzf import DecompressionLimitExceeded
+from conftest import SAMPLE_DIR
+
+DRUGS = "CODEINE,CLOPIDOGREL"
+NAMES = ["test2_CYP2D6_PM_CODEINE_TOXIC.vcf", "test3_CYP2C19_PM_CLOPIDOGREL_INEFFECTIVE.vcf"]
+
+
+def sample(name: str) -> bytes:
+    with open(os.path.join(SAMPLE_DIR, name), "rb") as f:
+        return f.read()
+
+
+def zip_of(members: dict) -> bytes:
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return buf.getvalue()
+
+
+def tar_of(members: dict) -> bytes:
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode="w:gz") as archive:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+
+def scrub(results):
+    return [{k: v for k, v in r.items() if k not in ("timestamp", "quality_metrics")} for r in results]
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main, "BATCH_WORKERS", 2)
+    with TestClient(main.app) as client:
+        yield client
+
+
+def test_batch_matches_single_analyze_for_files_and_archives(client):
+    files = [("vcf_files", (NAMES[0], sample(NAMES[0]))),
+             ("vcf_files", ("set.zip", zip_of({f"a/{n}": sample(n) for n in NAMES}))),
+             ("vcf_files", ("set.tar.gz", tar_of({NAMES[1]: sample(NAMES[1]), "notes.txt": b"skipped"})))]
+    response = client.post("/analyze/batch", files=files, data={"drugs": DRUGS})
+    assert response.status_code == 200
+    body = response.json()
+    assert [entry["file"] for entry in body] == [NAMES[0], f"set.zip/a/{NAMES[0]}", f"set.zip/a/{NAMES[1]}",
+                                                 f"set.tar.gz/{NAMES[1]}"]
+    single = {n: client.post("/analyze", files={"vcf_file": (n, sample(n))}, data={"drugs": DRUGS}).json()
+              for n in NAMES}
+    for entry in body:
+        assert scrub(entry["results"]) == scrub(single[entry["file"].rsplit("/", 1)[-1]])
+
+
+def test_batch_reports_unparseable_files_per_file(client):
+    files = [("vcf_files", ("empty.vcf", b"##fileformat=VCFv4.2\n")), ("vcf_files", (NAMES[0], sample(NAMES[0])))]
+    body = client.post("/analyze/batch", files=files, data={"drugs": DRUGS}).json()
+    assert "error" in body[0] and "results" in body[1]
+
+
+def test_member_with_an_oversized_declared_size_is_not_extracted(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "MAX_DECOMPRESSED_BYTES", 1_000_000)
+    archive = zip_of({"small.vcf": b"x" * 10, "bomb.vcf": b"\0" * 2_000_000})
+    with pytest.raises(DecompressionLimitExceeded):
+        main.unpack_batch_upload("set.zip", io.BytesIO(archive), str(tmp_path))
+    assert os.listdir(tmp_path) == []
+
+
+def test_extraction_stops_at_the_batch_limit_and_cleans_up(tmp_path):
+    archive = tar_of({f"{i}.vcf": b"\0" * 600_000 for i in range(3)})
+    saved, written = main.unpack_batch_upload("set.tar.gz", io.BytesIO(archive), str(tmp_path), 2_000_000)
+    assert (len(saved), written) == (3, 1_800_000)
+    for _, path in saved:
+        os.remove(path)
+    with pytest.raises(DecompressionLimitExceeded):
+        main.unpack_batch_upload("set.tar.gz", io.BytesIO(archive), str(tmp_path), 1_000_000)
+    assert os.listdir(tmp_path) == []
+
+
+def test_batch_rejects_an_archive_bomb(client, monkeypatch):
+    monkeypatch.setattr(main, "MAX_BATCH_BYTES", 5_000_000)
+    bomb = zip_of({f"{i}.vcf": b"\0" * 4_000_000 for i in range(2)})
+    assert len(bomb) < 50_000
+    response = client.post("/analyze/batch", files={"vcf_files": ("bomb.zip", bomb)}, data={"drugs": DRUGS})
+    assert response.status_code == 413
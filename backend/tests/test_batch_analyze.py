@@ -0,0 +1,42 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+from conftest import BACKEND_DIR, SAMPLE_DIR
+
+NAMES = ["test2_CYP2D6_PM_CODEINE_TOXIC.vcf", "test4_CYP2C9_PM_WARFARIN_ADJUST.vcf"]
+
+
+def run_cli(*args: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, os.path.join(BACKEND_DIR, "batch_analyze.py"), *args],
+                          cwd=BACKEND_DIR, capture_output=True, text=True, timeout=120)
+
+
+def test_cli_writes_one_line_per_file_and_resumes(tmp_path):
+    source = tmp_path / "vcfs"
+    source.mkdir()
+    for name in NAMES:
+        shutil.copyfile(os.path.join(SAMPLE_DIR, name), source / name)
+    (source / "broken.vcf").write_text("##fileformat=VCFv4.2\n")
+    output = str(tmp_path / "results.jsonl")
+
+    done = run_cli(str(source), "--drugs", "CODEINE,WARFARIN", "--output", output, "--workers", "2")
+    assert done.returncode == 0, done.stderr
+    with open(output) as f:
+        records = {os.path.basename(r["file"]): r for r in map(json.loads, f)}
+    assert sorted(records) == sorted(NAMES + ["broken.vcf"])
+    assert "error" in records["broken.vcf"]
+    codeine = records[NAMES[0]]["results"][0]
+    assert (codeine["drug"], codeine["pharmacogenomic_profile"]["phenotype"]) == ("CODEINE", "PM")
+
+    # A torn last line from an interrupted run is dropped, and finished files are skipped
+    with open(output, "rb+") as f:
+        f.seek(-20, os.SEEK_END)
+        f.truncate()
+    again = run_cli(str(source), "--drugs", "CODEINE,WARFARIN", "--output", output, "--workers", "1")
+    assert again.returncode == 0, again.stderr
+    assert "2 already in" in again.stderr
+    with open(output) as f:
+        assert sorted(os.path.basename(json.loads(line)["file"]) for line in f) == sorted(NAMES + ["broken.vcf"])
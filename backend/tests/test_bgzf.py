@@ -0,0 +1,129 @@
+import gzip
+import io
+import os
+import random
+
+import pytest
+
+import bgzf
+from bgzf import (DecompressionLimitExceeded, GzipStreamDecoder, decompress_gzip, parse_index, read_chunks,
+                  read_header, region_chunks)
+from pipeline import parse_vcf_path
+from synthetic_vcf import write_vcf
+from vcf_parser import VCFStreamParser
+
+
+def decode(data: bytes, chunk: int, **kwargs) -> list:
+    decoder = GzipStreamDecoder(**kwargs)
+    return [piece for i in range(0, len(data), chunk) for piece in decoder.decompress(data[i:i + chunk])]
+
+
+def test_multi_member_stream_across_chunk_boundaries():
+    raw = random.Random(0).randbytes(200_000) + b"A" * 300_000
+    data = gzip.compress(raw[:250_000]) + gzip.compress(raw[250_000:]) + gzip.compress(b"")
+    for chunk in (1, 17, 4096, len(data)):
+        assert b"".join(decode(data, chunk)) == raw
+    assert decompress_gzip(data) == raw
+
+
+def test_output_comes_in_bounded_pieces():
+    data = gzip.compress(b"\0" * 5_000_000)
+    pieces = decode(data, len(data), piece_size=65536)
+    assert max(len(p) for p in pieces) <= 65536
+    assert sum(len(p) for p in pieces) == 5_000_000
+
+
+def test_decompression_limit():
+    data = gzip.compress(b"\0" * 1_000_000)
+    with pytest.raises(DecompressionLimitExceeded):
+        decode(data, 1024, max_output=100_000)
+    assert sum(len(p) for p in decode(data, 1024, max_output=1_000_000)) == 1_000_000
+
+
+@pytest.fixture(scope="module")
+def indexed_vcf(tmp_path_factory):
+    """A multi-block bgzipped synthetic VCF with real tabix and CSI indexes built by htslib."""
+    pysam = pytest.importorskip("pysam")
+    workdir = tmp_path_factory.mktemp("indexed")
+    plain = str(workdir / "synthetic.vcf")
+    write_vcf(plain, 20000, pgx_density=0.01, missing_ids=0.3)
+    gz = pysam.tabix_index(plain, preset="vcf", keep_original=True)
+    csi_dir = workdir / "csi"
+    csi_dir.mkdir()
+    csi_plain = str(csi_dir / "synthetic.vcf")
+    with open(plain, "rb") as src, open(csi_plain, "wb") as dst:
+        dst.write(src.read())
+    csi_gz = pysam.tabix_index(csi_plain, preset="vcf", csi=True)
+    return {"gz": gz, "tbi": gz + ".tbi", "csi_gz": csi_gz, "csi": csi_gz + ".csi"}
+
+
+def parse_indexed(gz_path: str, index_path: str) -> dict:
+    with open(index_path, "rb") as f:
+        index = parse_index(f.read())
+    parser = VCFStreamParser()
+    with open(gz_path, "rb") as f:
+        parser.feed(read_header(f))
+        for data in read_chunks(f, region_chunks(index, parser.kb.pgx_regions)):
+            parser.feed(data)
+    return index, parser.close()
+
+
+@pytest.mark.parametrize("kind", ["tbi", "csi"])
+def test_region_reads_find_every_pgx_variant(indexed_vcf, kind):
+    gz = indexed_vcf["gz"] if kind == "tbi" else indexed_vcf["csi_gz"]
+    assert os.path.getsize(gz) > 3 * 65536   # spans many BGZF blocks
+
+    full = parse_vcf_path(gz)
+    index, indexed = parse_indexed(gz, indexed_vcf[kind])
+    assert indexed["pgx_variants"] == full["pgx_variants"]
+    assert set(full["pgx_variants"]) == {"CYP2D6", "CYP2C19", "CYP2C9", "SLCO1B1", "TPMT", "DPYD"}
+    # Only the pharmacogene regions were read, yet the index still knows the record count
+    assert indexed["total_variants"] < full["total_variants"]
+    assert index["n_records"] == full["total_variants"] == 20000
+
+
+def test_index_decompression_is_capped(monkeypatch):
+    monkeypatch.setattr(bgzf, "MAX_INDEX_BYTES", 1_000_000)
+    bomb = gzip.compress(b"TBI\x01" + b"\0" * 2_000_000)
+    with pytest.raises(DecompressionLimitExceeded):
+        parse_index(bomb)
+    with pytest.raises(DecompressionLimitExceeded):
+        parse_index(b"CSI\x01" + b"\0" * 2_000_000)
+
+
+def test_unknown_index_is_rejected():
+    with pytest.raises(ValueError):
+        parse_index(b"BAI\x01" + b"\0" * 16)
+
+
+def test_analyze_with_index_matches_full_upload(indexed_vcf):
+    from fastapi.testclient import TestClient
+    import main
+
+    drugs = "CODEINE,WARFARIN,CLOPIDOGREL"
+    with open(indexed_vcf["gz"], "rb") as f:
+        vcf = f.read()
+    with open(indexed_vcf["tbi"], "rb") as f:
+        tbi = f.read()
+    with TestClient(main.app) as client:
+        full = client.post("/analyze", files={"vcf_file": ("s.vcf.gz", vcf)}, data={"drugs": drugs})
+        indexed = client.post("/analyze", files={"vcf_file": ("s.vcf.gz", io.BytesIO(vcf)),
+                                                 "index_file": ("s.vcf.gz.tbi", tbi)}, data={"drugs": drugs})
+    assert full.status_code == indexed.status_code == 200
+    assert [r["pharmacogenomic_profile"] for r in indexed.json()] == \
+           [r["pharmacogenomic_profile"] for r in full.json()]
+    assert [r["quality_metrics"]["total_variants_in_vcf"] for r in indexed.json()] == [20000] * 3
+
+
+def test_analyze_rejects_an_index_bomb(indexed_vcf, monkeypatch):
+    from fastapi.testclient import TestClient
+    import main
+
+    monkeypatch.setattr(bgzf, "MAX_INDEX_BYTES", 1_000_000)
+    bomb = gzip.compress(b"TBI\x01" + b"\0" * 2_000_000)
+    with open(indexed_vcf["gz"], "rb") as f:
+        vcf = f.read()
+    with TestClient(main.app) as client:
+        response = client.post("/analyze", files={"vcf_file": ("s.vcf.gz", vcf), "index_file": ("s.vcf.gz.tbi", bomb)},
+                               data={"drugs": "CODEINE"})
+    assert response.status_code == 413
@@ -0,0 +1,82 @@
+import pytest
+
+import circuit_breaker
+from circuit_breaker import CircuitBreaker
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_seconds=10)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record_failure()
+    breaker.record_success()          # a success resets the run
+    for _ in range(3):
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.counters == {"opened": 1, "rejected": 1}
+    assert breaker.retry_in() == 10
+
+
+def test_half_open_probe_success_closes(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=10, half_open_probes=2)
+    breaker.record_failure()
+    clock[0] += 9.9
+    assert not breaker.allow()
+    clock[0] += 0.1
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow() and breaker.allow()
+    assert not breaker.allow()        # only half_open_probes trial calls
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.stats()["consecutive_failures"] == 0
+
+
+def test_half_open_probe_failure_reopens(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=10)
+    breaker.record_failure()
+    clock[0] += 10
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.counters["opened"] == 2
+    assert breaker.retry_in() == 10   # the reset interval starts again
+
+
+def test_abandoned_probe_frees_its_slot(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=10)
+    breaker.record_failure()
+    clock[0] += 10
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_abandoned()
+    assert breaker.allow()
+
+
+def test_gauge_follows_the_state(clock):
+    class Gauge:
+        value = None
+
+        def set(self, value):
+            self.value = value
+
+    gauge = Gauge()
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=10, gauge=gauge)
+    assert gauge.value == 0
+    breaker.record_failure()
+    assert gauge.value == 2
+    clock[0] += 10
+    assert breaker.allow() and gauge.value == 1
+    breaker.record_success()
+    assert gauge.value == 0
@@ -0,0 +1,89 @@
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from fastapi.testclient import TestClient
+
+import main
+from cohort import MISSING, CohortParser, cohort_phenotypes, genotype_code
+from cpic_rules import current_kb
+from vcf_parser import VCFStreamParser, determine_phenotype, extract_pharmacogenomic_variants, get_diplotype
+
+DRUGS = "CODEINE,WARFARIN,CLOPIDOGREL,SIMVASTATIN,AZATHIOPRINE,FLUOROURACIL,FOO"
+
+
+@pytest.mark.parametrize("gt, code", [("0/0", 0), ("0|1", 1), ("1|0", 1), ("1/1", 2), ("1/2", 2),
+                                      ("./.", MISSING), (".", MISSING), ("./1", 1), ("0", 0), ("1", 2)])
+def test_genotype_code(gt, code):
+    assert genotype_code(gt) == code
+
+
+def cohort_vcf(n_samples: int, columns=None, seed: int = 5) -> bytes:
+    """A joint-called VCF over random PGx sites, with a GT:DP format and one non-PGx record."""
+    rng = random.Random(seed)
+    kb = current_kb()
+    rsids = rng.sample(sorted(kb.variant_loci), 15)
+    gts = ["0/0", "0|1", "1/1", "./.", "1|0", "0/0", "0/0"]
+    columns = list(range(n_samples)) if columns is None else columns
+    lines = ["##fileformat=VCFv4.2",
+             "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t" + "\t".join(f"S{c}" for c in columns)]
+    for rsid in rsids:
+        chrom, pos, ref, alt = kb.variant_loci[rsid][0]
+        calls = [rng.choice(gts) for _ in range(n_samples)]
+        record_id = rsid if rng.random() < 0.7 else "."
+        lines.append(f"{chrom}\t{pos}\t{record_id}\t{ref}\t{alt}\t.\tPASS\t.\tGT:DP\t" +
+                     "\t".join(calls[c] + ":10" for c in columns))
+    lines.append("chr3\t100\t.\tA\tG\t.\tPASS\t.\tGT:DP\t" + "\t".join("0/1:10" for _ in columns))
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def parse(raw: bytes, parser) -> dict:
+    parser.feed(raw)
+    return parser.close()
+
+
+def test_matrix_is_sites_by_samples():
+    parsed = parse(cohort_vcf(30), CohortParser())
+    assert parsed["samples"] == [f"S{i}" for i in range(30)]
+    assert parsed["genotypes"].dtype == np.int8
+    assert parsed["genotypes"].shape == (len(parsed["sites"]), 30)
+    assert parsed["total_variants"] == 16
+    assert all(site["rsid"].startswith("rs") for site in parsed["sites"])
+
+
+def test_cohort_phenotypes_match_single_sample_calls():
+    n = 40
+    cohort = parse(cohort_vcf(n), CohortParser())
+    for gene in current_kb().pgx_genes:
+        phenotypes, diplotypes, detected = cohort_phenotypes(cohort, gene)
+        for j in range(n):
+            single = parse(cohort_vcf(n, columns=[j]), VCFStreamParser())
+            hits = extract_pharmacogenomic_variants(single, gene)
+            assert (phenotypes[j], diplotypes[j]) == (determine_phenotype(hits, gene), get_diplotype(hits, gene))
+            assert [v["rsid"] for v in detected[j]] == [v["rsid"] for v in hits]
+
+
+def scrub(results):
+    return [{k: v for k, v in r.items() if k not in ("timestamp", "quality_metrics")} for r in results]
+
+
+def test_cohort_endpoint_matches_per_sample_analyze():
+    n = 8
+    with TestClient(main.app) as client:
+        cohort = client.post("/analyze/cohort", files={"vcf_file": ("c.vcf", cohort_vcf(n))}, data={"drugs": DRUGS})
+        assert cohort.status_code == 200
+        per_sample = len(DRUGS.split(","))
+        assert len(cohort.json()) == n * per_sample
+        for j in range(n):
+            single = client.post("/analyze", files={"vcf_file": ("s.vcf", cohort_vcf(n, columns=[j]))},
+                                 data={"drugs": DRUGS})
+            assert scrub(single.json()) == scrub(cohort.json()[j * per_sample:(j + 1) * per_sample])
+
+
+def test_cohort_without_samples_is_rejected():
+    raw = b"#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\nchr1\t1\t.\tA\tG\t.\tPASS\t.\n"
+    with TestClient(main.app) as client:
+        response = client.post("/analyze/cohort", files={"vcf_file": ("c.vcf", raw)}, data={"drugs": "CODEINE"})
+    assert response.status_code == 400
@@ -0,0 +1,185 @@
+import asyncio
+import time
+
+import pytest
+
+import explanation_cache
+from explanation_cache import ExplanationCache
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_concurrent_misses_share_one_factory_call():
+    async def scenario():
+        cache = ExplanationCache(db_path=None)
+        calls = []
+
+        async def factory():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"summary": "x"}, True
+
+        values = await asyncio.gather(*(cache.get_or_create("k", factory) for _ in range(5)))
+        assert values == [{"summary": "x"}] * 5
+        assert len(calls) == 1
+        assert cache.counters["coalesced"] == 4
+        assert await cache.get_or_create("k", factory) == {"summary": "x"}
+        assert len(calls) == 1
+        assert not cache.is_pending("k")
+    run(scenario())
+
+
+def test_failure_reaches_every_waiter_and_is_not_cached():
+    async def scenario():
+        cache = ExplanationCache(db_path=None)
+
+        async def failing():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("upstream down")
+
+        results = await asyncio.gather(*(cache.get_or_create("k", failing) for _ in range(3)),
+                                       return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert cache.get("k") is None
+    run(scenario())
+
+
+def test_non_cacheable_values_are_shared_but_not_stored():
+    async def scenario():
+        cache = ExplanationCache(db_path=None)
+
+        async def factory():
+            await asyncio.sleep(0.01)
+            return {"source": "template"}, False
+
+        values = await asyncio.gather(cache.get_or_create("k", factory), cache.get_or_create("k", factory))
+        assert values == [{"source": "template"}] * 2
+        assert cache.get("k") is None
+    run(scenario())
+
+
+def test_many_creates_missing_keys_in_one_call_and_joins_pending_ones():
+    async def scenario():
+        cache = ExplanationCache(db_path=None)
+        cache.put("cached", {"v": "cached"})
+        calls = []
+
+        async def factory(keys):
+            calls.append(list(keys))
+            await asyncio.sleep(0.01)
+            return {k: ({"v": k}, k != "b") for k in keys}
+
+        first = cache.get_or_create_many(["cached", "a", "b"], factory)
+        second = cache.get_or_create_many(["a", "c"], factory)
+        assert first[0].done() and first[0].result() == {"v": "cached"}
+        assert second[0] is first[1]
+        await asyncio.gather(*first, *second)
+        assert calls == [["a", "b"], ["c"]]
+        assert [f.result() for f in second] == [{"v": "a"}, {"v": "c"}]
+        assert cache.get("a") == {"v": "a"} and cache.get("b") is None
+        assert cache.counters["coalesced"] == 1
+    run(scenario())
+
+
+def test_many_propagates_factory_errors():
+    async def scenario():
+        cache = ExplanationCache(db_path=None)
+
+        async def factory(keys):
+            raise RuntimeError("upstream down")
+
+        futures = cache.get_or_create_many(["a", "b"], factory)
+        await asyncio.wait(futures)
+        assert all(isinstance(f.exception(), RuntimeError) for f in futures)
+        assert not cache.is_pending("a") and not cache.is_pending("b")
+    run(scenario())
+
+
+def test_many_keeps_creating_after_callers_stop_waiting():
+    async def scenario():
+        cache = ExplanationCache(db_path=None)
+
+        async def factory(keys):
+            await asyncio.sleep(0.05)
+            return {k: ({"v": k}, True) for k in keys}
+
+        futures = cache.get_or_create_many(["a"], factory)
+        done, _ = await asyncio.wait(futures, timeout=0.001)
+        assert not done
+        await asyncio.gather(*cache._tasks)
+        assert cache.get("a") == {"v": "a"}
+    run(scenario())
+
+
+def test_entries_expire_and_survive_in_sqlite(tmp_path, monkeypatch):
+    db = str(tmp_path / "cache.sqlite3")
+    cache = ExplanationCache(db_path=db, ttl_seconds=60, version="v1")
+    cache.put("k", {"v": 1})
+    assert ExplanationCache(db_path=db, ttl_seconds=60, version="v1").get("k") == {"v": 1}
+    assert ExplanationCache(db_path=db, ttl_seconds=60, version="v2").get("k") is None
+
+    later = time.time() + 61
+    monkeypatch.setattr(explanation_cache.time, "time", lambda: later)
+    assert cache.get("k") is None
+
+
+@pytest.mark.parametrize("max_entries", [1, 3])
+def test_memory_tier_is_bounded(max_entries):
+    cache = ExplanationCache(max_entries=max_entries, db_path=None)
+    for i in range(5):
+        cache.put(str(i), {"v": i})
+    assert cache.stats()["memory_entries"] == max_entries
+    assert cache.get("4") == {"v": 4}
+    assert cache.get("0") is None
+
+
+class CountingConnection:
+    def __init__(self, db):
+        self.db = db
+        self.commits = 0
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    def commit(self):
+        self.commits += 1
+        self.db.commit()
+
+
+def test_disk_hits_resolve_without_the_factory(tmp_path):
+    db = str(tmp_path / "cache.sqlite3")
+    ExplanationCache(db_path=db).put("a", {"v": "a"})
+
+    async def scenario():
+        cache = ExplanationCache(db_path=db)
+
+        async def factory(keys):
+            return {k: ({"v": k}, True) for k in keys}
+
+        futures = cache.get_or_create_many(["a", "b"], factory)
+        assert not any(f.done() for f in futures)   # the disk lookup runs off the loop
+        await asyncio.gather(*futures)
+        assert [f.result() for f in futures] == [{"v": "a"}, {"v": "b"}]
+        assert (cache.counters["disk_hits"], cache.counters["misses"]) == (1, 1)
+        assert await cache.get_or_create("a", None) == {"v": "a"}   # now in memory
+    run(scenario())
+
+
+def test_stores_do_not_wait_for_the_disk_and_share_a_commit(tmp_path):
+    db = str(tmp_path / "cache.sqlite3")
+    cache = ExplanationCache(db_path=db)
+    cache._db = CountingConnection(cache._db)
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        with cache._db_lock:                        # a slow disk
+            for i in range(20):
+                cache.put(str(i), {"v": i})
+            assert cache.get_or_create_many(["7"], None)[0].result() == {"v": 7}
+        await loop.run_in_executor(None, cache.flush)
+    run(scenario())
+
+    assert cache._db.commits == 1
+    assert ExplanationCache(db_path=db).get("19") == {"v": 19}
@@ -0,0 +1,101 @@
+import asyncio
+import json
+import os
+import shutil
+
+from fastapi.testclient import TestClient
+
+import main
+from conftest import SAMPLE_DIR
+from jobs import JobManager
+
+SAMPLE = os.path.join(SAMPLE_DIR, "test2_CYP2D6_PM_CODEINE_TOXIC.vcf")
+
+
+def scrub(results):
+    return [{k: v for k, v in r.items() if k not in ("timestamp", "quality_metrics")} for r in results]
+
+
+def test_job_runs_through_every_stage_and_matches_analyze():
+    with TestClient(main.app) as client, open(SAMPLE, "rb") as f:
+        raw = f.read()
+        submitted = client.post("/jobs", files={"vcf_file": ("p.vcf", raw)}, data={"drugs": "CODEINE,WARFARIN"})
+        assert submitted.status_code == 202
+        job_id = submitted.json()["job_id"]
+
+        status = client.get(f"/jobs/{job_id}", params={"wait": 10}).json()
+        assert status["status"] == "done"
+        assert all(stage["status"] == "done" for stage in status["stages"].values())
+        assert status["stages"]["explanations"]["completed"] == 2
+        assert "result" not in status and "path" not in status
+
+        result = client.get(f"/jobs/{job_id}/result").json()
+        direct = client.post("/analyze", files={"vcf_file": ("p.vcf", raw)}, data={"drugs": "CODEINE,WARFARIN"})
+        assert scrub(result) == scrub(direct.json())
+
+
+def test_failed_and_unknown_jobs():
+    with TestClient(main.app) as client:
+        job_id = client.post("/jobs", files={"vcf_file": ("e.vcf", b"##fileformat=VCFv4.2\n")},
+                             data={"drugs": "CODEINE"}).json()["job_id"]
+        status = client.get(f"/jobs/{job_id}", params={"wait": 10}).json()
+        assert status["status"] == "failed" and status["error"]
+        assert client.get(f"/jobs/{job_id}/result").status_code == 400
+        assert client.get("/jobs/nope").status_code == 404
+
+
+def submit(manager: JobManager, drugs=("CODEINE",)) -> dict:
+    path = manager.new_upload_path("p.vcf")
+    shutil.copyfile(SAMPLE, path)
+    return manager.submit(path, "p.vcf", list(drugs))
+
+
+def test_queued_and_interrupted_jobs_run_again_after_a_restart(tmp_path):
+    job_dir = str(tmp_path)
+
+    async def before_restart():
+        manager = JobManager(workers=0, job_dir=job_dir)     # nothing picks the jobs up
+        await manager.start()
+        queued, interrupted, lost = submit(manager), submit(manager), submit(manager)
+        interrupted["status"] = "running"
+        manager._save(interrupted)
+        os.remove(lost["path"])
+        await manager.stop()
+        return queued["id"], interrupted["id"], lost["id"]
+
+    async def after_restart(ids):
+        manager = JobManager(workers=1, job_dir=job_dir)
+        await manager.start()
+        jobs = [await manager.wait(job_id, 10) for job_id in ids]
+        await manager.stop()
+        return jobs
+
+    ids = asyncio.run(before_restart())
+    queued, interrupted, lost = asyncio.run(after_restart(ids))
+    assert queued["status"] == interrupted["status"] == "done"
+    assert queued["result"]["pharmacogenomic_profile"]["phenotype"] == "PM"
+    assert lost["status"] == "failed"
+    assert os.listdir(os.path.join(job_dir, "uploads")) == []
+
+    # Finished jobs keep their results across a restart
+    async def reload():
+        manager = JobManager(workers=1, job_dir=job_dir)
+        await manager.start()
+        job = manager.get(ids[0])
+        await manager.stop()
+        return job
+    assert json.dumps(asyncio.run(reload())["result"]) == json.dumps(queued["result"])
+
+
+def test_temporary_upload_dir_lives_between_start_and_stop():
+    async def scenario():
+        manager = JobManager(workers=0)
+        assert manager.upload_dir is None
+        await manager.start()
+        upload_dir = manager.upload_dir
+        submit(manager)
+        assert len(os.listdir(upload_dir)) == 1
+        await manager.stop()
+        return upload_dir
+
+    assert not os.path.exists(asyncio.run(scenario()))
@@ -0,0 +1,88 @@
+import json
+import os
+import shutil
+
+import pytest
+from fastapi.testclient import TestClient
+
+import cpic_rules
+import main
+from conftest import SAMPLE_DIR
+from cpic_rules import current_kb, knowledge_base
+
+TOKEN = "reload-secret"
+
+
+@pytest.fixture
+def kb_dir(tmp_path, monkeypatch):
+    """A copy of the knowledge base that the reload endpoint reads; the bundled one is current again afterwards."""
+    path = str(tmp_path / "kb")
+    shutil.copytree(cpic_rules.KB_DIR, path, ignore=shutil.ignore_patterns(".compiled.pickle"))
+    monkeypatch.setattr(main, "reload_knowledge_base", lambda: cpic_rules.reload_knowledge_base(path))
+    yield path
+    cpic_rules.reload_knowledge_base()
+
+
+def set_version(kb_dir: str, version: str) -> None:
+    path = os.path.join(kb_dir, "manifest.json")
+    with open(path) as f:
+        manifest = json.load(f)
+    manifest["version"] = version
+    with open(path, "w") as f:
+        json.dump(manifest, f)
+
+
+def reload(client, token=TOKEN):
+    return client.post("/knowledge-base/reload", headers={"X-Reload-Token": token} if token else {})
+
+
+def test_reload_is_disabled_without_a_configured_token(kb_dir, monkeypatch):
+    monkeypatch.setattr(main, "KB_RELOAD_TOKEN", "")
+    set_version(kb_dir, "2099.1.0")
+    before = current_kb().version
+    with TestClient(main.app) as client:
+        for token in (None, "", "anything"):
+            response = reload(client, token)
+            assert response.status_code == 403
+            assert "KB_RELOAD_TOKEN" in response.json()["detail"]
+    assert current_kb().version == before
+
+
+def test_reload_requires_the_token(kb_dir, monkeypatch):
+    monkeypatch.setattr(main, "KB_RELOAD_TOKEN", TOKEN)
+    with TestClient(main.app) as client:
+        assert reload(client, None).status_code == 403
+        assert reload(client, "wrong").status_code == 403
+
+
+def test_reload_swaps_in_a_new_version_and_keeps_the_old_one(kb_dir, monkeypatch):
+    monkeypatch.setattr(main, "KB_RELOAD_TOKEN", TOKEN)
+    old = current_kb()
+    with TestClient(main.app) as client:
+        unchanged = reload(client).json()
+        assert unchanged == {"version": old.version, "previous_version": old.version, "changed": False}
+
+        set_version(kb_dir, "2099.1.0")
+        body = reload(client).json()
+        assert body["changed"] and body["previous_version"] == old.version
+        assert body["version"].startswith("2099.1.0+")
+        assert client.get("/knowledge-base").json()["version"] == body["version"]
+
+        with open(os.path.join(SAMPLE_DIR, "test2_CYP2D6_PM_CODEINE_TOXIC.vcf"), "rb") as f:
+            result = client.post("/analyze", files={"vcf_file": ("p.vcf", f.read())},
+                                 data={"drugs": "CODEINE"}).json()
+        assert result["quality_metrics"]["knowledge_base_version"] == body["version"]
+
+    # Requests that started on the old version can still resolve it
+    assert knowledge_base(old.version).version == old.version != current_kb().version
+
+
+def test_invalid_files_leave_the_current_version_active(kb_dir, monkeypatch):
+    monkeypatch.setattr(main, "KB_RELOAD_TOKEN", TOKEN)
+    before = current_kb().version
+    with open(os.path.join(kb_dir, "gene_drug_rules.json"), "w") as f:
+        f.write("{not json")
+    with TestClient(main.app) as client:
+        response = reload(client)
+    assert response.status_code == 400
+    assert current_kb().version == before
@@ -0,0 +1,138 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import llm_explainer
+from circuit_breaker import CircuitBreaker
+from explanation_cache import ExplanationCache
+from llm_explainer import EXPLANATION_FIELDS, explain_many
+
+
+def request(drug: str = "CODEINE", gene: str = "CYP2D6") -> dict:
+    return {"drug": drug, "gene": gene, "phenotype": "PM", "diplotype": "*4/*4", "risk_label": "Ineffective",
+            "severity": "high", "detected_variants": [{"rsid": "rs3892097"}],
+            "recommendation": "Avoid codeine.", "mechanism": "No conversion to morphine."}
+
+
+def explanation(drug: str) -> dict:
+    return {field: f"{field} for {drug}" for field in EXPLANATION_FIELDS}
+
+
+def reply(body) -> httpx.Response:
+    text = json.dumps(body)
+    return httpx.Response(200, json={"candidates": [{"content": {"parts": [{"text": text}]}}]},
+                          request=httpx.Request("POST", llm_explainer.GEMINI_URL))
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    """A stubbed Gemini: set .delay, .fail or .drop (drugs left out of a batch reply) per test."""
+    class Stub:
+        delay = 0.0
+        fail = False
+        drop = ()
+        posts = 0
+
+    stub = Stub()
+
+    async def post(payload):
+        stub.posts += 1
+        await asyncio.sleep(stub.delay)
+        if stub.fail:
+            raise httpx.ConnectError("unreachable")
+        prompt = payload["contents"][0]["parts"][0]["text"]
+        drugs = [d for d in ("CODEINE", "WARFARIN", "CLOPIDOGREL") if d in prompt]
+        if len(drugs) == 1:
+            return reply(explanation(drugs[0]))
+        return reply({d: explanation(d) for d in drugs if d not in stub.drop})
+
+    monkeypatch.setattr(llm_explainer, "GEMINI_API_KEY", "test-key")
+    monkeypatch.setattr(llm_explainer, "_post", post)
+    monkeypatch.setattr(llm_explainer, "PREGENERATED", {})
+    monkeypatch.setattr(llm_explainer, "EXPLANATION_CACHE", ExplanationCache(db_path=None))
+    monkeypatch.setattr(llm_explainer, "LLM_BREAKER", CircuitBreaker(failure_threshold=2, reset_seconds=60))
+    return stub
+
+
+def test_miss_then_hit(gemini):
+    async def scenario():
+        first = await explain_many([request()], budget=1)
+        second = await explain_many([request()], budget=1)
+        return first, second
+
+    (first,), (second,) = asyncio.run(scenario())
+    assert first == (explanation("CODEINE"), "miss")
+    assert second == (explanation("CODEINE"), "hit")
+    assert gemini.posts == 1
+
+
+def test_deadline_falls_back_and_the_call_still_fills_the_cache(gemini):
+    gemini.delay = 0.2
+
+    async def scenario():
+        late = await explain_many([request()], budget=0.02)
+        await asyncio.gather(*llm_explainer.EXPLANATION_CACHE._tasks)
+        return late, await explain_many([request()], budget=0.02)
+
+    (late,), (cached,) = asyncio.run(scenario())
+    assert late[1] == "fallback"
+    assert late[0]["source"] == "template" and late[0]["fallback_reason"] == "deadline"
+    assert "error" not in late[0]
+    assert cached == (explanation("CODEINE"), "hit")
+    assert gemini.posts == 1
+
+
+def test_concurrent_requests_for_one_drug_share_a_call(gemini):
+    gemini.delay = 0.05
+
+    async def scenario():
+        return await asyncio.gather(*(explain_many([request()], budget=1) for _ in range(4)))
+
+    outcomes = sorted(result[0][1] for result in asyncio.run(scenario()))
+    assert outcomes == ["coalesced"] * 3 + ["miss"]
+    assert gemini.posts == 1
+
+
+def test_drugs_of_one_patient_share_one_call(gemini):
+    drugs = [request("CODEINE"), request("WARFARIN", "CYP2C9"), request("CLOPIDOGREL", "CYP2C19")]
+    results = asyncio.run(explain_many(drugs, budget=1))
+    assert results == [(explanation(r["drug"]), "miss") for r in drugs]
+    assert gemini.posts == 1
+
+
+def test_batch_reply_missing_a_drug_falls_back_for_that_drug_only(gemini):
+    gemini.drop = ("WARFARIN",)
+    results = asyncio.run(explain_many([request("CODEINE"), request("WARFARIN", "CYP2C9")], budget=1))
+    assert results[0] == (explanation("CODEINE"), "miss")
+    assert results[1][1] == "fallback" and results[1][0]["fallback_reason"] == "malformed"
+    assert gemini.posts == 1
+
+
+def test_failures_open_the_circuit(gemini):
+    gemini.fail = True
+
+    async def scenario():
+        return [(await explain_many([request()], budget=1))[0] for _ in range(3)]
+
+    reasons = [explained["fallback_reason"] for explained, _ in asyncio.run(scenario())]
+    assert reasons == ["error", "error", "circuit_open"]
+    assert gemini.posts == 2
+    assert llm_explainer.LLM_BREAKER.state == CircuitBreaker.OPEN
+
+
+def test_no_api_key_means_disabled(gemini, monkeypatch):
+    monkeypatch.setattr(llm_explainer, "GEMINI_API_KEY", "")
+    ((explained, outcome),) = asyncio.run(explain_many([request()], budget=1))
+    assert (outcome, explained["fallback_reason"]) == ("fallback", "disabled")
+    assert gemini.posts == 0
+
+
+def test_default_budget_scales_with_the_batch(monkeypatch):
+    monkeypatch.setattr(llm_explainer, "LLM_BUDGET_SECONDS", 3.0)
+    monkeypatch.setattr(llm_explainer, "LLM_BUDGET_PER_DRUG_SECONDS", 2.0)
+    monkeypatch.setattr(llm_explainer, "LLM_BATCH_SIZE", 4)
+    assert [llm_explainer.default_budget(n) for n in (0, 1, 2, 4, 20)] == [3.0, 3.0, 5.0, 9.0, 9.0]
+    monkeypatch.setattr(llm_explainer, "LLM_BUDGET_PER_DRUG_SECONDS", 100.0)
+    assert llm_explainer.default_budget(4) == llm_explainer.LLM_TIMEOUT_SECONDS
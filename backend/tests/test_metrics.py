@@ -0,0 +1,89 @@
+import os
+import re
+import threading
+
+from fastapi.testclient import TestClient
+
+import main
+import metrics
+from conftest import SAMPLE_DIR
+from metrics import Counter, Gauge, Histogram
+
+SAMPLE_LINE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{[a-zA-Z_]+="[^"]*"(,[a-zA-Z_]+="[^"]*")*\})? -?[0-9.e+-]+$')
+
+
+def test_histogram_buckets_are_cumulative():
+    h = Histogram("t_seconds", "help", labels=("stage",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 5.0):
+        h.observe(value, "parse")
+    samples = {name + labels: value for name, labels, value in h.samples()}
+    assert samples == {
+        't_seconds_bucket{stage="parse",le="0.1"}': 2,
+        't_seconds_bucket{stage="parse",le="1.0"}': 3,
+        't_seconds_bucket{stage="parse",le="+Inf"}': 4,
+        't_seconds_sum{stage="parse"}': 5.65,
+        't_seconds_count{stage="parse"}': 4,
+    }
+    assert h.count("parse") == 4 and h.count("other") == 0
+
+
+def test_counter_and_gauge():
+    c = Counter("c_total", "help", labels=("path",))
+    c.inc(1, "/b")
+    c.inc(2, "/a")
+    assert list(c.samples()) == [("c_total", '{path="/a"}', 2), ("c_total", '{path="/b"}', 1)]
+    g = Gauge("g", "help")
+    g.inc()
+    g.inc()
+    g.dec()
+    assert g.value() == 1
+    g.set(7)
+    assert list(g.samples()) == [("g", "", 7)]
+
+
+def test_scrapes_survive_concurrent_observations():
+    h = Histogram("t_seconds", "help", labels=("stage",))
+    c = Counter("c_total", "help", labels=("k",))
+    stop = threading.Event()
+
+    def observe(n):
+        i = 0
+        while not stop.is_set():
+            h.observe(0.001 * (i % 50), f"s{n}-{i % 100}")
+            c.inc(1, f"{n}-{i % 100}")
+            i += 1
+
+    threads = [threading.Thread(target=observe, args=(n,)) for n in range(2)]
+    for t in threads:
+        t.start()
+    try:
+        for _ in range(10):
+            list(h.samples())
+            list(c.samples())
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+
+
+def test_metrics_endpoint_exposes_request_and_stage_series():
+    with open(os.path.join(SAMPLE_DIR, "test2_CYP2D6_PM_CODEINE_TOXIC.vcf"), "rb") as f:
+        raw = f.read()
+    with TestClient(main.app) as client:
+        parsed_before = metrics.VARIANTS_PARSED.value()
+        client.post("/analyze", files={"vcf_file": ("p.vcf", raw)}, data={"drugs": "CODEINE"})
+        client.get("/jobs/some-unknown-id")
+        response = client.get("/metrics")
+
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    lines = response.text.splitlines()
+    for line in lines:
+        assert line.startswith("# HELP ") or line.startswith("# TYPE ") or SAMPLE_LINE.match(line), line
+    body = response.text
+    assert 'pharmaguard_requests_total{path="/analyze"}' in body
+    assert 'pharmaguard_requests_total{path="/jobs/{job_id}"}' in body
+    assert "some-unknown-id" not in body
+    for stage in ("upload_read", "parse", "serialize"):
+        assert f'pharmaguard_stage_seconds_count{{stage="{stage}"}}' in body
+    assert metrics.VARIANTS_PARSED.value() > parsed_before
+    assert "pharmaguard_llm_fallback_ratio " in body
@@ -0,0 +1,117 @@
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import patient_store
+from conftest import SAMPLE_DIR
+from patient_store import PatientStore
+from vcf_parser import UNKNOWN_PATIENT_ID
+
+TOKEN = "patient-secret"
+NAME = "test2_CYP2D6_PM_CODEINE_TOXIC.vcf"
+
+
+def sample() -> bytes:
+    with open(os.path.join(SAMPLE_DIR, NAME), "rb") as f:
+        return f.read()
+
+
+def scrub(results):
+    return [{k: v for k, v in r.items() if k not in ("timestamp", "quality_metrics")} for r in results]
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = PatientStore(str(tmp_path / "patients.sqlite3"))
+    monkeypatch.setattr(main, "PATIENT_STORE", store)
+    monkeypatch.setattr(main, "PATIENT_TOKEN", TOKEN)
+    return store
+
+
+@pytest.fixture
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+
+def upload(client, token=TOKEN, drugs="CODEINE,WARFARIN", **form):
+    headers = {"X-Patient-Token": token} if token is not None else {}
+    return client.post("/analyze", files={"vcf_file": (NAME, sample())}, data={"drugs": drugs, **form},
+                       headers=headers)
+
+
+def test_store_is_off_without_a_database(client, monkeypatch):
+    monkeypatch.setattr(main, "PATIENT_STORE", None)
+    monkeypatch.setattr(main, "PATIENT_TOKEN", TOKEN)
+    assert upload(client, store_profile="true").status_code == 400
+    assert client.get("/patients/p1", headers={"X-Patient-Token": TOKEN}).status_code == 404
+    # Plain analyses are unaffected
+    assert upload(client, token=None).status_code == 200
+
+
+def test_store_stays_closed_without_a_configured_token(client, store, monkeypatch):
+    monkeypatch.setattr(main, "PATIENT_TOKEN", "")
+    for token in (None, "", "anything"):
+        assert upload(client, token=token, profile_id="p1").status_code == 403
+        assert client.get("/patients/p1", headers={"X-Patient-Token": token or ""}).status_code == 403
+    assert store.stats()["profiles"] == 0
+
+
+def test_every_route_checks_the_token(client, store):
+    profile_id = upload(client, store_profile="true").headers["X-Profile-Id"]
+    for token in (None, "wrong"):
+        headers = {"X-Patient-Token": token} if token is not None else {}
+        assert upload(client, token=token, profile_id="p2").status_code == 403
+        assert client.get(f"/patients/{profile_id}", headers=headers).status_code == 403
+        assert client.get(f"/patients/{profile_id}/analyze?drugs=CODEINE", headers=headers).status_code == 403
+        assert client.delete(f"/patients/{profile_id}", headers=headers).status_code == 403
+    assert store.get(profile_id) is not None and store.get("p2") is None
+
+
+def test_stored_profile_answers_like_the_upload(client, store):
+    uploaded = upload(client, store_profile="true")
+    assert uploaded.status_code == 200
+    profile_id = uploaded.headers["X-Profile-Id"]
+    assert profile_id != uploaded.json()[0]["patient_id"]
+
+    headers = {"X-Patient-Token": TOKEN}
+    again = client.get(f"/patients/{profile_id}/analyze?drugs=CODEINE,WARFARIN", headers=headers)
+    assert again.status_code == 200
+    assert scrub(again.json()) == scrub(uploaded.json())
+
+    profile = client.get(f"/patients/{profile_id}", headers=headers).json()
+    assert profile["profile_id"] == profile_id
+    assert profile["genes"]["CYP2D6"] == {"diplotype": "*4/*4", "phenotype": "PM"}
+
+    assert client.delete(f"/patients/{profile_id}", headers=headers).json()["deleted"]
+    assert client.get(f"/patients/{profile_id}", headers=headers).status_code == 404
+
+
+def test_caller_chosen_ids_are_checked_and_replaced_on_upload(client, store):
+    assert upload(client, profile_id=UNKNOWN_PATIENT_ID).status_code == 400
+    assert upload(client, profile_id="../etc").status_code == 400
+    assert upload(client, profile_id="p1").headers["X-Profile-Id"] == "p1"
+    first = store.get("p1")["saved_at"]
+    upload(client, profile_id="p1")
+    assert store.get("p1")["saved_at"] >= first and store.stats()["profiles"] == 1
+
+
+def test_profiles_expire(client, store, monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(patient_store.time, "time", lambda: now[0])
+    upload(client, profile_id="p1")
+    headers = {"X-Patient-Token": TOKEN}
+    assert client.get("/patients/p1", headers=headers).status_code == 200
+    now[0] += store.ttl_seconds + 1
+    assert client.get("/patients/p1", headers=headers).status_code == 404
+
+
+def test_profile_from_an_unloaded_knowledge_base_must_be_rebuilt(client, store):
+    upload(client, profile_id="p1")
+    with store._lock:
+        store._db.execute("UPDATE profiles SET profile = json_set(profile, '$.knowledge_base_version', 'gone')")
+        store._db.commit()
+    response = client.get("/patients/p1/analyze?drugs=CODEINE", headers={"X-Patient-Token": TOKEN})
+    assert response.status_code == 409
@@ -0,0 +1,76 @@
+import asyncio
+import os
+
+import pytest
+
+import pipeline
+from conftest import SAMPLE_DIR
+from explanation_cache import ExplanationCache
+from llm_explainer import EXPLANATION_CACHE
+from pipeline import evaluate_and_explain, parse_vcf_path
+from result_cache import genotype_fingerprint
+
+SAMPLE = os.path.join(SAMPLE_DIR, "test2_CYP2D6_PM_CODEINE_TOXIC.vcf")
+
+
+@pytest.fixture
+def results(monkeypatch):
+    cache = ExplanationCache(db_path=None, table="results")
+    monkeypatch.setattr(pipeline, "RESULT_CACHE", cache)
+    return cache
+
+
+def explainer(monkeypatch, outcome):
+    calls = []
+
+    async def explain_many(requests, budget=None):
+        calls.append([r["drug"] for r in requests])
+        return [({"summary": r["drug"]}, outcome) for r in requests]
+    monkeypatch.setattr(pipeline, "explain_many", explain_many)
+    return calls
+
+
+def analyze(parsed, drugs):
+    async def scenario():
+        return await asyncio.gather(*evaluate_and_explain(parsed, drugs))
+    return asyncio.run(scenario())
+
+
+def test_fingerprint_ignores_everything_but_the_genotypes():
+    parsed = parse_vcf_path(SAMPLE)
+    variants = parsed["pgx_variants"]["CYP2D6"]
+    assert genotype_fingerprint([dict(v) for v in variants]) == genotype_fingerprint(variants)
+    changed = [dict(variants[0], genotype="0|1"), *variants[1:]]
+    assert genotype_fingerprint(changed) != genotype_fingerprint(variants)
+
+
+def test_repeat_analysis_skips_the_explainer(monkeypatch, results):
+    calls = explainer(monkeypatch, "miss")
+    parsed = parse_vcf_path(SAMPLE)
+    first = analyze(parsed, ["CODEINE", "WARFARIN"])
+    second = analyze(parse_vcf_path(SAMPLE), ["CODEINE", "WARFARIN"])
+    assert calls == [["CODEINE", "WARFARIN"]]
+    assert first == second
+    assert results.counters["stores"] == 2 and results.counters["memory_hits"] == 2
+
+
+@pytest.mark.parametrize("outcome", ["pregenerated", "fallback", "coalesced"])
+def test_outcomes_not_from_the_llm_are_not_cached(monkeypatch, results, outcome):
+    calls = explainer(monkeypatch, outcome)
+    parsed = parse_vcf_path(SAMPLE)
+    analyze(parsed, ["CODEINE"])
+    analyze(parsed, ["CODEINE"])
+    assert calls == [["CODEINE"], ["CODEINE"]]
+    assert results.counters["stores"] == 0
+
+
+def test_only_the_explanation_cache_reports_pregenerated_hits():
+    assert "pregenerated_hits" in EXPLANATION_CACHE.stats()
+    assert "pregenerated_hits" not in pipeline.RESULT_CACHE.stats()
+
+
+def test_extra_hits_count_towards_the_hit_rate():
+    cache = ExplanationCache(db_path=None, extra_hits=("pregenerated_hits",))
+    cache.counters["pregenerated_hits"] = 3
+    cache.counters["misses"] = 1
+    assert cache.stats()["hit_rate"] == 0.75
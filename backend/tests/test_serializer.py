@@ -0,0 +1,88 @@
+import time
+
+import pytest
+from fastapi.responses import JSONResponse
+
+import serializer
+from cpic_rules import current_kb
+from pipeline import assemble_result, unsupported_result
+from serializer import encode_content
+
+KB = current_kb()
+PARSED = {"parse_success": True, "total_variants": 20, "knowledge_base_version": KB.version}
+
+
+def plain(content) -> bytes:
+    return JSONResponse(content=None).render(content)
+
+
+def result(drug: str, phenotype: str, patient_id: str = 'P "1" – Ünïcode', **explanation) -> dict:
+    evaluation = {"drug": drug, "gene": KB.gene_drug_rules[drug]["gene"], "phenotype": phenotype,
+                  "diplotype": "*4/*4",
+                  "detected_variants": [{"rsid": "rs3892097", "gene": "CYP2D6", "star_allele": "*4",
+                                         "genotype": "1/1", "depth": 12, "af": 1.0, "pass": True}]}
+    llm = {"summary": "100% of ‘activity’ lost\n", "source": "template", **explanation}
+    return assemble_result(patient_id, evaluation, llm, PARSED, time.time())
+
+
+@pytest.mark.parametrize("drug, phenotype", sorted(KB.result_templates))
+def test_every_frame_encodes_like_json_response(drug, phenotype):
+    r = result(drug, phenotype)
+    assert encode_content(r) == plain(r)
+
+
+def test_lists_and_unsupported_results():
+    results = [result(drug, phenotype) for drug, phenotype in sorted(KB.result_templates)[:5]]
+    results.append(unsupported_result("P1", "FOO", PARSED, time.time()))
+    assert encode_content(results) == plain(results)
+    assert encode_content(results[-1]) == plain(results[-1])
+
+
+def test_cached_fragments_keep_value_types_apart():
+    drug, phenotype = sorted(KB.result_templates)[0]
+    for value in (1, 1.0, True, "1", [1, 2]):
+        r = result(drug, phenotype, confidence=value)
+        assert encode_content(r) == plain(r)
+
+
+def test_results_that_do_not_match_their_frame_take_the_plain_path():
+    drug, phenotype = sorted(KB.result_templates)[0]
+    edited = result(drug, phenotype)
+    edited["risk_assessment"]["severity"] = "edited"
+    reordered = dict(reversed(list(result(drug, phenotype).items())))
+    extra = dict(result(drug, phenotype), note="extra")
+    for r in (edited, reordered, extra):
+        assert encode_content(r) == plain(r)
+
+
+def test_other_content_is_plain_json():
+    for content in ({"detail": "x"}, [1, 2], [result(*sorted(KB.result_templates)[0]), {"detail": "x"}], None):
+        assert encode_content(content) == plain(content)
+
+
+def test_frame_sets_are_bounded(monkeypatch):
+    monkeypatch.setattr(serializer, "_FRAMES", {f"old{i}": {} for i in range(serializer.MAX_FRAME_SETS)})
+    serializer._frames(KB.version)
+    assert len(serializer._FRAMES) == serializer.MAX_FRAME_SETS
+    assert "old0" not in serializer._FRAMES and KB.version in serializer._FRAMES
+
+
+def test_matching_results_use_the_precompiled_frame(monkeypatch):
+    serializer._frames(KB.version)
+
+    def no_plain_path(content):
+        raise AssertionError("took the plain json path")
+
+    r = result(*sorted(KB.result_templates)[0])
+    monkeypatch.setattr(serializer, "_encode", no_plain_path)
+    encoded = encode_content(r)
+    monkeypatch.undo()
+    assert encoded == plain(r)
+
+
+def test_profile_with_a_diplotype_note():
+    r = result("CODEINE", "PM")
+    r["pharmacogenomic_profile"]["detected_variants"].append(
+        {"rsid": "rs35742686", "gene": "CYP2D6", "star_allele": "*3", "genotype": "0/1"})
+    r["pharmacogenomic_profile"]["diplotype_note"] = "3 variant allele copies detected; leaves out *3"
+    assert encode_content(r) == plain(r)
@@ -0,0 +1,79 @@
+import json
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from conftest import SAMPLE_DIR
+
+DRUGS = "CODEINE,WARFARIN,FOO"
+SUMMARY_FIELDS = {"results", "vcf_parsing_success", "total_variants_in_vcf", "pharmacogenomic_variants_found",
+                  "processing_time_seconds", "knowledge_base_version"}
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+
+@pytest.fixture(scope="module")
+def raw():
+    with open(os.path.join(SAMPLE_DIR, "test2_CYP2D6_PM_CODEINE_TOXIC.vcf"), "rb") as f:
+        return f.read()
+
+
+def scrub(results):
+    return sorted((json.dumps({k: v for k, v in r.items() if k not in ("timestamp", "quality_metrics")},
+                              sort_keys=True) for r in results))
+
+
+def test_ndjson_streams_every_result_then_a_summary(client, raw):
+    response = client.post("/analyze", files={"vcf_file": ("p.vcf", raw)}, data={"drugs": DRUGS, "stream": "ndjson"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    records = [json.loads(line) for line in response.text.splitlines()]
+    *results, summary = records
+
+    assert results[0]["drug"] == "FOO"   # ready results go out before any explanation finishes
+    plain = client.post("/analyze", files={"vcf_file": ("p.vcf", raw)}, data={"drugs": DRUGS}).json()
+    assert scrub(results) == scrub(plain)
+
+    summary = summary["summary"]
+    assert set(summary) == SUMMARY_FIELDS | {"patient_id"}
+    assert summary["patient_id"] == plain[0]["patient_id"]
+    assert summary["results"] == 3
+    assert summary["pharmacogenomic_variants_found"] == sum(
+        r["quality_metrics"]["pharmacogenomic_variants_found"] for r in plain)
+
+
+def test_sse_is_chosen_by_the_accept_header(client, raw):
+    response = client.post("/analyze", files={"vcf_file": ("p.vcf", raw)}, data={"drugs": DRUGS},
+                           headers={"Accept": "text/event-stream"})
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [block.split("\n") for block in response.text.strip().split("\n\n")]
+    assert [e[0] for e in events] == ["event: result"] * 3 + ["event: summary"]
+    assert all(e[1].startswith("data: ") and json.loads(e[1][6:]) for e in events)
+
+
+def test_unknown_stream_format_is_rejected(client, raw):
+    response = client.post("/analyze", files={"vcf_file": ("p.vcf", raw)}, data={"drugs": DRUGS, "stream": "xml"})
+    assert response.status_code == 400
+
+
+def test_cohort_stream_summary_counts_samples(client, raw):
+    lines = raw.decode("utf-8").splitlines()
+    cohort = []
+    for line in lines:
+        if line.startswith("#CHROM"):
+            line += "\tSECOND"
+        elif line and not line.startswith("#"):
+            line += "\t" + line.split("\t")[9]
+        cohort.append(line)
+    response = client.post("/analyze/cohort", files={"vcf_file": ("c.vcf", "\n".join(cohort).encode("utf-8"))},
+                           data={"drugs": DRUGS, "stream": "ndjson"})
+    *results, summary = [json.loads(line) for line in response.text.splitlines()]
+    assert len(results) == 6
+    assert set(summary["summary"]) == SUMMARY_FIELDS | {"samples"}
+    assert summary["summary"]["samples"] == 2
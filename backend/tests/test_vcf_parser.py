@@ -0,0 +1,127 @@
+import glob
+import itertools
+import os
+
+import pytest
+
+import vcf_parser
+from conftest import SAMPLE_DIR
+from synthetic_vcf import write_vcf
+from vcf_parser import VCFStreamParser, call_diplotype, determine_phenotype, diplotype_note, get_diplotype
+
+SAMPLES = sorted(glob.glob(os.path.join(SAMPLE_DIR, "*.vcf")))
+
+
+def parse_in_chunks(raw: bytes, size: int) -> dict:
+    parser = VCFStreamParser()
+    for i in range(0, len(raw), size):
+        parser.feed(raw[i:i + size])
+    return parser.close()
+
+
+def summary(parsed: dict) -> tuple:
+    return parsed["patient_id"], parsed["total_variants"], parsed["parse_success"], parsed["pgx_variants"]
+
+
+@pytest.mark.parametrize("path", SAMPLES, ids=os.path.basename)
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, 1000])
+def test_chunk_boundaries_do_not_change_the_parse(path, size):
+    with open(path, "rb") as f:
+        raw = f.read()
+    assert summary(parse_in_chunks(raw, size)) == summary(parse_in_chunks(raw, len(raw)))
+
+
+def test_synthetic_file_with_crlf_and_no_final_newline(tmp_path):
+    path = str(tmp_path / "synthetic.vcf")
+    write_vcf(path, 2000, pgx_density=0.02, missing_ids=0.3)
+    with open(path, "rb") as f:
+        raw = f.read()
+    whole = parse_in_chunks(raw, len(raw))
+    assert whole["total_variants"] == 2000
+    assert whole["pgx_variants"]
+
+    crlf = raw.replace(b"\n", b"\r\n").rstrip(b"\r\n")
+    for size in (5, 333, 4096):
+        assert summary(parse_in_chunks(crlf, size)) == summary(whole)
+
+
+def test_multibyte_character_split_across_chunks():
+    raw = "##source=Pipeline café\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tP1\n" \
+          "chr22\t42128945\trs3892097\tC\tT\t.\tPASS\t.\tGT\t1/1\n".encode("utf-8")
+    split = raw.index("é".encode("utf-8")) + 1
+    parser = VCFStreamParser()
+    parser.feed(raw[:split])
+    parser.feed(raw[split:])
+    parsed = parser.close()
+    assert parsed["patient_id"] == "P1"
+    assert [v["rsid"] for v in parsed["pgx_variants"]["CYP2D6"]] == ["rs3892097"]
+
+
+def test_unterminated_line_is_bounded(monkeypatch):
+    monkeypatch.setattr(vcf_parser, "MAX_LINE_BYTES", 100)
+    parser = VCFStreamParser()
+    parser.feed(b"#CHROM\tPOS\n" + b"x" * 60)
+    with pytest.raises(ValueError):
+        parser.feed(b"x" * 60)
+
+
+
+def parse_records(*records: str) -> dict:
+    header = "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tP1\n"
+    parser = VCFStreamParser()
+    parser.feed((header + "".join(r + "\n" for r in records)).encode("utf-8"))
+    return parser.close()
+
+
+def test_records_without_an_id_are_matched_on_coordinates():
+    parsed = parse_records("chr22\t42128945\t.\tC\tT\t.\tPASS\t.\tGT\t0/1",
+                           "chr22\t42128945\t.\tC\tG\t.\tPASS\t.\tGT\t0/1",
+                           "chr1\t12345\t.\tA\tG\t.\tPASS\t.\tGT\t0/1")
+    assert parsed["total_variants"] == 3
+    assert [v["rsid"] for v in parsed["pgx_variants"]["CYP2D6"]] == ["rs3892097"]
+    assert list(parsed["pgx_variants"]) == ["CYP2D6"]
+
+
+def test_non_pgx_records_are_counted_but_not_kept():
+    parsed = parse_records(*(f"chr1\t{1000 + i}\trs{900000 + i}\tA\tG\t.\tPASS\t.\tGT\t0/1" for i in range(50)))
+    assert parsed["total_variants"] == 50
+    assert parsed["variants"] == [] and parsed["pgx_variants"] == {}
+
+
+def variant(rsid: str, genotype: str = "0/1", gene: str = "CYP2D6") -> dict:
+    return {"rsid": rsid, "gene": gene, "genotype": genotype, "star_allele": "unknown"}
+
+
+def test_diplotype_does_not_depend_on_variant_order():
+    variants = [variant("rs16947"), variant("rs3892097"), variant("rs1065852"), variant("rs28371725")]
+    calls = {call_diplotype(list(p), "CYP2D6") for p in itertools.permutations(variants)}
+    assert calls == {call_diplotype(variants, "CYP2D6")}
+    # The two lowest-activity copies are kept: *4 (0), then *41 over *10 (both 0.5) by table order
+    assert get_diplotype(variants, "CYP2D6") == "*4/*41"
+
+
+def test_homozygous_alt_counts_two_copies():
+    assert get_diplotype([variant("rs3892097", "1/1")], "CYP2D6") == "*4/*4"
+    assert determine_phenotype([variant("rs3892097", "1/1")], "CYP2D6") == "PM"
+    assert get_diplotype([variant("rs3892097", "1|1")], "CYP2D6") == "*4/*4"
+
+
+def test_single_heterozygous_carrier_is_padded_with_reference():
+    assert get_diplotype([variant("rs3892097", "0/1")], "CYP2D6") == "*4/*1"
+    assert determine_phenotype([variant("rs3892097", "0/1")], "CYP2D6") == "IM"
+    assert get_diplotype([], "CYP2D6") == "*1/*1"
+    assert determine_phenotype([], "CYP2D6") == "NM"
+
+
+def test_unknown_variant_uses_its_annotated_star_allele():
+    unknown = dict(variant("rs999999", "1/1"), star_allele="*99")
+    assert get_diplotype([unknown], "CYP2D6") == "*99/*99"
+
+
+def test_note_names_the_copies_left_out_of_the_diplotype():
+    assert diplotype_note([variant("rs3892097", "1/1")], "CYP2D6") is None
+    assert diplotype_note([variant("rs3892097"), variant("rs16947")], "CYP2D6") is None
+    variants = [variant("rs3892097", "1|1"), variant("rs35742686")]
+    assert get_diplotype(variants, "CYP2D6") == "*4/*4"
+    assert diplotype_note(variants, "CYP2D6") == ("3 variant allele copies detected; the diplotype keeps the two "
+                                                  "with the lowest activity and leaves out *3")
@@ -1,8 +1,62 @@
+import io
 import re
-from typing import Dict, List, Optional
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass
 
-@dataclass
+from cpic_rules import (KnowledgeBase, REFERENCE_ALLELE, UNKNOWN_ALLELE, current_kb,
+                        diplotype_table, star_order)
+
+NON_CARRIER_GENOTYPES = frozenset(["0/0", "0|0", "./.", ".|.", ".", None])
+HOMOZYGOUS_ALT_GENOTYPES = frozenset(["1/1", "1|1"])
+
+GENE_ANNOTATION = re.compile(r'GENE=([^;\t]+)')
+
+# A partial line is buffered across chunks; anything longer is not a VCF record
+MAX_LINE_BYTES = 64 * 1024 * 1024
+
+# patient_id of a VCF with neither a patient header nor a sample column
+UNKNOWN_PATIENT_ID = "PATIENT_UNKNOWN"
+
+
+def lookup_locus(chrom: str, pos: int, kb: Optional[KnowledgeBase] = None) -> Optional[List[Tuple]]:
+    """Binary-search the locus index; returns the (ref, alt, rsid) sites at chrom:pos, if any."""
+    entry = (kb or current_kb()).locus_index.get(chrom)
+    if entry is None:
+        return None
+    positions, sites = entry
+    i = bisect_left(positions, pos)
+    if i < len(positions) and positions[i] == pos:
+        return sites[i]
+    return None
+
+
+def locus_rsid(chrom: str, pos: int, ref: str, alt: str, kb: Optional[KnowledgeBase] = None) -> Optional[str]:
+    """Return the known rsID whose coordinates and alleles match this record."""
+    for site_ref, site_alt, rsid in lookup_locus(chrom, pos, kb) or ():
+        if ref == site_ref and site_alt in alt.split(','):
+            return rsid
+    return None
+
+
+def is_pgx_candidate(chrom: str, pos_field: str, rsid: str, rest: str, kb: Optional[KnowledgeBase] = None) -> bool:
+    """
+    Cheap pre-filter on the CHROM/POS/ID prefix of a record line.
+    Only lines with a known rsID, a known PGx position or a PGx GENE=
+    annotation are worth splitting into columns and parsing in full.
+    """
+    kb = kb or current_kb()
+    if rsid.lower() in kb.variant_star_alleles:
+        return True
+    if pos_field.isdigit() and lookup_locus(chrom, int(pos_field), kb) is not None:
+        return True
+    if 'GENE=' in rest:
+        match = GENE_ANNOTATION.search(rest)
+        return match is not None and match.group(1) in kb.pgx_genes
+    return False
+
+
+@dataclass(slots=True)
 class VCFVariant:
     chrom: str
     pos: int
@@ -13,51 +67,97 @@ class VCFVariant:
     star_allele: Optional[str] = None
     genotype: Optional[str] = None
 
-def parse_vcf(content: str) -> Dict:
+class VCFStreamParser:
     """
-    Parse VCF file content and extract pharmacogenomic variants.
-    Returns structured data with variants, patient ID, and metadata.
+    Incremental VCF parser. Raw byte chunks are fed in as they are read and
+    complete lines are parsed immediately; a partial trailing line is carried
+    over to the next chunk, so memory stays bounded by the chunk size.
     """
-    lines = content.strip().split('\n')
-    variants = []
-    patient_id = "PATIENT_UNKNOWN"
-    metadata = {}
 
-    for line in lines:
+    def __init__(self, pgx_only: bool = True, kb: Optional[KnowledgeBase] = None):
+        # By default only PGx candidate records are materialised; every record line is counted.
+        # pgx_only=False keeps a VCFVariant for every record, as parse_vcf() used to.
+        self.pgx_only = pgx_only
+        # Fixed for the whole parse; a knowledge-base reload only affects later parsers
+        self.kb = kb or current_kb()
+        self.variants = []
+        self.total_variants = 0
+        self.patient_id = UNKNOWN_PATIENT_ID
+        self.metadata = {}
+        # gene -> unique PGx hits in file order, keyed on lower-cased rsID
+        self.pgx_variants = {}
+        self._tail = b""
+
+    def feed(self, chunk: bytes) -> None:
+        """Parse every complete line in chunk, buffering any partial last line."""
+        if self._tail:
+            chunk = self._tail + chunk
+        lines = chunk.split(b'\n')
+        self._tail = lines.pop()
+        if len(self._tail) > MAX_LINE_BYTES:
+            raise ValueError(f"VCF line longer than {MAX_LINE_BYTES} bytes")
+        for raw in lines:
+            self.parse_line(raw.decode('utf-8'))
+
+    def close(self) -> Dict:
+        """Flush the buffered last line and return the parse result."""
+        if self._tail:
+            self.parse_line(self._tail.decode('utf-8'))
+            self._tail = b""
+        return self.result()
+
+    def result(self) -> Dict:
+        return {
+            "patient_id": self.patient_id,
+            "total_variants": self.total_variants,
+            "variants": self.variants,
+            "pgx_variants": {gene: list(hits.values()) for gene, hits in self.pgx_variants.items()},
+            "metadata": self.metadata,
+            "parse_success": self.total_variants > 0,
+            "knowledge_base_version": self.kb.version
+        }
+
+    def parse_line(self, line: str) -> None:
         line = line.strip()
 
         # Skip empty lines
         if not line:
-            continue
+            return
 
         # Parse metadata headers
         if line.startswith('##'):
             if 'patient_id' in line.lower() or 'sample' in line.lower():
                 match = re.search(r'=([A-Za-z0-9_\-]+)', line)
                 if match:
-                    patient_id = match.group(1)
-            continue
+                    self.patient_id = match.group(1)
+            return
 
         # Parse column header
         if line.startswith('#CHROM'):
-            cols = line.lstrip('#').split('\t')
-            if len(cols) > 8:
-                # Sample name is usually the last column
-                patient_id = cols[-1] if cols[-1] not in ['FORMAT', 'SAMPLE'] else patient_id
-            continue
+            self.on_column_header(line.lstrip('#').split('\t'))
+            return
 
         # Parse variant lines
         if not line.startswith('#'):
-            parts = line.split('\t')
-            if len(parts) < 5:
-                continue
+            # Reject non-PGx records on the CHROM/POS/ID prefix before the full split
+            head = line.split('\t', 3)
+            if len(head) < 4 or '\t' not in head[3]:
+                return
+            self.total_variants += 1
+            if self.pgx_only and not is_pgx_candidate(*head, self.kb):
+                return
 
+            parts = line.split('\t')
             chrom = parts[0]
             pos = int(parts[1]) if parts[1].isdigit() else 0
             rsid = parts[2] if parts[2] != '.' else f"pos_{pos}"
             ref = parts[3]
             alt = parts[4]
 
+            # Fall back to coordinates when the ID column is missing or unrecognised
+            if rsid.lower() not in self.kb.variant_star_alleles:
+                rsid = locus_rsid(chrom, pos, ref, alt, self.kb) or rsid
+
             # Extract gene from INFO field
             gene = None
             star_allele = None
@@ -92,133 +192,146 @@ def parse_vcf(content: str) -> Dict:
                 star_allele=star_allele,
                 genotype=genotype
             )
-            variants.append(variant)
+            self.add_variant(variant, parts)
 
-    return {
-        "patient_id": patient_id,
-        "total_variants": len(variants),
-        "variants": variants,
-        "metadata": metadata,
-        "parse_success": len(variants) > 0
-    }
+    def on_column_header(self, cols: List[str]) -> None:
+        if len(cols) > 9:
+            # Genotypes are read from the first sample column, so it names the patient
+            self.patient_id = cols[9] if cols[9] not in ['FORMAT', 'SAMPLE'] else self.patient_id
 
+    def add_variant(self, variant: VCFVariant, parts: List[str]) -> None:
+        self.variants.append(variant)
 
-def extract_pharmacogenomic_variants(parsed_vcf: Dict, target_gene: str) -> List[Dict]:
+        hit = pgx_hit(variant, self.kb)
+        if hit is not None:
+            self.pgx_variants.setdefault(hit["gene"], {}).setdefault(variant.rsid.lower(), hit)
+
+
+def parse_vcf(content: str, pgx_only: bool = True) -> Dict:
+    """
+    Parse VCF file content and extract pharmacogenomic variants.
+    Returns structured data with variants, patient ID, and metadata.
+    With pgx_only=False every record is kept in "variants", not just the PGx candidates.
     """
-    Filter VCF variants to only those relevant to the target gene.
-    Cross-references with known pharmacogenomic rsIDs.
+    parser = VCFStreamParser(pgx_only)
+    for line in io.StringIO(content):
+        parser.parse_line(line)
+    return parser.result()
+
+
+def pgx_hit(v: VCFVariant, kb: Optional[KnowledgeBase] = None) -> Optional[Dict]:
     """
-    from cpic_rules import VARIANT_STAR_ALLELES
+    Resolve a parsed variant to a pharmacogenomic hit, or None if it is not one.
+    Known rsIDs take precedence over the INFO GENE= annotation.
+    """
+    # CRITICAL FIX: skip if genotype is homozygous reference (0/0) or missing
+    # We only care about variants that are actually present
+    if v.genotype in NON_CARRIER_GENOTYPES:
+        return None
+
+    # Check by rsID in known database
+    info = (kb or current_kb()).variant_star_alleles.get(v.rsid.lower())
+    if info is not None:
+        return {
+            "rsid": v.rsid,
+            "chromosome": v.chrom,
+            "position": v.pos,
+            "ref_allele": v.ref,
+            "alt_allele": v.alt,
+            "gene": info["gene"],
+            "star_allele": info["star_allele"],
+            "function_status": info["function"],
+            "activity_score": info.get("activity_score", 0), # Default to 0 if not found for PGx variants
+            "genotype": v.genotype or "unknown"
+        }
+    # Also check by gene annotation in VCF
+    if v.gene and v.rsid != f"pos_{v.pos}":
+        return {
+            "rsid": v.rsid,
+            "chromosome": v.chrom,
+            "position": v.pos,
+            "ref_allele": v.ref,
+            "alt_allele": v.alt,
+            "gene": v.gene,
+            "star_allele": v.star_allele or "unknown",
+            "function_status": "unknown",
+            "activity_score": 0,
+            "genotype": v.genotype or "unknown"
+        }
+    return None
+
 
-    variants = parsed_vcf.get("variants", [])
-    pgx_variants = []
+def extract_pharmacogenomic_variants(parsed_vcf: Dict, target_gene: str) -> List[Dict]:
+    """
+    Return the VCF variants relevant to the target gene.
+    The per-gene index is built while parsing, so this is a dict lookup.
+    """
+    return list(parsed_vcf["pgx_variants"].get(target_gene, ()))
 
-    seen_rsids = set()
-    unique_pgx_variants = []
 
+def _allele_copies(variants: List[Dict], gene: str, kb: Optional[KnowledgeBase] = None) -> List[Tuple]:
+    """
+    One allele copy per variant (two if homozygous alt) as (activity, allele
+    index, name), ranked so that the order of the VCF does not matter.
+    """
+    table = diplotype_table(gene, kb)
+    index, names, scores, unknown = table["index"], table["names"], table["scores"], table["unknown"]
+    copies = []
     for v in variants:
-        rsid_lower = v.rsid.lower()
-        if rsid_lower in seen_rsids:
-            continue
-            
-        # CRITICAL FIX: skip if genotype is homozygous reference (0/0) or missing
-        # We only care about variants that are actually present
-        if v.genotype in ["0/0", "0|0", "./.", ".|.", ".", None]:
-            continue
-
-        # Check by rsID in known database
-        if rsid_lower in VARIANT_STAR_ALLELES:
-            info = VARIANT_STAR_ALLELES[rsid_lower]
-            if info["gene"] == target_gene:
-                seen_rsids.add(rsid_lower)
-                unique_pgx_variants.append({
-                    "rsid": v.rsid,
-                    "chromosome": v.chrom,
-                    "position": v.pos,
-                    "ref_allele": v.ref,
-                    "alt_allele": v.alt,
-                    "gene": info["gene"],
-                    "star_allele": info["star_allele"],
-                    "function_status": info["function"],
-                    "activity_score": info.get("activity_score", 0), # Default to 0 if not found for PGx variants
-                    "genotype": v.genotype or "unknown"
-                })
-        # Also check by gene annotation in VCF
-        elif v.gene == target_gene and v.rsid != f"pos_{v.pos}":
-            seen_rsids.add(rsid_lower)
-            unique_pgx_variants.append({
-                "rsid": v.rsid,
-                "chromosome": v.chrom,
-                "position": v.pos,
-                "ref_allele": v.ref,
-                "alt_allele": v.alt,
-                "gene": target_gene,
-                "star_allele": v.star_allele or "unknown",
-                "function_status": "unknown",
-                "activity_score": 0,
-                "genotype": v.genotype or "unknown"
-            })
-
-    return unique_pgx_variants
-
-
-def determine_phenotype(variants: List[Dict], gene: str) -> str:
-    """
-    Determine phenotype (PM/IM/NM/RM/URM) based on detected variants.
-    Uses diplotype logic based on CPIC guidelines.
+        i = index.get(v["rsid"].lower(), unknown)
+        copy = (scores[i], i, names[i] if i != unknown else v.get("star_allele") or UNKNOWN_ALLELE)
+        copies.append(copy)
+        if v.get("genotype") in HOMOZYGOUS_ALT_GENOTYPES:
+            copies.append(copy)
+    copies.sort()
+    return copies
+
+
+def call_diplotype(variants: List[Dict], gene: str, kb: Optional[KnowledgeBase] = None) -> Tuple[int, int, str]:
     """
-    if not variants:
-        return "NM"  # Default: Normal Metabolizer if no variants found
-
-    # Activity Score Logic (CPIC Standard)
-    # Default alleles: *1/*1 (Score 1.0 + 1.0 = 2.0)
-    allele_scores = [1.0, 1.0] 
-
-    if len(variants) == 1:
-        # One variant detected.
-        v = variants[0]
-        score = v.get("activity_score", 1.0) # Default to 1 if unknown, but usually 0 for variants in our list
-        
-        # Check zygosity
-        gt = v.get("genotype", "")
-        if gt in ["1/1", "1|1"]:
-            # Homozygous for the variant: *Var/*Var
-            allele_scores = [score, score]
-        else:
-            # Heterozygous: *1/*Var
-            allele_scores = [1.0, score]
-
-    elif len(variants) >= 2:
-        # Two or more variants. 
-        # Simplified: Take the top 2 impacted alleles (lowest scores) to be conservative, 
-        # or assume compound heterozygosity for the first two found.
-        # Strict logic: *A/*B
-        v1 = variants[0]
-        v2 = variants[1]
-        score1 = v1.get("activity_score", 1.0)
-        score2 = v2.get("activity_score", 1.0)
-        allele_scores = [score1, score2]
-
-    total_activity_score = sum(allele_scores)
-
-    # Phenotype Mapping based on Total Activity Score
-    # >= 1.5 -> NM (Normal Metabolizer)
-    # 1.0   -> IM (Intermediate Metabolizer)
-    # <= 0.5 -> PM (Poor Metabolizer)
-    
-    if total_activity_score >= 1.5:
-        return "NM"
-    elif total_activity_score >= 1.0:
-        return "IM"
-    else:
-        return "PM"
-
-
-def get_diplotype(variants: List[Dict]) -> str:
+    Call a diplotype from detected variants as two indices into the gene's
+    diplotype table, plus its star-allele name.
+
+    Each variant contributes one allele copy (two if homozygous alt); the two
+    lowest-activity copies form the diplotype, padded with *1. Copies are ranked
+    by (activity, allele index, name), so the call does not depend on VCF order.
+    Any further copies are left out of the call (see diplotype_note).
+    """
+    copies = _allele_copies(variants, gene, kb)
+    if not copies:
+        return 0, 0, f"{REFERENCE_ALLELE}/{REFERENCE_ALLELE}"
+    if len(copies) == 1:
+        # Single carriers read *Var/*1
+        _, a, name_a = copies[0]
+        return a, 0, f"{name_a}/{REFERENCE_ALLELE}"
+    (_, a, name_a), (_, b, name_b) = sorted(copies[:2], key=lambda c: star_order(c[2]))
+    return a, b, f"{name_a}/{name_b}"
+
+
+def diplotype_note(variants: List[Dict], gene: str, kb: Optional[KnowledgeBase] = None) -> Optional[str]:
+    """
+    None, or a note naming the detected alleles the diplotype leaves out
+    when more than two allele copies are called (e.g. *4 homozygous plus *3).
+    """
+    copies = _allele_copies(variants, gene, kb)
+    if len(copies) <= 2:
+        return None
+    left_out = ", ".join(name for _, _, name in copies[2:])
+    return (f"{len(copies)} variant allele copies detected; the diplotype keeps the two with the lowest "
+            f"activity and leaves out {left_out}")
+
+
+def determine_phenotype(variants: List[Dict], gene: str, kb: Optional[KnowledgeBase] = None) -> str:
+    """
+    Determine phenotype (PM/IM/NM) based on detected variants.
+    The called diplotype is one lookup in the gene's precomputed CPIC activity-score table.
+    """
+    a, b, _ = call_diplotype(variants, gene, kb)
+    return diplotype_table(gene, kb)["phenotype"][a][b]
+
+
+def get_diplotype(variants: List[Dict], gene: Optional[str] = None, kb: Optional[KnowledgeBase] = None) -> str:
     """Build diplotype string from detected variants."""
     if not variants:
         return "*1/*1"
-    star_alleles = [v.get("star_allele", "*1") for v in variants[:2]]
-    if len(star_alleles) == 1:
-        star_alleles.append("*1")
-    return f"{star_alleles[0]}/{star_alleles[1]}"
+    return call_diplotype(variants, gene or variants[0]["gene"], kb)[2]
@@ -77,6 +77,9 @@ function ResultCard({ result, index }) {
           </div>
         ))}
       </div>
+      {profile?.diplotype_note && (
+        <p className="text-xs" style={{ color: 'var(--text-secondary)' }}>{profile.diplotype_note}</p>
+      )}
 
       {/* Recommendation */}
       <div className="rounded-xl p-5" style={{ background: 'rgba(0,0,0,0.05)', border: '1px solid var(--glass-border)' }}>